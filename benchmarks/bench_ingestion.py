@@ -0,0 +1,109 @@
+"""
+Пропускная способность и задержка приема обновлений в режимах polling и webhook.
+
+Бот запускается целиком (main.build_application) против локального поддельного
+Telegram, который отдает обновления со спамом через getUpdates или POST на webhook.
+Задержка - время от отправки обновления до вызова deleteMessage ботом.
+С --shards N сообщения проверяются в N процессах-обработчиках (SHARD_WORKERS).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_ingestion --mode webhook --updates 2000 --rate 500
+    python -m benchmarks.bench_ingestion --shards 4 --updates 5000
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import logging
+
+# Кэш OCR на диске для замеров не нужен
+os.environ.setdefault("OCR_CACHE_FILE", "")
+
+from benchmarks.fake_telegram import FakeTelegram, make_text_update
+from benchmarks.stats import percentiles
+
+
+async def run(mode, updates, rate, port, seed):
+    from main import build_application, ALLOWED_UPDATES
+    from handlers.message_handlers import text_phrase_manager
+    from utils.shards import shard_router
+
+    rng = random.Random(seed)
+    phrases = text_phrase_manager.get_phrases()
+    if not phrases:
+        sys.exit("Список запрещенных фраз пуст, замерять нечего")
+
+    fake = FakeTelegram().start()
+    application = build_application(token=fake.token, base_url=fake.base_url,
+                                    base_file_url=fake.base_file_url)
+    secret = "bench-secret"
+    async with application:
+        await application.start()
+        if mode == "webhook":
+            await application.updater.start_webhook(
+                listen="127.0.0.1", port=port, url_path="webhook",
+                webhook_url=f"http://127.0.0.1:{port}/webhook",
+                secret_token=secret, allowed_updates=ALLOWED_UPDATES,
+            )
+            # Запрос с чужим секретом сервер должен отклонить
+            wrong_status = await asyncio.to_thread(
+                fake.post_raw, make_text_update(-1, 1, 2, "x"), "wrong-secret")
+        else:
+            await application.updater.start_polling(
+                poll_interval=0, timeout=1, allowed_updates=ALLOWED_UPDATES)
+        if shard_router.enabled:
+            # post_init вызывается только в run_polling/run_webhook, здесь обработчики запускаются явно
+            shard_router.start()
+            while not shard_router.ready:
+                await asyncio.sleep(0.1)
+
+        started = time.perf_counter()
+        for i in range(updates):
+            # Разные пользователи и чаты, чтобы каждое сообщение проходило весь путь с баном
+            text = f"{rng.choice(['Привет', 'Всем добрый день', 'Внимание'])}! {rng.choice(phrases)}"
+            fake.push_update(make_text_update(-100 - i % 50, i + 1, 10000 + i, text))
+            if rate:
+                delay = started + (i + 1) / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        deleted = await asyncio.to_thread(fake.wait_for_deletions, updates, 120)
+        elapsed = time.perf_counter() - started
+
+        await application.updater.stop()
+        await application.stop()
+        await shard_router.stop()
+    fake.stop()
+
+    latencies = fake.latencies()
+    print(f"Режим: {mode}, обработчиков: {shard_router.workers or 'без разделения'}, обновлений: {updates}, "
+          f"заданная частота: {rate or 'максимальная'}/с")
+    print(f"Обработано: {deleted} за {elapsed:.2f} с ({deleted / elapsed:.0f} обновлений/с)")
+    if latencies:
+        p50, p95, p99 = percentiles(latencies, (50, 95, 99))
+        print(f"Задержка: p50 {p50 * 1000:.1f} мс, p95 {p95 * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс")
+    if mode == "webhook":
+        print(f"Запрос с неверным секретом: HTTP {wrong_status} (ожидается 403)")
+        errors = [status for status in fake.webhook_statuses if status != 200]
+        if errors:
+            print(f"Ошибочных ответов webhook: {len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=0, help="обновлений в секунду (0 - без ограничения)")
+    parser.add_argument("--port", type=int, default=8787, help="порт webhook-сервера бота")
+    parser.add_argument("--shards", type=int, default=0, help="процессов-обработчиков (0 - один процесс)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    os.environ["SHARD_WORKERS"] = str(args.shards)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args.mode, args.updates, args.rate, args.port, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Качество и скорость поиска измененных копий спама (MinHash + LSH).
+
+Индекс заполняется исходными спам-сообщениями, затем проверяются:
+измененные копии (доля найденных), обычные сообщения чата (доля ложных срабатываний)
+и время одной проверки при заполненном индексе.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_near_duplicates --legit 20000 --edits 3
+"""
+import argparse
+import random
+import time
+
+from utils.near_duplicates import NearDuplicateIndex, NEAR_DUP_MIN_LENGTH
+from benchmarks.stats import percentiles
+from benchmarks.corpus import SPAM_TEMPLATES, make_message, fill_template, mutate
+
+
+def run(legit_count, variants, edits, index_size, seed):
+    rng = random.Random(seed)
+    index = NearDuplicateIndex(threshold=0.0, max_size=index_size, ttl=float("inf"), enabled=True)
+
+    # Удаленный спам: по несколько копий каждого шаблона, остальное место - другие тексты
+    originals = [fill_template(rng, template) for template in SPAM_TEMPLATES for _ in range(3)]
+    for text in originals:
+        index.add(text, chat_id=1)
+    while len(index) < index_size:
+        index.add(make_message(rng, rng.randint(10, 40)), chat_id=2)
+
+    spam = [mutate(rng, fill_template(rng, rng.choice(SPAM_TEMPLATES)), edits) for _ in range(variants)]
+    legit = [make_message(rng, rng.randint(3, 40)) for _ in range(legit_count)]
+
+    # Порог 0: запоминаем лучшее сходство, доли считаем для разных порогов
+    spam_scores = []
+    for text in spam:
+        found = index.find(text, chat_id=3)
+        spam_scores.append(found.similarity if found else 0.0)
+
+    legit_scores = []
+    timings = []
+    for text in legit:
+        started = time.perf_counter()
+        found = index.find(text, chat_id=3)
+        timings.append(time.perf_counter() - started)
+        legit_scores.append(found.similarity if found else 0.0)
+
+    # Обычные сообщения сравниваются только с удаленным спамом (а не с заполнителем индекса)
+    spam_index = NearDuplicateIndex(threshold=0.0, max_size=index_size, ttl=float("inf"), enabled=True)
+    for text in originals:
+        spam_index.add(text, chat_id=1)
+    legit_vs_spam = []
+    for text in legit:
+        found = spam_index.find(text, chat_id=3)
+        legit_vs_spam.append(found.similarity if found else 0.0)
+
+    long_legit = sum(len(text) >= NEAR_DUP_MIN_LENGTH for text in legit)
+    print(f"Отпечатков в индексе: {len(index)}, копий спама: {variants} (изменений: {edits}), "
+          f"обычных сообщений: {legit_count} (длиннее {NEAR_DUP_MIN_LENGTH} символов: {long_legit})")
+    p50, p95, p99 = percentiles(timings, (50, 95, 99))
+    print(f"Проверка одного сообщения: p50 {p50 * 1e6:.0f} мкс, p95 {p95 * 1e6:.0f} мкс, "
+          f"p99 {p99 * 1e6:.0f} мкс")
+    print("Порог  найдено копий  ложные (спам)  ложные (весь индекс)")
+    for threshold in (0.4, 0.5, 0.6, 0.7, 0.8):
+        recall = sum(score >= threshold for score in spam_scores) / len(spam_scores)
+        false_spam = sum(score >= threshold for score in legit_vs_spam) / len(legit)
+        false_all = sum(score >= threshold for score in legit_scores) / len(legit)
+        print(f"{threshold:5.1f}  {recall:13.1%}  {false_spam:13.3%}  {false_all:20.3%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--legit", type=int, default=20000, help="обычных сообщений")
+    parser.add_argument("--variants", type=int, default=2000, help="измененных копий спама")
+    parser.add_argument("--edits", type=int, default=3, help="изменений в одной копии")
+    parser.add_argument("--index-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    run(args.legit, args.variants, args.edits, args.index_size, args.seed)
+
+
+if __name__ == "__main__":
+    main()
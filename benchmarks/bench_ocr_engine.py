@@ -0,0 +1,86 @@
+"""
+Движки OCR на одних и тех же картинках: pytesseract (процесс tesseract на каждую
+картинку) против tesserocr (libtesseract внутри процесса, модели загружены заранее).
+
+Обе ветки проходят через utils.ocr._recognize - тот же код, что в процессах пула:
+декодирование и предобработка, затем движок, затем сборка строк. Замеряется
+запуск движка (загрузка моделей), время tesseract на картинку и доля слов
+исходного текста, найденных в распознанном (чтобы убедиться, что движки равноценны).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_ocr_engine --images 50
+"""
+import re
+import time
+import random
+import argparse
+
+from utils import ocr
+from utils.ocr_engine import create_engine, ENGINE_PYTESSERACT, ENGINE_TESSEROCR
+from benchmarks.stats import percentiles
+from benchmarks.corpus import SPAM_TEMPLATES, fill_template, make_spam_image
+
+WORD_RE = re.compile(r"\w+")
+
+
+def words(text):
+    return set(WORD_RE.findall(text.lower()))
+
+
+def run(engine_name, samples, lang, timeout):
+    started = time.perf_counter()
+    try:
+        engine = create_engine(engine_name, lang, ocr.TESSERACT_PATH, strict=True)
+    except (ImportError, RuntimeError) as e:
+        print(f"{engine_name:<12} недоступен: {e}")
+        return
+    startup = time.perf_counter() - started
+    ocr._engine = engine
+    try:
+        tesseract_times = []
+        totals = []
+        found = 0
+        expected = 0
+        for text, data in samples:
+            started = time.perf_counter()
+            result = ocr._recognize(data, lang, timeout)
+            totals.append(time.perf_counter() - started)
+            tesseract_times.append(result.tesseract_time)
+            source = words(text)
+            found += len(source & words(result.text))
+            expected += len(source)
+    finally:
+        ocr._engine = None
+        engine.close()
+
+    p50, p95 = percentiles(tesseract_times, (50, 95))
+    total_p50, = percentiles(totals, (50,))
+    print(f"{engine_name:<12} {startup * 1000:9.0f} {p50 * 1000:9.1f} {p95 * 1000:9.1f} "
+          f"{total_p50 * 1000:10.1f} {len(samples) / sum(totals):8.1f} {found / max(expected, 1):8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--side", type=int, default=1280, help="длинная сторона картинки")
+    parser.add_argument("--engines", nargs="+", default=[ENGINE_PYTESSERACT, ENGINE_TESSEROCR])
+    parser.add_argument("--lang", default=ocr.OCR_LANG)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    size = (args.side, args.side * 9 // 16)
+    samples = []
+    for _ in range(args.images):
+        text = fill_template(rng, rng.choice(SPAM_TEMPLATES))
+        samples.append((text, make_spam_image(rng, text, size)))
+
+    print(f"{args.images} картинок {size[0]}x{size[1]}, языки {args.lang}, один процесс")
+    print(f"{'движок':<12} {'запуск, мс':>9} {'p50, мс':>9} {'p95, мс':>9} {'всего p50':>10} "
+          f"{'карт/с':>8} {'слов':>8}")
+    for name in args.engines:
+        run(name, samples, args.lang, ocr.OCR_TIMEOUT)
+
+
+if __name__ == "__main__":
+    main()
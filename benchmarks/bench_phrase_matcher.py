@@ -0,0 +1,104 @@
+"""
+Сравнение скорости проверки текста: старый цикл по фразам против автомата Ахо-Корасик.
+Отдельно замеряется стоимость нормализации текста (двойники букв, невидимые символы).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_phrase_matcher --phrases 2000 --messages 5000
+"""
+import argparse
+import random
+import time
+
+from utils.matcher import PhraseMatcher
+from utils.normalization import normalize_text
+
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz"
+
+
+def random_word(rng):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(3, 9)))
+
+
+def make_corpus(rng, phrases_count, messages_count, message_words, hit_rate):
+    """Синтетический набор фраз и сообщений, часть сообщений содержит фразу"""
+    phrases = [" ".join(random_word(rng) for _ in range(rng.randint(1, 5)))
+               for _ in range(phrases_count)]
+    messages = []
+    for _ in range(messages_count):
+        words = [random_word(rng) for _ in range(message_words)]
+        if rng.random() < hit_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(phrases).upper())
+        messages.append(" ".join(words))
+    return phrases, messages
+
+
+def legacy_check(phrases, text):
+    """Проверка в том виде, в каком она была в handle_message"""
+    text_lower = text.lower()
+    for phrase in phrases.copy():
+        if phrase.lower() in text_lower:
+            return True
+    return False
+
+
+def lower_text(text):
+    """Только нижний регистр, как в старой проверке"""
+    return text.strip().lower()
+
+
+def run(phrases_count, messages_count, message_words, hit_rate, seed):
+    rng = random.Random(seed)
+    phrases, messages = make_corpus(rng, phrases_count, messages_count, message_words, hit_rate)
+
+    started = time.perf_counter()
+    # Алгоритмы сравниваются на одинаковом приведении текста (только регистр)
+    matcher = PhraseMatcher(phrases, normalizer=lower_text)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    legacy_hits = sum(legacy_check(phrases, text) for text in messages)
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matcher_hits = sum(matcher.search(text) is not None for text in messages)
+    matcher_time = time.perf_counter() - started
+
+    normalized = PhraseMatcher(phrases)
+    started = time.perf_counter()
+    normalized_hits = sum(normalized.search(text) is not None for text in messages)
+    normalized_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for text in messages:
+        normalize_text(text)
+    normalize_time = time.perf_counter() - started
+
+    print(f"Фраз: {phrases_count}, сообщений: {messages_count}, слов в сообщении: {message_words}")
+    print(f"Построение автомата: {build_time * 1000:.1f} мс")
+    print(f"Старый цикл:   {legacy_time * 1000:.1f} мс, "
+          f"{legacy_time / messages_count * 1e6:.1f} мкс/сообщение, срабатываний: {legacy_hits}")
+    print(f"Ахо-Корасик:   {matcher_time * 1000:.1f} мс, "
+          f"{matcher_time / messages_count * 1e6:.1f} мкс/сообщение, срабатываний: {matcher_hits}")
+    print(f"С нормализацией: {normalized_time * 1000:.1f} мс, "
+          f"{normalized_time / messages_count * 1e6:.1f} мкс/сообщение "
+          f"(из них нормализация {normalize_time / messages_count * 1e6:.1f} мкс), "
+          f"срабатываний: {normalized_hits}")
+    if matcher_time:
+        print(f"Ускорение: x{legacy_time / matcher_time:.1f}")
+    if legacy_hits != matcher_hits:
+        print("ВНИМАНИЕ: результаты проверок не совпадают")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--phrases", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=40, help="слов в одном сообщении")
+    parser.add_argument("--hit-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    run(args.phrases, args.messages, args.words, args.hit_rate, args.seed)
+
+
+if __name__ == "__main__":
+    main()
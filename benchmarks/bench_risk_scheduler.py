@@ -0,0 +1,93 @@
+"""
+Очередь OCR во время спам-волны: обычная очередь (FIFO) против очереди по оценке риска.
+
+Картинки приходят быстрее, чем их успевают распознать: небольшая доля - от новичков
+(высокий риск), остальные - от постоянных участников. Распознавание имитируется
+паузой, поэтому замер показывает только работу планировщика: сколько ждут
+картинки с высоким риском и сколько обычных картинок не дождались OCR.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_risk_scheduler --images 2000 --rate 40 --workers 2
+"""
+import time
+import random
+import asyncio
+import argparse
+
+from utils.risk import PrioritySlots
+from benchmarks.stats import percentiles
+
+
+class FifoSlots:
+    """Обычный семафор с тем же интерфейсом, что и PrioritySlots"""
+
+    def __init__(self, capacity):
+        self._semaphore = asyncio.Semaphore(capacity)
+
+    async def acquire(self, priority=0.0):
+        await self._semaphore.acquire()
+
+    def release(self):
+        self._semaphore.release()
+
+
+async def run(make_slots, images, rate, high_share, ocr_time, timeout, seed):
+    # Семафор создается внутри цикла событий (в Python 3.9 он привязывается к циклу)
+    slots = make_slots()
+    rng = random.Random(seed)
+    waits = {'high': [], 'low': []}
+    expired = {'high': 0, 'low': 0}
+
+    async def process(kind, priority):
+        queued = time.perf_counter()
+        try:
+            await asyncio.wait_for(slots.acquire(priority), timeout)
+        except asyncio.TimeoutError:
+            expired[kind] += 1
+            return
+        waits[kind].append(time.perf_counter() - queued)
+        try:
+            await asyncio.sleep(rng.expovariate(1 / ocr_time))
+        finally:
+            slots.release()
+
+    tasks = []
+    started = time.perf_counter()
+    for i in range(images):
+        if rng.random() < high_share:
+            tasks.append(asyncio.ensure_future(process('high', rng.uniform(0.5, 1.0))))
+        else:
+            tasks.append(asyncio.ensure_future(process('low', rng.uniform(0.0, 0.2))))
+        delay = started + (i + 1) / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await asyncio.gather(*tasks)
+    return waits, expired
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=40, help="картинок в секунду")
+    parser.add_argument("--workers", type=int, default=2, help="одновременных распознаваний")
+    parser.add_argument("--ocr-time", type=float, default=0.06, help="среднее время OCR, секунд")
+    parser.add_argument("--high-share", type=float, default=0.1, help="доля картинок от новичков")
+    parser.add_argument("--timeout", type=float, default=10, help="сколько картинка ждет OCR, секунд")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.images} картинок, {args.rate:.0f}/с, OCR {args.workers} x {args.ocr_time * 1000:.0f} мс "
+          f"(нагрузка {args.rate * args.ocr_time / args.workers:.0%})")
+    print(f"{'очередь':<10} {'риск':<8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'не дождались':>13}")
+    for title, make_slots in (("FIFO", FifoSlots), ("по риску", PrioritySlots)):
+        waits, expired = asyncio.run(run(lambda: make_slots(args.workers), args.images, args.rate, args.high_share,
+                                         args.ocr_time, args.timeout, args.seed))
+        for kind in ('high', 'low'):
+            values = waits[kind] or [0.0]
+            p50, p95, p99 = percentiles(values, (50, 95, 99))
+            print(f"{title:<10} {kind:<8} {p50 * 1000:9.1f} {p95 * 1000:9.1f} {p99 * 1000:9.1f} "
+                  f"{expired[kind]:>13}")
+
+
+if __name__ == "__main__":
+    main()
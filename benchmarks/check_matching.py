@@ -0,0 +1,63 @@
+"""
+Проверка поиска запрещенных фраз на известных случаях ложных срабатываний и пропусков.
+
+Каждый случай - фраза (или правило для картинок), текст и ожидаемый результат.
+Скрипт печатает несовпадения и завершается с кодом 1, если они есть.
+
+Запуск из корня проекта:
+    python -m benchmarks.check_matching
+"""
+import sys
+
+from utils.matcher import PhraseMatcher
+from utils.image_rules import ImageRuleIndex
+
+# (фраза, текст сообщения, должна ли фраза найтись)
+TEXT_CASES = [
+    ("t.me/", "Вот меню на сегодня", False),
+    ("t.me/", "Подписывайтесь: t.me/free_money", True),
+    ("bit.ly", "habit lyrics", False),
+    ("bit.ly", "Жми bit.ly/abc", True),
+    ("казино", "Лучшее кaзинo города", True),
+    ("казино", "Лучшее К-А-З-И-Н-О", False),
+    ("купи слона", "Купи, слона!", True),
+    ("заработок", "Зааааработок без вложений", True),
+    # Обычный английский текст не превращается в кириллицу: только настоящие двойники букв
+    ("вот", "Telegram bot for chats", False),
+    ("топ", "A ton of work today", False),
+    ("касса", "Оплата через kacca", True),
+]
+
+# (правило для картинок, распознанный текст, должно ли правило сработать)
+IMAGE_CASES = [
+    ("t.me", "Meeting at the office", False),
+    ("t.me", "Join t.me/channel", True),
+    ("в/у права", "Права в автошколе у дома", False),
+    ("в/у права", "Купить в/у права недорого", True),
+    ("в у права", "Купить в у права", True),
+    ("казино бонус", "БОНУС в нашем КАЗИНО", True),
+    ("=бонус", "бонусы", False),
+    ("=бонус", "бонус!", True),
+]
+
+
+def main():
+    failures = []
+    for phrase, text, expected in TEXT_CASES:
+        found = PhraseMatcher([phrase]).search(text) is not None
+        if found != expected:
+            failures.append(f"текст:    {phrase!r} в {text!r}: {found}, ожидалось {expected}")
+    for rule, text, expected in IMAGE_CASES:
+        found = ImageRuleIndex([rule]).search(text) is not None
+        if found != expected:
+            failures.append(f"картинка: {rule!r} в {text!r}: {found}, ожидалось {expected}")
+
+    for failure in failures:
+        print(failure)
+    total = len(TEXT_CASES) + len(IMAGE_CASES)
+    print(f"Проверено случаев: {total}, ошибок: {len(failures)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
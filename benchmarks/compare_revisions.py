@@ -0,0 +1,97 @@
+"""
+Сравнение двух ревизий git на одном и том же потоке обновлений.
+
+Каждая ревизия выгружается во временный git worktree, туда копируется текущая
+версия benchmarks/ (чтобы замер был одинаковым), и запускается benchmarks.replay.
+config.py берется из текущей папки проекта. Параметры после "--" передаются в replay.
+
+Запуск из корня проекта:
+    python -m benchmarks.compare_revisions HEAD~3 HEAD -- --updates 3000 --rate 300
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (название, функция получения значения, больше - лучше)
+METRICS = [
+    ("обновлений/с", lambda r: r['throughput'], True),
+    ("задержка p50, мс", lambda r: r['latency']['all']['p50'] * 1000, False),
+    ("задержка p95, мс", lambda r: r['latency']['all']['p95'] * 1000, False),
+    ("задержка p99, мс", lambda r: r['latency']['all']['p99'] * 1000, False),
+    ("спам p95, мс", lambda r: (r['latency']['spam'] or {}).get('p95', 0) * 1000, False),
+    ("картинки p95, мс", lambda r: (r['latency']['image'] or {}).get('p95', 0) * 1000, False),
+    ("удалено сообщений", lambda r: r['deleted'], True),
+    ("память бота, МБ", lambda r: r['peak_rss_mb'], False),
+    ("память OCR, МБ", lambda r: r['children_peak_rss_mb'], False),
+]
+
+
+def run_revision(revision, replay_args, repeat):
+    """Прогоняет replay на ревизии repeat раз, возвращает список результатов"""
+    worktree = tempfile.mkdtemp(prefix="bench_")
+    os.rmdir(worktree)
+    subprocess.run(["git", "worktree", "add", "--detach", worktree, revision], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL)
+    try:
+        shutil.copytree(os.path.join(ROOT, "benchmarks"), os.path.join(worktree, "benchmarks"),
+                        dirs_exist_ok=True, ignore=shutil.ignore_patterns("__pycache__"))
+        env = dict(os.environ)
+        # Код ревизии важнее, config.py (его нет в git) - из текущей папки проекта
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [worktree, ROOT, env.get("PYTHONPATH")]))
+        results = []
+        for attempt in range(repeat):
+            output = os.path.join(worktree, f"result_{attempt}.json")
+            print(f"=== {revision}, прогон {attempt + 1} из {repeat}")
+            completed = subprocess.run([sys.executable, "-m", "benchmarks.replay", "--json", output]
+                                       + replay_args, cwd=worktree, env=env)
+            if not os.path.exists(output):
+                sys.exit(f"Прогон ревизии {revision} завершился с ошибкой (код {completed.returncode})")
+            with open(output, encoding="utf-8") as f:
+                results.append(json.load(f))
+        return results
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base", help="исходная ревизия")
+    parser.add_argument("target", help="ревизия с изменениями")
+    parser.add_argument("--repeat", type=int, default=3, help="прогонов на ревизию (берется медиана)")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="ухудшение больше этого (в процентах) отмечается как регрессия")
+    argv = sys.argv[1:]
+    replay_args = []
+    if "--" in argv:
+        index = argv.index("--")
+        argv, replay_args = argv[:index], argv[index + 1:]
+    args = parser.parse_args(argv)
+
+    base = run_revision(args.base, replay_args, args.repeat)
+    target = run_revision(args.target, replay_args, args.repeat)
+
+    print(f"\n{'':<20} {args.base:>12} {args.target:>12} {'изменение':>10}")
+    regressions = 0
+    for title, get, higher_is_better in METRICS:
+        before = statistics.median(get(result) for result in base)
+        after = statistics.median(get(result) for result in target)
+        change = (after - before) / before * 100 if before else 0.0
+        worse = -change if higher_is_better else change
+        mark = ""
+        if worse > args.threshold:
+            mark = "  <- регрессия"
+            regressions += 1
+        print(f"{title:<20} {before:12.1f} {after:12.1f} {change:+9.1f}%{mark}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
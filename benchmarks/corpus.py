@@ -0,0 +1,194 @@
+"""
+Синтетические данные для бенчмарков: обычные сообщения чата, спам-рассылки
+с изменениями от копии к копии и картинки со спам-текстом.
+"""
+import io
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# Шаблоны рассылок; {n} - число, {w} - слово, которое меняется от копии к копии
+SPAM_TEMPLATES = [
+    "Ищем адекватных людей в команду, не школьники. Доход от {n}$ в день, всё с телефона. Пишите в лс {w}",
+    "Срочно нужны {n} человека на удалённую деятельность, пару часов в день, оплата каждый день. Подробности в личке",
+    "Банк запускает единоразовую выплату {n} рублей для клиентов, успейте оформить по ссылке {w}",
+    "Требуются несколько активных людей для онлайн-проектов, опыт не нужен, обучение бесплатно, от {n} в неделю",
+    "Пассивная занятость, требуются люди от 18 лет, доход от {n} рублей, пишите плюс в личные сообщения {w}",
+    "Я участвую в конкурсе моделей и мне очень нужна твоя поддержка, проголосуй пожалуйста по ссылке {w}",
+    "Делаем водительские права любых категорий без экзаменов, быстро и надежно, цена {n}, пишите {w}",
+    "Реальный доход онлайн на криптовалюте, стабильно от {n}$ в день, набор в команду ограничен",
+    "Проводится набор в новое онлайн-направление, ищем ответственных людей, выплаты {n} каждый день {w}",
+    "Горячие встречи, от которых перехватывает дыхание, вип чатик только для своих, заходи {w}",
+]
+
+# Частые слова обычной переписки в чатах, отсортированы примерно по частоте
+VOCABULARY = (
+    "и в не на я что с а как это по все он у так но да мы к вы же то ты за есть из "
+    "было бы еще уже только или нет если когда кто можно ну вот там тут чем сегодня завтра "
+    "всем привет спасибо пожалуйста подскажите кто знает где купить сколько стоит "
+    "работа дом машина ребенок школа магазин аптека врач ремонт квартира сосед двор "
+    "вечером утром днем сейчас потом опять снова очень хорошо плохо нормально быстро "
+    "вопрос ответ помощь совет номер телефон адрес улица автобус остановка парковка "
+    "вода свет газ интернет оплата деньги рублей цена продам куплю отдам бесплатно "
+    "собрание жильцов управляющая компания подъезд лифт мусор уборка снег дорога "
+    "кошка собака потерялась нашлась найдена фото объявление пост чат группа админ "
+    "день неделя месяц год праздник выходные отпуск погода дождь жарко холодно "
+    "хочу могу надо нужно знаю думаю видел слышал пишите звоните приходите ждем"
+).split()
+
+_WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+# Шрифты с кириллицей; если ни одного нет, используется встроенный шрифт Pillow
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+
+
+def make_message(rng, words_count):
+    """Обычное сообщение: частые слова встречаются чаще (распределение Ципфа)"""
+    return " ".join(rng.choices(VOCABULARY, _WEIGHTS, k=words_count)).capitalize()
+
+
+def fill_template(rng, template):
+    return template.format(n=rng.randint(2, 500), w=f"@{rng.choice(VOCABULARY)}{rng.randint(1, 999)}")
+
+
+def mutate(rng, text, edits):
+    """Изменяет несколько слов: замена, вставка, удаление, буквы-двойники"""
+    words = text.split()
+    for _ in range(edits):
+        action = rng.choice(("replace", "insert", "delete", "homoglyph"))
+        position = rng.randrange(len(words))
+        if action == "replace":
+            words[position] = rng.choice(VOCABULARY)
+        elif action == "insert":
+            words.insert(position, rng.choice(VOCABULARY))
+        elif action == "delete" and len(words) > 3:
+            del words[position]
+        else:
+            words[position] = words[position].replace("о", "o").replace("а", "a").replace("е", "e")
+    return " ".join(words)
+
+
+def make_spam(rng, phrases=(), edits=2):
+    """Спам: измененная копия шаблона рассылки или фраза из списка внутри обычного текста"""
+    if phrases and rng.random() < 0.5:
+        return f"{make_message(rng, rng.randint(2, 8))}. {rng.choice(phrases)}"
+    return mutate(rng, fill_template(rng, rng.choice(SPAM_TEMPLATES)), edits)
+
+
+def _load_font(size):
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow до 10.1 не масштабирует встроенный шрифт
+        return ImageFont.load_default()
+
+
+def _wrap(draw, text, font, width):
+    lines = []
+    line = ""
+    for word in text.split():
+        candidate = f"{line} {word}".strip()
+        if draw.textlength(candidate, font=font) <= width or not line:
+            line = candidate
+        else:
+            lines.append(line)
+            line = word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def make_spam_image(rng, text, size=(1280, 720), quality=85):
+    """
+    Картинка в духе рекламных постов: цветной фон с градиентом и шумом,
+    крупный текст (иногда светлый на темном), JPEG как после пересжатия в Telegram.
+    """
+    width, height = size
+    dark = rng.random() < 0.4
+    base = [rng.randint(0, 70) if dark else rng.randint(170, 255) for _ in range(3)]
+    image = Image.new("RGB", size, tuple(base))
+    draw = ImageDraw.Draw(image)
+    for y in range(0, height, 8):
+        shade = tuple(max(0, min(255, value + (y * 40) // height - 20)) for value in base)
+        draw.rectangle((0, y, width, y + 8), fill=shade)
+    for _ in range(rng.randint(3, 8)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randint(20, 150)
+        color = tuple(rng.randint(0, 255) for _ in range(3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), outline=color, width=4)
+
+    font = _load_font(rng.randint(height // 16, height // 10))
+    lines = _wrap(draw, text, font, width * 0.85)
+    line_height = int(font.size * 1.3) if hasattr(font, "size") else 16
+    y = max(10, (height - line_height * len(lines)) // 2 + rng.randint(-40, 40))
+    color = (rng.randint(220, 255),) * 3 if dark else (rng.randint(0, 40),) * 3
+    for line in lines:
+        x = (width - draw.textlength(line, font=font)) // 2 + rng.randint(-20, 20)
+        draw.text((x, y), line, font=font, fill=color)
+        y += line_height
+
+    image = image.filter(ImageFilter.GaussianBlur(0.6))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def photo_sizes(image_data, sides=(320, 800, 1280)):
+    """Уменьшенные копии картинки, как в поле photo сообщения: [(ширина, высота, JPEG)]"""
+    image = Image.open(io.BytesIO(image_data))
+    result = []
+    for side in sides:
+        copy = image.copy()
+        copy.thumbnail((side, side))
+        buffer = io.BytesIO()
+        copy.save(buffer, "JPEG", quality=85)
+        result.append((copy.width, copy.height, buffer.getvalue()))
+    return result
+
+
+def make_spam_gif(rng, text, size=(480, 270), frames=24):
+    """
+    GIF со спамом: сначала безобидная заставка, затем кадры с текстом рассылки
+    (текст на первом кадре отсутствует, поэтому превью не помогает)
+    """
+    intro = Image.open(io.BytesIO(make_spam_image(rng, make_message(rng, 3), size)))
+    spam = Image.open(io.BytesIO(make_spam_image(rng, text, size)))
+    sequence = [intro] * (frames // 3) + [spam] * (frames - frames // 3)
+    sequence = [frame.convert("P", palette=Image.ADAPTIVE) for frame in sequence]
+    buffer = io.BytesIO()
+    sequence[0].save(buffer, "GIF", save_all=True, append_images=sequence[1:], duration=120, loop=0)
+    return buffer.getvalue()
+
+
+def first_frame(gif_data, side=320):
+    """Превью анимации, как его делает Telegram: уменьшенный первый кадр в JPEG"""
+    image = Image.open(io.BytesIO(gif_data)).convert("RGB")
+    image.thumbnail((side, side))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return image.width, image.height, buffer.getvalue()
+
+
+def make_image_pool(rng, count, phrases=()):
+    """Набор разных спам-картинок (для повторов одной рассылки используется повторно)"""
+    texts = list(phrases) + [fill_template(rng, template) for template in SPAM_TEMPLATES]
+    return [make_spam_image(rng, rng.choice(texts)) for _ in range(count)]
+
+
+if __name__ == "__main__":
+    # Быстрый просмотр: сохраняет несколько картинок в текущую папку
+    rng = random.Random(1)
+    for i, data in enumerate(make_image_pool(rng, 3)):
+        with open(f"spam_sample_{i}.jpg", "wb") as f:
+            f.write(data)
+    print(make_spam(rng))
+    print(make_message(rng, 12))
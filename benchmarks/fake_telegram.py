@@ -0,0 +1,301 @@
+"""
+Локальный поддельный сервер Bot API для замеров без сети.
+
+Отвечает на методы, которые использует бот (getMe, getUpdates, setWebhook,
+getChatAdministrators, getFile, banChatMember, deleteMessage(s) и т.д.),
+отдает файлы картинок и в режиме webhook сам отправляет обновления POST-запросами,
+как это делает Telegram.
+"""
+import json
+import time
+import queue
+import threading
+import itertools
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qs, urlparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            "can_join_groups": True, "can_read_all_group_messages": True,
+            "supports_inline_queries": False}
+OWNER_USER = {"id": 1, "is_bot": False, "first_name": "Owner", "username": "owner"}
+
+
+class FakeTelegram:
+    """Поддельный Telegram: HTTP-сервер Bot API в отдельном потоке"""
+
+    def __init__(self, token="1000:BENCH", host="127.0.0.1", port=0):
+        self.token = token
+        self.updates = queue.Queue()
+        self.files = {}
+        self.calls = []
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_statuses = []
+        self._max_connections = 40
+        # (chat_id, message_id) -> время отправки обновления боту
+        self.sent_at = {}
+        # (chat_id, message_id) -> время, когда бот удалил сообщение
+        self.deleted_at = {}
+        self._update_ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._sender = None
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Заголовки и тело уходят одним пакетом, без задержек Nagle/delayed ACK
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # Бот закрыл long polling соединение при остановке
+                    pass
+
+            def do_GET(self):
+                fake._handle_file(self)
+
+            def do_POST(self):
+                fake._handle_api(self)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.base_url = f"http://{host}:{self.port}/bot"
+        self.base_file_url = f"http://{host}:{self.port}/file/bot"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        if self._sender is not None:
+            self._sender.shutdown(wait=False)
+
+    # --- отправка обновлений боту ---
+
+    def push_update(self, update):
+        """Передает обновление боту: через getUpdates или POST на webhook"""
+        update = dict(update, update_id=next(self._update_ids))
+        message = update.get("message")
+        if message:
+            self.sent_at[(message["chat"]["id"], message["message_id"])] = time.perf_counter()
+        if self.webhook_url:
+            self._get_sender().submit(self._post_update, update)
+        else:
+            self.updates.put(update)
+
+    def _get_sender(self):
+        # Telegram открывает к webhook ограниченное число соединений, как и этот пул
+        if self._sender is None:
+            self._sender = ThreadPoolExecutor(max_workers=self._max_connections)
+        return self._sender
+
+    def post_raw(self, update, secret):
+        """Отправка на webhook с произвольным секретом, возвращает HTTP-код ответа"""
+        request = urllib.request.Request(
+            self.webhook_url, data=json.dumps(update).encode(),
+            headers={"Content-Type": "application/json",
+                     "X-Telegram-Bot-Api-Secret-Token": secret or ""},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def _post_update(self, update):
+        status = self.post_raw(update, self.webhook_secret)
+        self.webhook_statuses.append(status)
+
+    def add_file(self, file_id, data):
+        """Регистрирует файл, который бот сможет скачать через getFile"""
+        self.files[file_id] = data
+
+    def wait_for_deletions(self, count, timeout=60):
+        """Ждет, пока бот удалит count сообщений; возвращает, сколько удалено"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len(self.deleted_at) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return len(self.deleted_at)
+
+    def latencies(self):
+        """Задержки от отправки обновления до его удаления ботом, секунд"""
+        return [self.deleted_at[key] - self.sent_at[key]
+                for key in self.deleted_at if key in self.sent_at]
+
+    # --- обработка запросов бота ---
+
+    def _read_params(self, handler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length).decode() if length else ""
+        content_type = handler.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body or "{}")
+        params = {}
+        for key, values in parse_qs(body).items():
+            value = values[0]
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    def _reply(self, handler, result, status=200):
+        body = json.dumps({"ok": status == 200, "result": result}).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _handle_api(self, handler):
+        method = handler.path.rsplit("/", 1)[-1]
+        params = self._read_params(handler)
+        now = time.perf_counter()
+        self.calls.append((method, params, now))
+        result = getattr(self, f"_api_{method}", self._api_default)(params)
+        self._reply(handler, result)
+
+    def _handle_file(self, handler):
+        file_id = urlparse(handler.path).path.rsplit("/", 1)[-1]
+        data = self.files.get(file_id)
+        if data is None:
+            handler.send_response(404)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _api_default(self, params):
+        return True
+
+    def _api_getMe(self, params):
+        return BOT_USER
+
+    def _api_setWebhook(self, params):
+        self._max_connections = int(params.get("max_connections") or 40)
+        self.webhook_secret = params.get("secret_token")
+        self.webhook_url = params["url"]
+        return True
+
+    def _api_deleteWebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        result = []
+        try:
+            update = self.updates.get(timeout=timeout) if timeout else self.updates.get_nowait()
+            result.append(update)
+            while len(result) < limit:
+                result.append(self.updates.get_nowait())
+        except queue.Empty:
+            pass
+        return [update for update in result if update["update_id"] >= offset]
+
+    def _api_getChatAdministrators(self, params):
+        return [{"status": "creator", "user": OWNER_USER, "is_anonymous": False}]
+
+    def _api_getChatMember(self, params):
+        return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False,
+                                             "first_name": "User"}}
+
+    def _api_getFile(self, params):
+        file_id = params["file_id"]
+        data = self.files.get(file_id, b"")
+        return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": len(data),
+                "file_path": f"files/{file_id}"}
+
+    def _mark_deleted(self, chat_id, message_ids):
+        now = time.perf_counter()
+        with self._condition:
+            for message_id in message_ids:
+                self.deleted_at.setdefault((int(chat_id), int(message_id)), now)
+            self._condition.notify_all()
+        return True
+
+    def _api_deleteMessage(self, params):
+        return self._mark_deleted(params["chat_id"], [params["message_id"]])
+
+    def _api_deleteMessages(self, params):
+        return self._mark_deleted(params["chat_id"], params["message_ids"])
+
+    def _api_sendMessage(self, params):
+        return {"message_id": int(time.time() * 1000) % 2 ** 31, "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "from": BOT_USER, "text": params.get("text", "")}
+
+
+def make_text_update(chat_id, message_id, user_id, text):
+    """Обновление с текстовым сообщением в супергруппе"""
+    return {
+        "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        }
+    }
+
+
+def make_photo_update(chat_id, message_id, user_id, sizes, caption=None):
+    """
+    Обновление с фото; sizes - [(file_id, file_unique_id, ширина, высота, размер в байтах)]
+    от меньшего к большему, как в Telegram
+    """
+    update = make_text_update(chat_id, message_id, user_id, None)
+    message = update["message"]
+    del message["text"]
+    message["photo"] = [
+        {"file_id": file_id, "file_unique_id": unique_id, "width": width, "height": height,
+         "file_size": file_size}
+        for file_id, unique_id, width, height, file_size in sizes
+    ]
+    if caption:
+        message["caption"] = caption
+    return update
+
+
+def make_animation_update(chat_id, message_id, user_id, animation, thumbnail=None, caption=None):
+    """
+    Обновление с анимацией (GIF); animation и thumbnail - (file_id, file_unique_id, ширина,
+    высота, размер в байтах). Как и Telegram, дублируем анимацию в поле document.
+    """
+    update = make_text_update(chat_id, message_id, user_id, None)
+    message = update["message"]
+    del message["text"]
+    file_id, unique_id, width, height, file_size = animation
+    message["animation"] = {"file_id": file_id, "file_unique_id": unique_id, "width": width,
+                            "height": height, "duration": 3, "mime_type": "image/gif",
+                            "file_name": f"{unique_id}.gif", "file_size": file_size}
+    message["document"] = {key: message["animation"][key]
+                           for key in ("file_id", "file_unique_id", "mime_type", "file_name", "file_size")}
+    if thumbnail:
+        file_id, unique_id, width, height, file_size = thumbnail
+        message["animation"]["thumbnail"] = {"file_id": file_id, "file_unique_id": unique_id,
+                                             "width": width, "height": height, "file_size": file_size}
+    if caption:
+        message["caption"] = caption
+    return update
@@ -0,0 +1,285 @@
+"""
+Воспроизведение потока обновлений через настоящие обработчики бота без сети.
+
+Бот собирается так же, как при запуске, и работает против локального поддельного
+Telegram (benchmarks.fake_telegram): обычные сообщения, спам и картинки со спамом
+подаются с заданной частотой, замеряются пропускная способность, задержка обработки
+каждого обновления и пиковая память. Результат можно сохранить в JSON для сравнения
+ревизий (benchmarks.compare_revisions).
+
+Запуск из корня проекта:
+    python -m benchmarks.replay --updates 3000 --rate 200 --image-share 0.1
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import subprocess
+
+# Кэш OCR на диске для замеров не нужен, база фраз - в памяти (заполняется из текстовых списков)
+os.environ.setdefault("OCR_CACHE_FILE", "")
+os.environ.setdefault("PHRASES_DB_FILE", ":memory:")
+
+from benchmarks.fake_telegram import FakeTelegram, make_text_update, make_photo_update, make_animation_update
+from benchmarks.corpus import (make_message, make_spam, make_image_pool, photo_sizes, make_spam_gif,
+                               first_frame, fill_template, SPAM_TEMPLATES)
+from benchmarks.stats import percentiles
+
+KINDS = ("text", "spam", "image", "animation")
+
+
+def build_application(fake):
+    """Приложение бота против поддельного Telegram (для старых ревизий - как в их main())"""
+    try:
+        from main import build_application as build
+    except ImportError:
+        build = None
+    if build is not None:
+        return build(token=fake.token, base_url=fake.base_url, base_file_url=fake.base_file_url)
+
+    from telegram.ext import Application, MessageHandler, filters
+    from handlers.message_handlers import handle_message
+    application = (
+        Application.builder().token(fake.token)
+        .base_url(fake.base_url).base_file_url(fake.base_file_url).build()
+    )
+    application.add_handler(MessageHandler(
+        filters.ChatType.GROUPS & (filters.TEXT | filters.CAPTION | filters.PHOTO | filters.Document.IMAGE),
+        handle_message
+    ))
+    return application
+
+
+def load_phrases():
+    from config import BANNED_PHRASES_FILE
+    try:
+        with open(BANNED_PHRASES_FILE, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    except OSError:
+        return []
+
+
+def make_plan(fake, rng, updates, spam_share, image_share, images, chats, animation_share=0.0):
+    """Заранее готовит обновления: [(вид, обновление)], файлы картинок регистрируются в fake"""
+    phrases = load_phrases()
+    pool = [photo_sizes(data) for data in make_image_pool(rng, images, phrases)] if image_share else []
+    gifs = []
+    if animation_share:
+        texts = list(phrases) + [fill_template(rng, template) for template in SPAM_TEMPLATES]
+        gifs = [make_spam_gif(rng, rng.choice(texts)) for _ in range(images)]
+    plan = []
+    for i in range(updates):
+        chat_id = -100 - i % chats
+        message_id = i + 1
+        # Каждое сообщение от нового пользователя, чтобы бан не пропускался как повторный
+        user_id = 10000 + i
+        roll = rng.random()
+        if roll < animation_share:
+            data = rng.choice(gifs)
+            fake.add_file(f"a{i}", data)
+            width, height, thumbnail = first_frame(data)
+            fake.add_file(f"t{i}", thumbnail)
+            plan.append(("animation", make_animation_update(
+                chat_id, message_id, user_id, (f"a{i}", f"ua{i}", 480, 270, len(data)),
+                (f"t{i}", f"ut{i}", width, height, len(thumbnail)))))
+            continue
+        roll -= animation_share
+        if roll < image_share:
+            sizes = []
+            for width, height, data in rng.choice(pool):
+                file_id = f"f{i}_{width}"
+                fake.add_file(file_id, data)
+                sizes.append((file_id, f"u{file_id}", width, height, len(data)))
+            plan.append(("image", make_photo_update(chat_id, message_id, user_id, sizes)))
+        elif roll < image_share + spam_share:
+            plan.append(("spam", make_text_update(chat_id, message_id, user_id, make_spam(rng, phrases))))
+        else:
+            text = make_message(rng, rng.randint(2, 30))
+            plan.append(("text", make_text_update(chat_id, message_id, user_id, text)))
+    return plan
+
+
+def _read_peak_rss(pid):
+    """Пиковый объем памяти процесса (VmHWM), МБ; 0, если /proc недоступен"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def peak_rss():
+    """Пиковая память бота и сумма пиков дочерних процессов (пул OCR), МБ"""
+    own = _read_peak_rss("self")
+    if not own:
+        import resource
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = 0.0
+    parent = str(os.getpid())
+    if os.path.isdir("/proc"):
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    ppid = f.read().rsplit(")", 1)[1].split()[1]
+            except (OSError, IndexError):
+                continue
+            if ppid == parent:
+                children += _read_peak_rss(pid)
+    return own, children
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def stage_percentiles():
+    """Перцентили этапов из utils.metrics, если в этой ревизии они есть"""
+    try:
+        from utils.metrics import metrics
+    except ImportError:
+        return {}
+    return {stage: {'count': data['count'],
+                    'p50': data['quantiles'][0.5], 'p95': data['quantiles'][0.95]}
+            for stage, data in metrics.snapshot()['stages'].items()}
+
+
+async def run(updates, rate, spam_share, image_share, images, chats, seed, timeout, animation_share=0.0):
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    rng = random.Random(seed)
+    fake = FakeTelegram().start()
+    plan = make_plan(fake, rng, updates, spam_share, image_share, images, chats, animation_share)
+    kinds = {(update["message"]["chat"]["id"], update["message"]["message_id"]): kind
+             for kind, update in plan}
+
+    application = build_application(fake)
+    finished_at = {}
+    all_done = asyncio.Event()
+
+    async def on_done(update, context):
+        # Последняя группа обработчиков: сообщение прошло все проверки
+        message = update.effective_message
+        if message is not None:
+            finished_at[(message.chat_id, message.message_id)] = time.perf_counter()
+            if len(finished_at) >= len(plan):
+                all_done.set()
+
+    application.add_handler(TypeHandler(Update, on_done), group=100)
+
+    async with application:
+        await application.start()
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+
+        started = time.perf_counter()
+        for i, (kind, update) in enumerate(plan):
+            fake.push_update(update)
+            if rate:
+                delay = started + (i + 1) / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        try:
+            await asyncio.wait_for(all_done.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Обработано только {len(finished_at)} из {len(plan)} обновлений")
+        elapsed = time.perf_counter() - started
+        # Удаления отправляются параллельно с баном, даем им завершиться
+        await asyncio.sleep(0.5)
+        own_rss, children_rss = peak_rss()
+        stages = stage_percentiles()
+
+        await application.updater.stop()
+        await application.stop()
+    fake.stop()
+
+    latencies = {kind: [] for kind in KINDS}
+    for key, finished in finished_at.items():
+        if key in fake.sent_at and key in kinds:
+            latencies[kinds[key]].append(finished - fake.sent_at[key])
+    everything = [value for values in latencies.values() for value in values]
+
+    def summary(values):
+        if not values:
+            return None
+        p50, p95, p99 = percentiles(values, (50, 95, 99))
+        return {'count': len(values), 'p50': p50, 'p95': p95, 'p99': p99, 'max': max(values)}
+
+    return {
+        'revision': git_revision(),
+        'updates': len(plan),
+        'processed': len(finished_at),
+        'elapsed': elapsed,
+        'throughput': len(finished_at) / elapsed if elapsed else 0.0,
+        'rate': rate,
+        'deleted': len(fake.deleted_at),
+        'expected_deleted': sum(kind != "text" for kind, _ in plan),
+        'latency': dict({'all': summary(everything)}, **{kind: summary(latencies[kind]) for kind in KINDS}),
+        'peak_rss_mb': own_rss,
+        'children_peak_rss_mb': children_rss,
+        'stages': stages,
+    }
+
+
+def print_report(result):
+    print(f"Ревизия: {result['revision']}, обновлений: {result['updates']}, "
+          f"заданная частота: {result['rate'] or 'максимальная'}/с")
+    print(f"Обработано: {result['processed']} за {result['elapsed']:.2f} с "
+          f"({result['throughput']:.0f} обновлений/с)")
+    print(f"Удалено сообщений: {result['deleted']} (спама и картинок в потоке: {result['expected_deleted']})")
+    print("Задержка, мс      число      p50      p95      p99     макс")
+    titles = {'all': "все", 'text': "обычные", 'spam': "спам", 'image': "картинки", 'animation': "анимации"}
+    for kind, title in titles.items():
+        data = result['latency'].get(kind)
+        if data:
+            print(f"  {title:<12} {data['count']:>7} {data['p50'] * 1000:8.1f} {data['p95'] * 1000:8.1f} "
+                  f"{data['p99'] * 1000:8.1f} {data['max'] * 1000:8.1f}")
+    print(f"Пиковая память: бот {result['peak_rss_mb']:.0f} МБ, "
+          f"дочерние процессы {result['children_peak_rss_mb']:.0f} МБ")
+    if result['stages']:
+        print("Этапы, мс (p50 / p95, число):")
+        for stage, data in sorted(result['stages'].items()):
+            print(f"  {stage:<16} {data['p50'] * 1000:8.2f} / {data['p95'] * 1000:8.2f} ({data['count']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200, help="обновлений в секунду (0 - без ограничения)")
+    parser.add_argument("--spam-share", type=float, default=0.2, help="доля текстового спама")
+    parser.add_argument("--image-share", type=float, default=0.05, help="доля картинок со спамом")
+    parser.add_argument("--animation-share", type=float, default=0.0, help="доля GIF-анимаций со спамом")
+    parser.add_argument("--images", type=int, default=20, help="сколько разных картинок (и GIF) в рассылке")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300, help="сколько ждать обработки, секунд")
+    parser.add_argument("--json", help="сохранить результат в файл")
+    parser.add_argument("--verbose", action="store_true", help="показывать лог бота")
+    args = parser.parse_args()
+    # Без --verbose лог бота не мешает отчету (например, ошибки OCR без tesseract)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    result = asyncio.run(run(args.updates, args.rate, args.spam_share, args.image_share,
+                             args.images, args.chats, args.seed, args.timeout, args.animation_share))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if result['processed'] < result['updates']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""Общие функции для отчетов бенчмарков"""
+
+
+def percentiles(values, points):
+    """Перцентили (метод ближайшего ранга) для списка значений"""
+    ordered = sorted(values)
+    result = []
+    for point in points:
+        index = max(0, min(len(ordered) - 1, int(round(point / 100 * len(ordered))) - 1))
+        result.append(ordered[index])
+    return result
@@ -1,18 +1,26 @@
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
-from utils.phrase_manager import PhraseManager
+from utils.phrase_manager import get_phrase_manager
+from utils.phrase_store import GLOBAL_CHAT
+from utils.metrics import metrics
+from utils.log_pipeline import audit
 from config import ADMINS
 
-# Инициализация менеджеров фраз
-text_phrase_manager = PhraseManager("text")
-image_phrase_manager = PhraseManager("image")
+# Общие для всего процесса менеджеры фраз
+text_phrase_manager = get_phrase_manager("text")
+image_phrase_manager = get_phrase_manager("image")
 
 # Состояния для диалога
 WAITING_FOR_ADD_PHRASE = 1
 WAITING_FOR_REMOVE_PHRASE = 2
 WAITING_FOR_ADD_IMAGE_WORD = 3
 WAITING_FOR_REMOVE_IMAGE_WORD = 4
+WAITING_FOR_IMPORT_PHRASES = 5
+WAITING_FOR_IMPORT_IMAGE_WORDS = 6
+
+# Максимальный размер файла для импорта списка
+IMPORT_MAX_BYTES = 1024 * 1024
 
 def is_admin(user):
     """Проверка, является ли пользователь администратором"""
@@ -20,6 +28,15 @@ def is_admin(user):
         return False
     return user.username in ADMINS
 
+def get_scope(context):
+    """Чат, с правилами которого работают команды админа (GLOBAL_CHAT - общий список)"""
+    return context.user_data.get('chat_id', GLOBAL_CHAT)
+
+def scope_title(chat_id):
+    if chat_id == GLOBAL_CHAT:
+        return "общий список"
+    return f"правила чата {chat_id}"
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user = update.effective_user
@@ -38,6 +55,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /add_image_word - Добавить запрещенное слово или сочетание слов для картинок
 /remove_image_word - Удалить запрещенное слово или сочетание слов для картинок
 /list_phrases - Показать все запрещенные фразы и слова
+/select_chat - Выбрать чат для правил только этого чата (без параметра - общий список)
+/import_phrases - Загрузить список запрещенных фраз
+/import_image_words - Загрузить список запрещенных слов для картинок
+/export_phrases - Выгрузить списки в файлы
+/stats - Время обработки и статистика работы бота
 /help - Помощь
 /cancel - Отмена текущей операции
 """
@@ -78,7 +100,8 @@ async def add_image_word(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ У Вас нет прав для выполнения этой команды.")
         return
         
-    await update.message.reply_text("🖼 Пожалуйста, введите слово или сочетание слов для добавления в список запрещенных на картинках:")
+    await update.message.reply_text("🖼 Пожалуйста, введите слово или сочетание слов для добавления в список запрещенных на картинках.\n"
+        "Чтобы искать только целые слова (а не части слов), начните строку с \"=\":")
     context.user_data['state'] = WAITING_FOR_ADD_IMAGE_WORD
 
 async def remove_image_word(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -102,39 +125,160 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     state = context.user_data.get('state')
     text = update.message.text.strip()
+    chat_id = get_scope(context)
+    # Для правил отдельного чата в ответе указывается, о каком чате речь
+    where = "" if chat_id == GLOBAL_CHAT else f" ({scope_title(chat_id)})"
     
     if state == WAITING_FOR_ADD_PHRASE:
-        if text_phrase_manager.add_phrase(text):
-            await update.message.reply_text(f"✅ Фраза \"{text}\" добавлена в список запрещенных.")
-            logging.info(f"Админ {user.username} добавил фразу: {text}")
+        if text_phrase_manager.add_phrase(text, chat_id):
+            await update.message.reply_text(f"✅ Фраза \"{text}\" добавлена в список запрещенных{where}.")
+            logging.info(f"Админ {user.username} добавил фразу{where}: {text}")
+            audit("phrase_added", list="text", chat_id=chat_id, phrase=text, admin=user.username)
         else:
-            await update.message.reply_text(f"❌ Фраза \"{text}\" уже есть в списке.")
+            await update.message.reply_text(f"❌ Фраза \"{text}\" уже есть в списке{where}.")
         context.user_data['state'] = None
         
     elif state == WAITING_FOR_REMOVE_PHRASE:
-        if text_phrase_manager.remove_phrase(text):
-            await update.message.reply_text(f"✅ Фраза \"{text}\" удалена из списка запрещенных.")
-            logging.info(f"Админ {user.username} удалил фразу: {text}")
+        if text_phrase_manager.remove_phrase(text, chat_id):
+            await update.message.reply_text(f"✅ Фраза \"{text}\" удалена из списка запрещенных{where}.")
+            logging.info(f"Админ {user.username} удалил фразу{where}: {text}")
+            audit("phrase_removed", list="text", chat_id=chat_id, phrase=text, admin=user.username)
         else:
-            await update.message.reply_text(f"❌ Фраза \"{text}\" не найдена в списке.")
+            await update.message.reply_text(f"❌ Фраза \"{text}\" не найдена в списке{where}.")
         context.user_data['state'] = None
         
     elif state == WAITING_FOR_ADD_IMAGE_WORD:
-        if image_phrase_manager.add_phrase(text):
-            await update.message.reply_text(f"✅ Слово(-а) \"{text}\" добавлено(-ы) в список запрещенных на картинках.")
-            logging.info(f"Админ {user.username} добавил слово(-а) для картинок: {text}")
+        if image_phrase_manager.add_phrase(text, chat_id):
+            await update.message.reply_text(f"✅ Слово(-а) \"{text}\" добавлено(-ы) в список запрещенных на картинках{where}.")
+            logging.info(f"Админ {user.username} добавил слово(-а) для картинок{where}: {text}")
+            audit("phrase_added", list="image", chat_id=chat_id, phrase=text, admin=user.username)
         else:
-            await update.message.reply_text(f"❌ Слово(-а) \"{text}\" уже есть в списке запрещенных на картинках.")
+            await update.message.reply_text(f"❌ Слово(-а) \"{text}\" уже есть в списке запрещенных на картинках{where}.")
         context.user_data['state'] = None
         
     elif state == WAITING_FOR_REMOVE_IMAGE_WORD:
-        if image_phrase_manager.remove_phrase(text):
-            await update.message.reply_text(f"✅ Слово(-а) \"{text}\" удалено(-ы) из списка запрещенных на картинках.")
-            logging.info(f"Админ {user.username} удалил слово(-а) для картинок: {text}")
+        if image_phrase_manager.remove_phrase(text, chat_id):
+            await update.message.reply_text(f"✅ Слово(-а) \"{text}\" удалено(-ы) из списка запрещенных на картинках{where}.")
+            logging.info(f"Админ {user.username} удалил слово(-а) для картинок{where}: {text}")
+            audit("phrase_removed", list="image", chat_id=chat_id, phrase=text, admin=user.username)
         else:
-            await update.message.reply_text(f"❌ Слово(-а) \"{text}\" не найдено в списке запрещенных на картинках.")
+            await update.message.reply_text(f"❌ Слово(-а) \"{text}\" не найдено в списке запрещенных на картинках{where}.")
         context.user_data['state'] = None
         
+    elif state in (WAITING_FOR_IMPORT_PHRASES, WAITING_FOR_IMPORT_IMAGE_WORDS):
+        await import_lines(update, context, text.splitlines())
+        
+async def select_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор чата, с правилами которого работают команды (/select_chat -100123...)"""
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ У Вас нет прав для выполнения этой команды.")
+        return
+        
+    if context.args:
+        try:
+            chat_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Укажите числовой id чата, например: /select_chat -1001234567890")
+            return
+    else:
+        chat_id = GLOBAL_CHAT
+    context.user_data['chat_id'] = chat_id
+    context.user_data['state'] = None
+    
+    if chat_id == GLOBAL_CHAT:
+        await update.message.reply_text("🌐 Команды работают с общим списком для всех чатов.")
+    else:
+        await update.message.reply_text(
+            f"💬 Команды работают с правилами чата {chat_id}: они действуют в этом чате "
+            "вместе с общим списком.\n/select_chat без параметра - вернуться к общему списку."
+        )
+
+async def import_phrases(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Массовая загрузка запрещенных фраз"""
+    await _start_import(update, context, WAITING_FOR_IMPORT_PHRASES)
+
+async def import_image_words(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Массовая загрузка запрещенных слов для картинок"""
+    await _start_import(update, context, WAITING_FOR_IMPORT_IMAGE_WORDS)
+
+async def _start_import(update, context, state):
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ У Вас нет прав для выполнения этой команды.")
+        return
+        
+    await update.message.reply_text(
+        f"📥 Пришлите .txt файл или сообщение со списком, по одной строке на запись "
+        f"({scope_title(get_scope(context))}). Строки, которые уже есть в списке, пропускаются."
+    )
+    context.user_data['state'] = state
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Файл со списком для импорта"""
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ У Вас нет прав для выполнения этой команды.")
+        return
+        
+    if context.user_data.get('state') not in (WAITING_FOR_IMPORT_PHRASES, WAITING_FOR_IMPORT_IMAGE_WORDS):
+        await update.message.reply_text("❌ Сначала выберите команду /import_phrases или /import_image_words.")
+        return
+        
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text("❌ Файл слишком большой (максимум 1 МБ).")
+        return
+        
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+    try:
+        lines = bytes(data).decode("utf-8-sig").splitlines()
+    except UnicodeDecodeError:
+        await update.message.reply_text("❌ Файл должен быть в кодировке UTF-8.")
+        return
+    await import_lines(update, context, lines)
+
+async def import_lines(update, context, lines):
+    """Добавляет строки в выбранный список одной транзакцией"""
+    user = update.effective_user
+    chat_id = get_scope(context)
+    if context.user_data.get('state') == WAITING_FOR_IMPORT_IMAGE_WORDS:
+        manager, list_name = image_phrase_manager, "image"
+    else:
+        manager, list_name = text_phrase_manager, "text"
+    lines = [line.strip() for line in lines if line.strip()]
+    
+    added = manager.import_phrases(lines, chat_id)
+    await update.message.reply_text(f"✅ Добавлено записей: {added} из {len(lines)} ({scope_title(chat_id)}).")
+    logging.info(f"Админ {user.username} загрузил список {list_name} ({scope_title(chat_id)}): "
+                 f"добавлено {added} из {len(lines)}")
+    audit("phrases_imported", list=list_name, chat_id=chat_id, added=added, lines=len(lines), admin=user.username)
+    context.user_data['state'] = None
+
+async def export_phrases(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка списков выбранного чата в файлы (формат подходит для импорта)"""
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ У Вас нет прав для выполнения этой команды.")
+        return
+        
+    chat_id = get_scope(context)
+    suffix = "" if chat_id == GLOBAL_CHAT else f"_{chat_id}"
+    exported = False
+    for manager, name in ((text_phrase_manager, "banned_phrases"), (image_phrase_manager, "banned_words_image")):
+        phrases = manager.get_phrases(chat_id)
+        if phrases:
+            data = "".join(phrase + "\n" for phrase in phrases).encode("utf-8")
+            await update.message.reply_document(data, filename=f"{name}{suffix}.txt")
+            exported = True
+    if not exported:
+        await update.message.reply_text(f"📝 Списки пусты ({scope_title(chat_id)}).")
+
 async def list_phrases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отображение списка всех запрещенных фраз и слов"""
     user = update.effective_user
@@ -143,14 +287,18 @@ async def list_phrases(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ У Вас нет прав для выполнения этой команды.")
         return
         
-    text_phrases = text_phrase_manager.get_phrases()
-    image_words = image_phrase_manager.get_phrases()
+    chat_id = get_scope(context)
+    text_phrases = text_phrase_manager.get_phrases(chat_id)
+    image_words = image_phrase_manager.get_phrases(chat_id)
+    chats = []
+    if chat_id == GLOBAL_CHAT:
+        chats = sorted(set(text_phrase_manager.get_chats()) | set(image_phrase_manager.get_chats()))
     
-    if not text_phrases and not image_words:
-        await update.message.reply_text("📝 Списки запрещенных фраз и слов пусты.")
+    if not text_phrases and not image_words and not chats:
+        await update.message.reply_text(f"📝 Списки запрещенных фраз и слов пусты ({scope_title(chat_id)}).")
         return
     
-    response = "📝 Списки запрещенных фраз и слов:\n\n"
+    response = f"📝 Списки запрещенных фраз и слов ({scope_title(chat_id)}):\n\n"
     
     if text_phrases:
         response += "🔤 Запрещенные текстовые фразы:\n"
@@ -158,7 +306,12 @@ async def list_phrases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if image_words:
         response += "🖼 Запрещенные слова на картинках:\n"
-        response += "\n".join([f"• {word}" for word in image_words])
+        response += "\n".join([f"• {word}" for word in image_words]) + "\n\n"
+    
+    if chats:
+        response += "💬 Чаты со своими правилами (/select_chat id):\n"
+        response += "\n".join([f"• {chat}" for chat in chats])
+    response = response.rstrip("\n")
     
     # Разбиваем сообщение если оно слишком длинное
     if len(response) > 4096:
@@ -181,6 +334,16 @@ async def list_phrases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(response)
 
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Время обработки по этапам, счетчики и состояние кэшей"""
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ У Вас нет прав для выполнения этой команды.")
+        return
+        
+    await update.message.reply_text(metrics.render_text()[:4096])
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Помощь"""
     user = update.effective_user
@@ -193,6 +356,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "/add_image_word - Добавить запрещенное слово или сочетание слов для картинок\n"
             "/remove_image_word - Удалить запрещенное слово или сочетание слов для картинок\n"
             "/list_phrases - Показать все запрещенные фразы и слова\n"
+            "/select_chat - Выбрать чат для правил только этого чата (без параметра - общий список)\n"
+            "/import_phrases - Загрузить список запрещенных фраз\n"
+            "/import_image_words - Загрузить список запрещенных слов для картинок\n"
+            "/export_phrases - Выгрузить списки в файлы\n"
+            "/stats - Время обработки и статистика работы бота\n"
             "/help - Помощь\n"
             "/cancel - Отмена текущей операции\n"
         )
@@ -216,7 +384,13 @@ def get_command_handlers():
         CommandHandler("add_image_word", add_image_word, filters=private_filter),
         CommandHandler("remove_image_word", remove_image_word, filters=private_filter),
         CommandHandler("list_phrases", list_phrases, filters=private_filter),
+        CommandHandler("stats", stats, filters=private_filter),
+        CommandHandler("select_chat", select_chat, filters=private_filter),
+        CommandHandler("import_phrases", import_phrases, filters=private_filter),
+        CommandHandler("import_image_words", import_image_words, filters=private_filter),
+        CommandHandler("export_phrases", export_phrases, filters=private_filter),
         CommandHandler("help", help_command, filters=private_filter),
         CommandHandler("cancel", cancel, filters=filters.ChatType.PRIVATE),
         MessageHandler(filters.TEXT & filters.ChatType.PRIVATE, handle_text),
+        MessageHandler(filters.Document.ALL & filters.ChatType.PRIVATE, handle_document),
     ]
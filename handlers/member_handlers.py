@@ -0,0 +1,23 @@
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes
+from utils.member_cache import member_cache
+from utils.risk import risk_tracker
+
+async def handle_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обновляет кэш статусов при изменении участника чата (вход, выход, назначение админом)
+    и запоминает время вступления для оценки риска
+    """
+    chat_member = update.chat_member
+    if not chat_member:
+        return
+        
+    chat_id = chat_member.chat.id
+    user_id = chat_member.new_chat_member.user.id
+    status = chat_member.new_chat_member.status
+    
+    member_cache.set(chat_id, user_id, status)
+    risk_tracker.record_member_update(chat_id, user_id, chat_member.old_chat_member.status, status)
+    logging.info(f"Статус пользователя {user_id} в чате {chat_id}: "
+                 f"{chat_member.old_chat_member.status} -> {status}")
@@ -1,22 +1,44 @@
 import logging
-import io
-import pytesseract
-from PIL import Image
+import random
+import asyncio
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.error import BadRequest, Forbidden
-from utils.phrase_manager import PhraseManager
-from utils.chat_actions import delete_message, ban_user
+from utils.phrase_manager import get_phrase_manager
+from utils.chat_actions import enforcer
+from utils.recent_messages import recent_messages
+from utils.ocr import ocr_pool, OcrOverloaded, OCR_OVERLOAD_POLICY, OcrResult, select_photo_tiers, is_confident
+from utils.media_frames import MediaTier, media_tiers, get_media, FFMPEG_PATH, MEDIA_OCR_ENABLED, MEDIA_MAX_BYTES
+from utils.ocr_cache import ocr_cache
+from utils.downloads import downloader, precheck, DownloadRejected, DownloadError, DOWNLOAD_MAX_BYTES
+from utils.member_cache import member_cache, ADMIN_STATUSES
+from utils.media_groups import media_group_collector
+from utils.near_duplicates import near_duplicates
+from utils.metrics import metrics
+from utils.risk import (risk_tracker, RISK_LOW_SCORE, RISK_HIGH_SCORE, RISK_DEFER_MAX_PENDING,
+                        RISK_DEFER_TIMEOUT, RISK_SAMPLE_RATE)
+from utils.update_lanes import update_processor
+from utils.log_pipeline import start_trace, trace, audit, cap
 from config import TESSERACT_PATH
 
-if TESSERACT_PATH:
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
-else:
+if not TESSERACT_PATH:
     print("Предупреждение: Tesseract не найден. Распознавание текста с картинок отключено.")
+elif MEDIA_OCR_ENABLED and not FFMPEG_PATH:
+    print("Предупреждение: ffmpeg не найден. В видео и анимациях проверяется только превью.")
 
-# Инициализация менеджеров фраз
-text_phrase_manager = PhraseManager("text")
-image_phrase_manager = PhraseManager("image")
+# Общие для всего процесса менеджеры фраз
+text_phrase_manager = get_phrase_manager("text")
+image_phrase_manager = get_phrase_manager("image")
+
+def forget_stale_fingerprints(file_type, chat_id):
+    """Отпечатки спама, удаленного по фразе, которую убрали или изменили, больше не банят"""
+    if file_type != "text":
+        return
+    removed = near_duplicates.forget(text_phrase_manager.has_phrase)
+    if removed:
+        logging.info(f"Удалено отпечатков спама по убранным фразам: {removed}")
+
+text_phrase_manager.subscribe(forget_stale_fingerprints)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает сообщения в группах"""
@@ -24,29 +46,33 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = message.from_user
     chat = update.effective_chat
     
-    # Логируем тип сообщения для отладки
-    message_type = "текст"
-    if message.photo:
-        message_type = "фото"
-    elif message.document:
-        message_type = "документ"
-    elif message.video:
-        message_type = "видео"
-    elif message.audio:
-        message_type = "аудио"
-    elif message.voice:
-        message_type = "голосовое"
-    elif message.sticker:
-        message_type = "стикер"
-    elif message.animation:
-        message_type = "анимация"
-    
-    logging.info(f"Получено сообщение типа: {message_type}")
+    # Подробные строки обработки пишутся только для выбранной доли сообщений
+    if start_trace():
+        # Логируем тип сообщения для отладки
+        message_type = "текст"
+        if message.photo:
+            message_type = "фото"
+        elif message.document:
+            message_type = "документ"
+        elif message.video:
+            message_type = "видео"
+        elif message.audio:
+            message_type = "аудио"
+        elif message.voice:
+            message_type = "голосовое"
+        elif message.sticker:
+            message_type = "стикер"
+        elif message.animation:
+            message_type = "анимация"
+        trace("Получено сообщение типа: %s в чате %s", message_type, chat.id)
+    metrics.increment("messages")
     
     # Проверяем права пользователя
     try:
-        member = await chat.get_member(user.id)
-        if member.status in ['administrator', 'creator']:
+        # Статус берется из кэша, запрос к API только при промахе
+        with metrics.timer("member_check"):
+            status = await member_cache.get_status(chat, user.id)
+        if status in ADMIN_STATUSES:
             return
     except BadRequest as e:
         if "User not found" in str(e) or "Chat not found" in str(e):
@@ -61,38 +87,160 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logging.error(f"Неизвестная ошибка при проверки прав пользователя {user.id}: {e}")
         return
 
+    # Оценка риска по дешевым признакам (новичок, первое сообщение, ссылки, прошлые нарушения)
+    # определяет очередность OCR; считается до учета текущего сообщения
+    risk = risk_tracker.score(chat.id, user.id, message)
+    risk_tracker.record_message(chat.id, user.id)
+    
+    # Запоминаем сообщение, чтобы при бане удалить и остальные недавние сообщения автора
+    recent_messages.add(chat.id, user.id, message.message_id)
+
+    # Части альбома приходят отдельными обновлениями: собираем их и проверяем вместе
+    if message.media_group_id:
+        if media_group_collector.add(message):
+            context.application.create_task(
+                process_media_group(message, chat, user, context, risk), update=update
+            )
+        return
+
     # Проверка изображений
     is_image = await is_image_message(message)
     
     if is_image:
-        logging.info(f"Обнаружено изображение, начинаем проверку OCR")
-        banned_found = await check_image_for_banned_words(message, context)
+        trace("Обнаружено изображение (риск %.2f), начинаем проверку OCR", risk)
+        banned_found = await check_image_by_risk(update, message, chat, user, context, risk)
         if banned_found:
-            await handle_restricted_message(message, chat, user, context, "изображение")
+            await handle_restricted_message(message, chat, user, context, "изображение", banned_found.phrase)
+            return
 
     # Проверка текстовых сообщений
     text = message.text or message.caption
     
     if text:
-        text_lower = text.lower()
-        for phrase in text_phrase_manager.get_phrases():
-            if phrase.lower() in text_lower:
-                await handle_restricted_message(message, chat, user, context, "текст")
+        with metrics.timer("phrase_match"):
+            match = text_phrase_manager.find_phrase(text, chat.id)
+        if match:
+            # Позиция - в нормализованном тексте: после NFKC, удаления невидимых символов и схлопывания
+            # повторов она не совпадает с позицией в сообщении
+            logging.info(f"Найдена запрещенная фраза \"{match.phrase}\" "
+                         f"(позиция в нормализованном тексте {match.start}-{match.end})")
+            await handle_restricted_message(message, chat, user, context, "текст", match.phrase, spam_text=text,
+                                            shared=text_phrase_manager.is_global(match.phrase))
+            return
+        
+        # Измененная копия недавно удаленного спама, которой еще нет в списке фраз
+        with metrics.timer("near_duplicate"):
+            duplicate = near_duplicates.find(text, chat.id)
+        if duplicate:
+            logging.info(f"Сообщение похоже на удаленный спам из чата {duplicate.chat_id} "
+                         f"(сходство {duplicate.similarity:.2f})")
+            # Найденный отпечаток уже обновлен, новый не добавляется: иначе отпечатки "уплывают"
+            # от исходного текста на пороге сходства
+            await handle_restricted_message(message, chat, user, context, "повтор спама",
+                                            f"сходство {duplicate.similarity:.2f}")
+            return
+
+async def process_media_group(message, chat, user, context, risk=0.0):
+    """Проверяет альбом целиком: подписи, затем все картинки параллельно до первого нарушения"""
+    messages = await media_group_collector.wait_for_group(chat.id, message.media_group_id)
+    trace("Медиагруппа %s: собрано %s сообщений", message.media_group_id, len(messages))
+    
+    # Подписи проверяются дешево, начинаем с них
+    for item in messages:
+        text = item.text or item.caption
+        if text:
+            match = text_phrase_manager.find_phrase(text, chat.id)
+            if match:
+                logging.info(f"Найдена запрещенная фраза \"{match.phrase}\" в медиагруппе {message.media_group_id}")
+                await handle_restricted_media_group(messages, chat, user, context, "текст", match.phrase,
+                                                    spam_text=text,
+                                                    shared=text_phrase_manager.is_global(match.phrase))
                 return
+            duplicate = near_duplicates.find(text, chat.id)
+            if duplicate:
+                logging.info(f"Подпись медиагруппы {message.media_group_id} похожа на удаленный спам "
+                             f"(сходство {duplicate.similarity:.2f})")
+                await handle_restricted_media_group(messages, chat, user, context, "повтор спама",
+                                                    f"сходство {duplicate.similarity:.2f}")
+                return
+    
+    image_messages = [item for item in messages if await is_image_message(item)]
+    if not image_messages:
+        return
+        
+    tasks = [asyncio.ensure_future(check_image_for_banned_words(item, context, risk)) for item in image_messages]
+    banned_found = None
+    try:
+        for finished in asyncio.as_completed(tasks):
+            banned_found = await finished
+            if banned_found:
+                break
+    finally:
+        # Остальные картинки альбома проверять уже не нужно
+        for task in tasks:
+            task.cancel()
+    
+    if banned_found:
+        await handle_restricted_media_group(messages, chat, user, context, "изображение", banned_found.phrase)
+
+def _ocr_saturated():
+    """Картинки ждут своей очереди: OCR занят полностью или в полосе картинок есть очередь"""
+    return ocr_pool.is_full() or update_processor.image_lane.waiting > 0
+
+async def check_image_by_risk(update, message, chat, user, context, risk):
+    """
+    Проверка картинки с учетом риска. Под нагрузкой картинки участников с низким риском
+    не занимают OCR: проверка откладывается до освобождения очереди, а когда отложенных
+    слишком много - выполняется лишь для случайной доли RISK_SAMPLE_RATE.
+    """
+    if risk >= RISK_LOW_SCORE or not _ocr_saturated():
+        return await check_image_for_banned_words(message, context, risk)
+    
+    if risk_tracker.deferred < RISK_DEFER_MAX_PENDING:
+        risk_tracker.deferred += 1
+        metrics.increment("ocr_deferred")
+        trace("OCR занят, проверка картинки отложена (риск %.2f)", risk)
+        context.application.create_task(deferred_image_check(message, chat, user, context, risk),
+                                        update=update)
+        return False
+    if random.random() < RISK_SAMPLE_RATE:
+        metrics.increment("ocr_sampled")
+        return await check_image_for_banned_words(message, context, risk)
+    metrics.increment("ocr_skipped_low_risk")
+    trace("OCR занят, картинка с низким риском пропущена (риск %.2f)", risk)
+    return False
+
+async def deferred_image_check(message, chat, user, context, risk):
+    """Отложенная проверка картинки: ждет свободного места в OCR после остальных"""
+    try:
+        # Автора могли уже забанить за другое сообщение
+        if enforcer.is_recently_banned(chat.id, user.id):
+            return
+        banned_found = await check_image_for_banned_words(message, context, risk, deferred=True)
+        if banned_found:
+            await handle_restricted_message(message, chat, user, context, "изображение", banned_found.phrase)
+    finally:
+        risk_tracker.deferred -= 1
 
 async def is_image_message(message):
     """Определяет, является ли сообщение изображением"""
     # Проверяем фото
     if message.photo:
-        logging.info(f"Сообщение содержит фото: {len(message.photo)} элементов")
+        trace("Сообщение содержит фото: %s элементов", len(message.photo))
+        return True
+    
+    # Анимации, стикеры, кружки и видео проверяются по кадрам
+    # (у анимации заполнено и поле document, поэтому проверяем ее раньше)
+    if get_media(message):
+        trace("Сообщение содержит анимацию, стикер или видео")
         return True
     
     # Проверяем документ с изображением
     if message.document:
-        mime_type = getattr(message.document, 'mime_type', '')
-        file_name = getattr(message.document, 'file_name', '').lower()
+        mime_type = message.document.mime_type or ''
+        file_name = (message.document.file_name or '').lower()
         
-        logging.info(f"Документ: MIME-type={mime_type}, file_name={file_name}")
+        trace("Документ: MIME-type=%s, file_name=%s", mime_type, file_name)
         
         # Проверяем MIME-type
         if mime_type and mime_type.startswith('image/'):
@@ -105,87 +253,202 @@ async def is_image_message(message):
     
     # Проверяем, есть ли медиагруппа (альбом изображений)
     if message.media_group_id:
-        logging.info(f"Сообщение является частью медиагруппы: {message.media_group_id}")
+        trace("Сообщение является частью медиагруппы: %s", message.media_group_id)
         # Проверяем, есть ли фото в медиагруппе
         if message.photo:
             return True
     
     return False
 
-async def check_image_for_banned_words(message, context):
-    """Проверяет изображение на наличие запрещенных слов с помощью OCR"""
+async def check_image_for_banned_words(message, context, risk=0.0, deferred=False):
+    """
+    Проверяет изображение на наличие запрещенных слов с помощью OCR (сработавшее правило или False).
+    risk - оценка риска (очередность в OCR), deferred - отложенная проверка, ждет места дольше.
+    """
     try:
         # Получаем файл изображения
         if message.photo:
-            # Берем самое большое изображение (последний элемент в списке)
-            file_id = message.photo[-1].file_id
-            logging.info(f"Обрабатываем фото с file_id: {file_id}")
-        elif message.document:
-            file_id = message.document.file_id
-            logging.info(f"Обрабатываем документ с file_id: {file_id}")
+            # Ключ кэша - самое большое изображение, распознаем начиная со среднего размера
+            attachment = message.photo[-1]
+            tiers = [MediaTier(size, None) for size in select_photo_tiers(message.photo)]
+            trace("Обрабатываем фото с file_id: %s", attachment.file_id)
         else:
-            logging.warning("Неизвестный тип изображения")
-            return False
-            
-        file = await context.bot.get_file(file_id)
-        logging.info(f"Получили файл: {file.file_path}")
+            # Документ, стикер или анимация: сначала превью, затем кадры самого файла
+            attachment, tiers = media_tiers(message)
+            if not tiers:
+                logging.warning("Неизвестный тип изображения")
+                return False
+            trace("Обрабатываем файл с file_id: %s, уровней проверки: %s", attachment.file_id, len(tiers))
+        file_id = attachment.file_id
         
-        # Скачиваем изображение в память
-        image_bytes = io.BytesIO()
-        await file.download_to_memory(out=image_bytes)
-        image_bytes.seek(0)
+        # Повторно присланную картинку не скачиваем и не распознаем
+        metrics.increment("images")
+        entry = ocr_cache.get(attachment.file_unique_id)
+        if entry is not None:
+            trace("Текст изображения %s взят из кэша", attachment.file_unique_id)
+            return _check_cached_text(entry, message.chat_id)
         
-        # Открываем изображение с PIL
-        try:
-            image = Image.open(image_bytes)
-            logging.info(f"Изображение открыто: {image.size}, формат: {image.format}")
-        except Exception as e:
-            logging.error(f"Ошибка открытия изображения: {e}")
+        # Слишком большие файлы и не картинки отсеиваем по данным из сообщения, ничего не скачивая
+        allowed = []
+        for tier in tiers:
+            reason = precheck(tier.file, still=tier.frames is None)
+            if reason is None:
+                allowed.append(tier)
+            else:
+                metrics.increment("images_rejected")
+                logging.info(f"Файл {tier.file.file_id} не скачивается: {reason}")
+        if not allowed:
             return False
-        
-        # Используем tesseract для распознавания текста
+        tiers = allowed
+            
+        result = None
+        # Уровень, на котором получен последний результат распознавания
+        verdict_tier = None
+        # Место в очереди OCR занимаем до скачивания, чтобы при перегрузке не тратить трафик;
+        # картинки с высоким риском ждут очереди при любой политике
+        wait = (deferred or risk >= RISK_HIGH_SCORE or OCR_OVERLOAD_POLICY == "defer"
+                or (OCR_OVERLOAD_POLICY == "caption" and not message.caption))
         try:
-            extracted_text = pytesseract.image_to_string(image, lang='rus+eng')
-            logging.info(f"Распознанный текст с изображения: {extracted_text}")
-        except Exception as e:
-            logging.error(f"Ошибка OCR: {e}")
+            async with ocr_pool.reserve(wait=wait, priority=risk,
+                                        timeout=RISK_DEFER_TIMEOUT if deferred else None):
+                for tier_number, tier in enumerate(tiers, 1):
+                    try:
+                        image_data = await _download_image(context, tier)
+                    except DownloadRejected as e:
+                        # Остается результат предыдущего уровня, если он был
+                        metrics.increment("images_rejected")
+                        logging.info(f"Скачивание {tier.file.file_id} прервано: {e}")
+                        break
+                    except DownloadError as e:
+                        logging.error(f"Ошибка скачивания {tier.file.file_id}: {e}")
+                        break
+                    
+                    if tier.frames:
+                        # Несколько разных кадров вместо каждого кадра ролика
+                        try:
+                            with metrics.timer("frames"):
+                                frames = await ocr_pool.extract_frames(
+                                    image_data, tier.frames, getattr(tier.file, "duration", None))
+                        except Exception as e:
+                            logging.error(f"Ошибка извлечения кадров из {file_id}: {e}")
+                            break
+                        if not frames:
+                            break
+                        metrics.increment("media_frames", len(frames))
+                        trace("Из файла %s выбрано кадров: %s", file_id, len(frames))
+                    else:
+                        frames = [image_data]
+                    
+                    # Распознаем текст в пуле процессов, не блокируя обработку остальных сообщений
+                    try:
+                        result = await _recognize_frames(frames, message.chat_id)
+                        trace("Распознанный текст с изображения (уровень %s, уверенность %.0f): %s",
+                              tier_number, result.confidence, cap(result.text))
+                        verdict_tier = tier_number
+                    except asyncio.TimeoutError:
+                        logging.error(f"Превышено время распознавания изображения {file_id}")
+                        return False
+                    except Exception as e:
+                        logging.error(f"Ошибка OCR: {e}")
+                        return False
+                    
+                    if tier_number == len(tiers) or image_phrase_manager.find_phrase(result.text, message.chat_id):
+                        break
+                    # Полное разрешение нужно, только если на меньшем ничего надежно не прочитано;
+                    # превью ролика - лишь один кадр, кадры самого файла проверяются всегда
+                    if is_confident(result) and not tiers[tier_number].frames:
+                        break
+                    trace("Мало текста, низкая уверенность или только превью, переходим к уровню %s",
+                          tier_number + 1)
+                    
+                if verdict_tier is not None:
+                    metrics.increment(f"image_tier_{verdict_tier}")
+                    trace("Вердикт по изображению получен на уровне %s из %s", verdict_tier, len(tiers))
+        except OcrOverloaded:
+            metrics.increment("ocr_overloaded")
+            logging.warning(f"Очередь OCR заполнена, изображение {file_id} пропущено "
+                            f"(политика: {OCR_OVERLOAD_POLICY})")
             return False
             
-        extracted_text_lower = extracted_text.lower()
-        
-        # Проверяем каждую строку из запрещенных слов для изображений
-        banned_image_phrases = image_phrase_manager.get_phrases()
-        logging.info(f"Запрещенные фразы для изображений: {banned_image_phrases}")
-        
-        for phrase_line in banned_image_phrases:
-            # Разбиваем строку на отдельные слова
-            words_in_phrase = phrase_line.lower().split()
-            
-            # Пропускаем пустые строки
-            if not words_in_phrase:
-                continue
-                
-            # Проверяем, что все слова из строки присутствуют в распознанном тексте
-            if all(word in extracted_text_lower for word in words_in_phrase):
-                logging.info(f"Найдено запрещенное сочетание слов в изображении: {phrase_line}")
-                return True
-                
-        logging.info("Запрещенных сочетаний слов в изображении не найдено")
-        return False
+        if result is None:
+            return False
+        entry = ocr_cache.put(attachment.file_unique_id, result.text)
+        return _check_cached_text(entry, message.chat_id)
         
     except Exception as e:
         logging.error(f"Ошибка при обработке изображения: {e}")
         return False
 
-async def handle_restricted_message(message, chat, user, context, content_type="контент"):
-    """Обрабатывает сообщение с запрещенной фразой"""
+async def _recognize_frames(frames, chat_id):
+    """Распознает кадры по очереди до первого запрещенного текста, тексты кадров объединяются"""
+    results = []
+    for frame in frames:
+        with metrics.timer("ocr"):
+            result = await ocr_pool.recognize(frame)
+        metrics.observe("decode", result.decode_time)
+        metrics.observe("tesseract", result.tesseract_time)
+        results.append(result)
+        if len(frames) > 1 and image_phrase_manager.find_phrase(result.text, chat_id):
+            break
+    if len(results) == 1:
+        return results[0]
+    return OcrResult(
+        "\n".join(result.text for result in results if result.text),
+        min(result.confidence for result in results),
+        sum(result.decode_time for result in results),
+        sum(result.tesseract_time for result in results),
+        results[0].engine,
+    )
+
+async def _download_image(context, tier):
+    """
+    Скачивает файл уровня в память и возвращает его содержимое. Скачивание прерывается
+    (DownloadRejected) на превышении предела размера или по заголовку картинки.
+    """
+    # Кадры ролика извлекает ffmpeg, у картинки сразу проверяем формат и разрешение
+    still = tier.frames is None
+    with metrics.timer("download"):
+        image_data = await downloader.download(
+            context.bot, tier.file.file_id,
+            max_bytes=DOWNLOAD_MAX_BYTES if still else MEDIA_MAX_BYTES, inspect=still)
+    trace("Скачан файл %s: %s байт", tier.file.file_id, len(image_data))
+    return image_data
+
+def _check_cached_text(entry, chat_id):
+    """Проверка распознанного текста по правилам для картинок чата (вердикт кэшируется до смены списка)"""
+    # Правила заранее собраны в инвертированный индекс, текст разбирается один раз
+    with metrics.timer("image_match"):
+        rule = entry.get_verdict(image_phrase_manager.get_snapshot(chat_id))
+    if rule:
+        logging.info(f"Найдено запрещенное сочетание слов в изображении: {rule.phrase}")
+        return rule
+        
+    trace("Запрещенных сочетаний слов в изображении не найдено")
+    return False
+
+async def handle_restricted_message(message, chat, user, context, content_type="контент", reason=None,
+                                    spam_text=None, shared=True):
+    """
+    Обрабатывает сообщение с запрещенной фразой (reason - сработавшая фраза или правило).
+    spam_text - текст, из-за которого удалено сообщение: его отпечаток запоминается, пока фраза reason
+    остается в списке (подписи к запрещенным картинкам и повторы уже известного спама не запоминаются),
+    shared=False - сработало правило только этого чата, копии текста в других чатах не ищутся.
+    """
     username = f"@{user.username}" if user.username else user.first_name
     
-    # Баним пользователя
-    ban_success = await ban_user(chat, user)
+    # Отпечаток текста нужен, чтобы ловить измененные копии без новых фраз в списке
+    if spam_text:
+        near_duplicates.add(spam_text, chat.id, reason, shared)
+    risk_tracker.record_violation(user.id)
     
-    # Удаляем сообщение
-    delete_success = await delete_message(message, chat, user)
+    # Баним пользователя и удаляем сообщение одновременно (повторный бан не отправляется)
+    metrics.increment("violations")
+    with metrics.timer("enforce"):
+        ban_success, deleted = await enforcer.enforce([message], chat, user)
+    delete_success = deleted == 1
+    audit("violation", chat_id=chat.id, user_id=user.id, username=user.username,
+          content_type=content_type, reason=reason, message_ids=[message.message_id],
+          text=cap(message.text or message.caption or ""), banned=ban_success, deleted=deleted)
     
     # Логируем результат
     log_message = f"Обнаружен запрещенный {content_type} от {username}"
@@ -194,3 +457,31 @@ async def handle_restricted_message(message, chat, user, context, content_type="
         logging.info(f"{log_message} - полностью обработан (бан + удаление)")
     else:
         logging.warning(f"{log_message} - частично обработан (удаление: {delete_success}, бан: {ban_success})")
+
+async def handle_restricted_media_group(messages, chat, user, context, content_type="контент", reason=None,
+                                        spam_text=None, shared=True):
+    """
+    Обрабатывает альбом с запрещенным содержимым: один бан и удаление всех его сообщений.
+    spam_text и shared - как в handle_restricted_message.
+    """
+    username = f"@{user.username}" if user.username else user.first_name
+    
+    if spam_text:
+        near_duplicates.add(spam_text, chat.id, reason, shared)
+    risk_tracker.record_violation(user.id)
+    
+    # Баним пользователя и удаляем все сообщения альбома одновременно
+    metrics.increment("violations")
+    with metrics.timer("enforce"):
+        ban_success, deleted = await enforcer.enforce(messages, chat, user)
+    audit("violation", chat_id=chat.id, user_id=user.id, username=user.username,
+          content_type=content_type, reason=reason, message_ids=[item.message_id for item in messages],
+          media_group_id=messages[0].media_group_id, banned=ban_success, deleted=deleted)
+    
+    # Логируем результат
+    log_message = f"Обнаружен запрещенный {content_type} в альбоме от {username}"
+    
+    if deleted == len(messages) and ban_success:
+        logging.info(f"{log_message} - полностью обработан (бан + удаление {deleted} сообщений)")
+    else:
+        logging.warning(f"{log_message} - частично обработан (удалено: {deleted} из {len(messages)}, бан: {ban_success})")
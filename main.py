@@ -1,45 +1,177 @@
+import os
+import asyncio
 import logging
+import secrets
+import functools
 from config import setup_logging, TOKEN
 from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, MessageHandler, ChatMemberHandler, filters, ContextTypes
 from handlers.message_handlers import handle_message
 from handlers.command_handlers import get_command_handlers
+from handlers.member_handlers import handle_chat_member
+from utils.ocr import ocr_pool
+from utils.downloads import downloader
+from utils.ocr_cache import ocr_cache
+from utils.update_lanes import update_processor, BackpressureQueue, UPDATE_QUEUE_SIZE
+from utils.member_cache import member_cache
+from utils.chat_actions import enforcer
+from utils.near_duplicates import near_duplicates
+from utils.metrics import metrics
+from utils.log_pipeline import log_pipeline
+from utils.risk import risk_tracker
+from utils.phrase_manager import get_phrase_manager
+from utils.phrase_store import get_phrase_store
+from utils.shards import shard_router
+
+# Способ получения обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Настройки webhook: полный адрес для Telegram (включая путь WEBHOOK_PATH)
+# и где слушает встроенный сервер PTB
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "webhook")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token; если не задан, генерируется при запуске
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+# Сколько одновременных соединений Telegram открывает к webhook
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+ALLOWED_UPDATES = ['message', 'edited_message', 'callback_query', 'chat_member']
+
+async def post_init(application: Application):
+    """Запуск эндпоинта метрик Prometheus (если задан METRICS_PORT) и процессов-обработчиков"""
+    metrics.start_server()
+    if shard_router.enabled:
+        shard_router.start()
+
+async def post_shutdown(application: Application):
+    """Остановка обработчиков и процессов OCR, закрытие кэша и базы фраз при завершении бота"""
+    await shard_router.stop()
+    metrics.stop_server()
+    ocr_pool.shutdown()
+    await downloader.close()
+    ocr_cache.close()
+    get_phrase_store().close()
+    log_pipeline.stop()
+
+def register_collectors(sharded=False):
+    """Состояние кэшей и очередей для /stats и Prometheus"""
+    metrics.register_collector("member_cache", member_cache.stats)
+    metrics.register_collector("ocr_cache", lambda: {
+        'hits': ocr_cache.hits,
+        'misses': ocr_cache.misses,
+        'entries': len(ocr_cache),
+    })
+    metrics.register_collector("ocr_pool", ocr_pool.stats)
+    metrics.register_collector("downloads", downloader.stats)
+    metrics.register_collector("text_lane", update_processor.text_lane.stats)
+    metrics.register_collector("image_lane", update_processor.image_lane.stats)
+    metrics.register_collector("updates", lambda: {'pending': update_processor.pending})
+    metrics.register_collector("enforcer", lambda: {'skipped_bans': enforcer.skipped_bans})
+    metrics.register_collector("near_duplicates", near_duplicates.stats)
+    metrics.register_collector("text_phrases", get_phrase_manager("text").stats)
+    metrics.register_collector("image_phrases", get_phrase_manager("image").stats)
+    metrics.register_collector("risk", risk_tracker.stats)
+    metrics.register_collector("logging", lambda: {'dropped': log_pipeline.dropped})
+    if sharded:
+        metrics.register_collector("shards", shard_router.stats)
+        metrics.register_collector("shard_counters", shard_router.worker_counters)
+
+def build_application(token=TOKEN, base_url=None, base_file_url=None, worker=False):
+    """
+    Создает приложение со всеми обработчиками (base_url - для локального сервера Bot API).
+    При SHARD_WORKERS > 0 сообщения групп проверяются в процессах-обработчиках,
+    worker=True - приложение такого обработчика: без приема обновлений и команд.
+    """
+    # Сообщения и изменения участников проверяются здесь или в обработчике, за которым закреплен чат
+    sharded = shard_router.enabled and not worker
+    builder = Application.builder().token(token).post_shutdown(post_shutdown)
+    if sharded:
+        # Принимающий процесс передает обновления по одному в порядке получения:
+        # параллельная обработка в полосах переставляла бы обновления одного чата
+        builder = builder.update_queue(asyncio.Queue(UPDATE_QUEUE_SIZE)).concurrent_updates(False)
+    else:
+        builder = (
+            builder
+            # Ограниченная очередь: при перегрузке прием обновлений замедляется
+            .update_queue(BackpressureQueue(update_processor))
+            # Текст и картинки обрабатываются параллельно в разных полосах
+            .concurrent_updates(update_processor)
+        )
+    if worker:
+        # Обновления передает принимающий процесс
+        builder = builder.updater(None)
+    else:
+        builder = builder.post_init(post_init)
+    if base_url:
+        builder = builder.base_url(base_url).base_file_url(base_file_url or base_url)
+    application = builder.build()
+
+    # Добавляем обработчики команд (команды и списки фраз - в принимающем процессе)
+    if not worker:
+        for handler in get_command_handlers():
+            application.add_handler(handler)
+            logging.info(f"Добавлен обработчик команды: {handler}")
+
+    if sharded:
+        shard_router.configure(functools.partial(build_application, token, base_url, base_file_url, worker=True))
+
+    # Добавляем обработчик сообщений для групп
+    application.add_handler(MessageHandler(
+        filters.ChatType.GROUPS & (
+            filters.TEXT |
+            filters.CAPTION |
+            filters.PHOTO |
+            filters.Document.IMAGE |
+            # Текст в GIF, стикерах, кружках и коротких видео проверяется по кадрам
+            filters.ANIMATION |
+            filters.Sticker.ALL |
+            filters.VIDEO_NOTE |
+            filters.VIDEO
+        ),
+        shard_router.forward if sharded else handle_message
+    ))
+
+    # Изменения участников обновляют кэш статусов (бот должен быть администратором)
+    application.add_handler(ChatMemberHandler(shard_router.forward if sharded else handle_chat_member,
+                                              ChatMemberHandler.CHAT_MEMBER))
+    register_collectors(sharded)
+    return application
 
 def main():
     """Запуск бота"""
     try:
-        # Настройка логирования
+        # Настройка логирования; запись в файл и консоль уходит в фоновый поток
         setup_logging()
-        
+        log_pipeline.start()
+
         # Создаем приложение
-        application = Application.builder().token(TOKEN).build()
+        application = build_application()
 
-        # Добавляем обработчики команд
-        command_handlers = get_command_handlers()
-        for handler in command_handlers:
-            application.add_handler(handler)
-            logging.info(f"Добавлен обработчик команды: {handler}")
-        
-        # Добавляем обработчик сообщений для групп
-        application.add_handler(MessageHandler(
-            filters.ChatType.GROUPS & (
-                filters.TEXT | 
-                filters.CAPTION | 
-                filters.PHOTO | 
-                filters.Document.IMAGE
-            ),
-            handle_message
-        ))
-        
         print("Бот запущен...")
         print("Для остановки нажмите Ctrl+C")
-        
+
         # Запускаем бота
-        application.run_polling(
-            drop_pending_updates=True,  # Игнорировать накопившиеся обновления
-            allowed_updates=['message', 'edited_message', 'callback_query']
-        )
-        
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise ValueError("Для режима webhook нужно указать WEBHOOK_URL")
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=WEBHOOK_URL,
+                # Запросы без правильного секрета сервер PTB отклоняет с кодом 403
+                secret_token=WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32),
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=True,
+                allowed_updates=ALLOWED_UPDATES
+            )
+        else:
+            application.run_polling(
+                drop_pending_updates=True,  # Игнорировать накопившиеся обновления
+                allowed_updates=ALLOWED_UPDATES
+            )
+
     except Exception as e:
         logging.error(f"Ошибка запуска бота: {e}")
         print(f"Ошибка: {e}")
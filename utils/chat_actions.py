@@ -1,12 +1,43 @@
+import os
+import time
+import asyncio
 import logging
-from telegram.error import BadRequest, Forbidden
+from datetime import timedelta
+from collections import OrderedDict
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from utils.recent_messages import recent_messages
+from utils.log_pipeline import audit
+
+# Сколько секунд помнить забаненного пользователя, чтобы не банить его повторно
+RECENT_BAN_TTL = float(os.getenv("RECENT_BAN_TTL", "3600"))
+RECENT_BAN_MAX_SIZE = int(os.getenv("RECENT_BAN_MAX_SIZE", "10000"))
+# Повторы запроса после RetryAfter (429) и максимальная пауза, которую готовы ждать
+RETRY_AFTER_ATTEMPTS = int(os.getenv("RETRY_AFTER_ATTEMPTS", "3"))
+RETRY_AFTER_MAX_DELAY = float(os.getenv("RETRY_AFTER_MAX_DELAY", "60"))
+# Ограничение Bot API на число сообщений в одном вызове deleteMessages
+DELETE_MESSAGES_BATCH = 100
+
+async def call_with_retry(make_call, description):
+    """Выполняет запрос к API, при RetryAfter ждет указанное сервером время и повторяет"""
+    for attempt in range(RETRY_AFTER_ATTEMPTS):
+        try:
+            return await make_call()
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            if delay > RETRY_AFTER_MAX_DELAY:
+                raise
+            logging.warning(f"Ограничение частоты запросов ({description}), повтор через {delay} с")
+            await asyncio.sleep(delay)
+    return await make_call()
 
 async def delete_message(message, chat, user) -> bool:
     """Удаляет сообщение пользователя"""
     username = f"@{user.username}" if user.username else user.first_name
     
     try:
-        await message.delete()
+        await call_with_retry(message.delete, f"удаление сообщения в чате {chat.id}")
         logging.info(f"Удалил сообщение от {username} в чате {chat.id}")
         return True
         
@@ -31,9 +62,9 @@ async def delete_message(message, chat, user) -> bool:
 async def ban_user(chat, user) -> bool:
     """Банит пользователя"""
     try:
-        await chat.ban_member(
-            user_id=user.id,
-            revoke_messages=False
+        await call_with_retry(
+            lambda: chat.ban_member(user_id=user.id, revoke_messages=False),
+            f"бан в чате {chat.id}"
         )
         logging.info(f"Забанил пользователя {user.id} в чате {chat.id}")
         return True
@@ -58,3 +89,105 @@ async def ban_user(chat, user) -> bool:
         logging.error(f"Неизвестная ошибка при бане пользователя {user.id}: {e}")
         return False
 
+async def delete_messages(chat, message_ids) -> int:
+    """Удаляет сообщения пачками по 100 через deleteMessages, возвращает число удаленных"""
+    deleted = 0
+    for start in range(0, len(message_ids), DELETE_MESSAGES_BATCH):
+        batch = message_ids[start:start + DELETE_MESSAGES_BATCH]
+        try:
+            await call_with_retry(
+                lambda: chat.delete_messages(batch),
+                f"удаление {len(batch)} сообщений в чате {chat.id}"
+            )
+            deleted += len(batch)
+        except BadRequest as e:
+            if "not enough rights" in str(e).lower():
+                logging.error(f"Бот не имеет прав на удаление сообщений в чате {chat.id}")
+                break
+            logging.error(f"Ошибка удаления {len(batch)} сообщений в чате {chat.id}: {e}")
+        except Forbidden as e:
+            logging.error(f"Доступ запрещен при удалении сообщений: {e}")
+            break
+        except Exception as e:
+            logging.error(f"Неизвестная ошибка при удалении сообщений: {e}")
+    return deleted
+
+async def purge_recent_messages(chat, user, exclude_ids=()) -> int:
+    """Удаляет недавние сообщения пользователя, запомненные в буфере"""
+    exclude_ids = set(exclude_ids)
+    message_ids = [message_id for message_id in recent_messages.pop(chat.id, user.id)
+                   if message_id not in exclude_ids]
+    if not message_ids:
+        return 0
+    deleted = await delete_messages(chat, message_ids)
+    logging.info(f"Удалено {deleted} недавних сообщений пользователя {user.id} в чате {chat.id}")
+    audit("purge", chat_id=chat.id, user_id=user.id, message_ids=message_ids, deleted=deleted)
+    return deleted
+
+class EnforcementCoalescer:
+    """
+    Объединяет повторные срабатывания: бан и удаление выполняются параллельно,
+    недавно забаненный пользователь повторно не банится (только удаление сообщений),
+    одновременные попытки забанить одного пользователя сводятся к одному запросу.
+    """
+
+    def __init__(self, ttl=RECENT_BAN_TTL, max_size=RECENT_BAN_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.skipped_bans = 0
+        # (chat_id, user_id) -> время успешного бана
+        self._banned = OrderedDict()
+        # (chat_id, user_id) -> задача бана, которая выполняется прямо сейчас
+        self._banning = {}
+
+    def is_recently_banned(self, chat_id, user_id):
+        key = (chat_id, user_id)
+        banned_at = self._banned.get(key)
+        if banned_at is None:
+            return False
+        if time.monotonic() - banned_at > self.ttl:
+            del self._banned[key]
+            return False
+        return True
+
+    def _remember_ban(self, key):
+        self._banned[key] = time.monotonic()
+        self._banned.move_to_end(key)
+        while len(self._banned) > self.max_size:
+            self._banned.popitem(last=False)
+
+    async def _ban(self, chat, user):
+        key = (chat.id, user.id)
+        if self.is_recently_banned(*key):
+            self.skipped_bans += 1
+            return True
+
+        task = self._banning.get(key)
+        if task is None:
+            task = asyncio.ensure_future(ban_user(chat, user))
+            self._banning[key] = task
+            task.add_done_callback(lambda _: self._banning.pop(key, None))
+        else:
+            self.skipped_bans += 1
+
+        success = await asyncio.shield(task)
+        if success:
+            self._remember_ban(key)
+        return success
+
+    async def enforce(self, messages, chat, user):
+        """
+        Банит пользователя и удаляет сообщения одновременно, после бана удаляет
+        и его недавние сообщения. Возвращает (бан, число удаленных нарушающих сообщений).
+        """
+        ban_success, *deleted = await asyncio.gather(
+            self._ban(chat, user),
+            *(delete_message(message, chat, user) for message in messages)
+        )
+        if ban_success:
+            await purge_recent_messages(chat, user, exclude_ids=[message.message_id for message in messages])
+        return ban_success, sum(deleted)
+
+
+# Общий координатор на процесс
+enforcer = EnforcementCoalescer()
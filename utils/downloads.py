@@ -0,0 +1,232 @@
+import io
+import os
+import asyncio
+import contextlib
+import httpx
+from PIL import Image
+from utils.metrics import metrics
+from utils.ocr import OCR_MAX_PIXELS, draft_image
+from utils.media_frames import MEDIA_MAX_BYTES
+
+# Картинки больше этого размера не скачиваются (для видео и анимаций - MEDIA_MAX_BYTES)
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+# Сколько файлов скачивается одновременно; у каждого скачивания свой буфер из пула,
+# поэтому память под скачивание не больше DOWNLOAD_BUFFERS * наибольший предел размера
+DOWNLOAD_BUFFERS = max(1, int(os.getenv("DOWNLOAD_BUFFERS", "4")))
+# Максимальное время скачивания одного файла, секунд
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+# Заголовок картинки проверяется по первым байтам; если формат не определился и к этому
+# пределу, файл отклоняется
+DOWNLOAD_HEADER_LIMIT = int(os.getenv("DOWNLOAD_HEADER_LIMIT", str(512 * 1024)))
+# Буфер больше этого размера при возврате в пул укорачивается: один большой файл
+# не держит память до перезапуска
+DOWNLOAD_BUFFER_KEEP = int(os.getenv("DOWNLOAD_BUFFER_KEEP", str(2 * 1024 * 1024)))
+
+# Документы с картинками, которые умеют открывать Pillow и tesseract
+IMAGE_MIME_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif", "image/bmp", "image/tiff")
+# Форматы по заголовку файла (MPO - JPEG с камер телефонов)
+IMAGE_FORMATS = ("JPEG", "MPO", "PNG", "WEBP", "GIF", "BMP", "TIFF")
+
+# До этого числа байт заголовок не разбирается: его все равно не хватит
+_HEADER_MIN_BYTES = 1024
+
+
+class DownloadRejected(Exception):
+    """Файл не скачивается или скачивание прервано: слишком большой или не картинка"""
+
+
+class DownloadError(Exception):
+    """Ошибка сети или ответ сервера с ошибкой (без адреса файла: в нем токен бота)"""
+
+
+def precheck(file, still=True, max_bytes=None):
+    """
+    Причина не скачивать файл (None - скачивать) по данным из сообщения: размер,
+    разрешение и MIME-тип. still - неподвижная картинка (не кадры видео).
+    """
+    if max_bytes is None:
+        max_bytes = DOWNLOAD_MAX_BYTES if still else MEDIA_MAX_BYTES
+    size = getattr(file, "file_size", None)
+    if size and size > max_bytes:
+        return f"размер {size} байт"
+    if not still:
+        return None
+    width = getattr(file, "width", None)
+    height = getattr(file, "height", None)
+    if width and height and width * height > OCR_MAX_PIXELS:
+        return f"разрешение {width}x{height}"
+    mime_type = getattr(file, "mime_type", None)
+    if mime_type and mime_type not in IMAGE_MIME_TYPES:
+        return f"тип {mime_type}"
+    return None
+
+
+def inspect_header(data):
+    """
+    Формат и размер картинки по заголовку, без декодирования пикселей
+    (None, если заголовок еще не получен целиком или формат не узнан). Выбрасывает DownloadRejected.
+    Размер JPEG - после уменьшения в декодере, как при распознавании.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format, (width, height) = image.format, draft_image(image)
+    except (OSError, SyntaxError, ValueError):
+        # Pillow не узнал формат или заголовок оборван: возможно, нужно больше байт
+        return None
+    except Image.DecompressionBombError:
+        raise DownloadRejected("слишком большое разрешение") from None
+    if image_format not in IMAGE_FORMATS:
+        raise DownloadRejected(f"формат {image_format}")
+    if width * height > OCR_MAX_PIXELS:
+        raise DownloadRejected(f"разрешение {width}x{height}")
+    return image_format, width, height
+
+
+def _inspect(buffer, size):
+    """inspect_header по первым size байтам буфера без копирования среза"""
+    # Представление освобождается сразу: пока оно есть, буфер нельзя удлинять
+    with memoryview(buffer) as view, view[:size] as head:
+        return inspect_header(head)
+
+
+class BufferPool:
+    """
+    Переиспользуемые буферы для скачивания. Буфер растет до размера скачиваемого файла
+    и дальше перезаписывается; в пул он возвращается не длиннее keep байт.
+    Когда все буферы заняты, скачивание ждет.
+    """
+
+    def __init__(self, count=DOWNLOAD_BUFFERS, keep=DOWNLOAD_BUFFER_KEEP):
+        self.count = count
+        self.keep = keep
+        self._free = []
+        self._allocated = 0
+        self._semaphore = None
+        self.waits = 0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        # Семафор создается внутри работающего цикла событий
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.count)
+        if self._semaphore.locked():
+            self.waits += 1
+        async with self._semaphore:
+            if self._free:
+                buffer = self._free.pop()
+            else:
+                buffer = bytearray()
+                self._allocated += 1
+            try:
+                yield buffer
+            finally:
+                if len(buffer) > self.keep:
+                    del buffer[self.keep:]
+                self._free.append(buffer)
+
+    def stats(self):
+        return {
+            'buffers': self._allocated,
+            'in_use': self._allocated - len(self._free),
+            'free_bytes': sum(len(buffer) for buffer in self._free),
+            'waits': self.waits,
+        }
+
+
+class Downloader:
+    """Потоковое скачивание файлов Telegram в буферы пула с ограничением размера"""
+
+    def __init__(self, pool=None, timeout=DOWNLOAD_TIMEOUT):
+        self.pool = pool or BufferPool()
+        self.timeout = timeout
+        self._client = None
+        self.rejected = 0
+        self.aborted = 0
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    async def download(self, bot, file_id, max_bytes=DOWNLOAD_MAX_BYTES, inspect=True):
+        """
+        Содержимое файла (bytes). Скачивание прерывается, как только файл превысил
+        max_bytes или (при inspect) заголовок показал не картинку или слишком большое разрешение.
+        """
+        file = await bot.get_file(file_id)
+        if file.file_size and file.file_size > max_bytes:
+            self.rejected += 1
+            raise DownloadRejected(f"размер {file.file_size} байт")
+        url = file.file_path
+        if not url.startswith(("http://", "https://")):
+            # Локальный сервер Bot API отдает путь к файлу на диске
+            data = bytes(await file.download_as_bytearray())
+            if len(data) > max_bytes:
+                raise DownloadRejected(f"размер {len(data)} байт")
+            if inspect and inspect_header(data) is None:
+                raise DownloadRejected("не удалось определить формат")
+            return data
+
+        async with self.pool.acquire() as buffer:
+            try:
+                size, checked = await self._stream(url, buffer, max_bytes, inspect)
+            except httpx.HTTPStatusError as e:
+                # Текст исключений httpx содержит адрес файла вместе с токеном бота
+                raise DownloadError(f"HTTP {e.response.status_code}") from None
+            except httpx.HTTPError as e:
+                raise DownloadError(type(e).__name__) from None
+            if not checked and _inspect(buffer, size) is None:
+                self.rejected += 1
+                raise DownloadRejected("не удалось определить формат")
+            metrics.increment("download_bytes", size)
+            # Копия нужного размера: буфер возвращается в пул, а данные уходят в процесс OCR
+            with memoryview(buffer) as view:
+                return bytes(view[:size])
+
+    async def _stream(self, url, buffer, max_bytes, inspect):
+        """
+        Скачивание в буфер по частям; возвращает (размер, проверен ли заголовок).
+        Заголовок разбирается дважды: после первых _HEADER_MIN_BYTES и на DOWNLOAD_HEADER_LIMIT.
+        """
+        size = 0
+        checked = not inspect
+        next_check = _HEADER_MIN_BYTES
+        async with self._get_client().stream("GET", url) as response:
+            response.raise_for_status()
+            length = int(response.headers.get("Content-Length") or 0)
+            if length > max_bytes:
+                self.rejected += 1
+                raise DownloadRejected(f"размер {length} байт")
+            async for chunk in response.aiter_bytes():
+                end = size + len(chunk)
+                if end > max_bytes:
+                    self.aborted += 1
+                    raise DownloadRejected(f"больше {max_bytes} байт")
+                # Перезапись старого содержимого; буфер удлиняется, только если файл больше прежних
+                buffer[size:end] = chunk
+                size = end
+                if not checked and size >= next_check:
+                    try:
+                        checked = _inspect(buffer, size) is not None
+                    except DownloadRejected:
+                        # Дальше не качаем: картинка все равно не будет распознаваться
+                        self.aborted += 1
+                        raise
+                    if not checked:
+                        if next_check >= DOWNLOAD_HEADER_LIMIT:
+                            self.aborted += 1
+                            raise DownloadRejected("не удалось определить формат")
+                        next_check = DOWNLOAD_HEADER_LIMIT
+        return size, checked
+
+    def stats(self):
+        return {'rejected': self.rejected, 'aborted': self.aborted, **self.pool.stats()}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Общий на процесс
+downloader = Downloader()
@@ -0,0 +1,103 @@
+import re
+from collections import namedtuple
+from utils.matcher import PhraseMatcher
+from utils.normalization import normalize_text
+
+# Режимы сравнения слов правила с распознанным текстом
+MODE_SUBSTRING = "substring"  # слово может быть частью другого слова (как раньше)
+MODE_TOKEN = "token"          # слово должно совпасть с целым словом текста
+
+# Префикс строки в banned_words_image.txt, включающий поиск только целых слов
+TOKEN_MODE_PREFIX = "="
+
+# Слова нормализованного текста (знаки препинания внутри слова, как в "t.me", - его часть)
+TOKEN_RE = re.compile(r"\S+")
+
+# Правило для картинок: исходная строка, режим и набор слов, которые должны встретиться все
+ImageRule = namedtuple("ImageRule", ["phrase", "mode", "words"])
+
+
+def parse_rule(line):
+    """Разбор строки из списка запрещенных слов для картинок"""
+    line = line.strip()
+    if line.startswith(TOKEN_MODE_PREFIX):
+        mode = MODE_TOKEN
+        words = TOKEN_RE.findall(normalize_text(line[len(TOKEN_MODE_PREFIX):]))
+    else:
+        mode = MODE_SUBSTRING
+        words = normalize_text(line).split()
+    return ImageRule(line, mode, tuple(dict.fromkeys(words)))
+
+
+def rule_key(line):
+    """Ключ правила для поиска дублей: режим и нормализованные слова (пусто для пустого правила)"""
+    rule = parse_rule(line)
+    if not rule.words:
+        return ""
+    prefix = TOKEN_MODE_PREFIX if rule.mode == MODE_TOKEN else ""
+    return prefix + " ".join(rule.words)
+
+
+class ImageRuleIndex:
+    """
+    Инвертированный индекс правил для картинок: слово -> правила, в которых оно встречается.
+    Текст с картинки разбирается один раз, срабатывают только правила,
+    все слова которых найдены.
+    """
+
+    def __init__(self, lines):
+        self.rules = []
+        self._token_index = {}
+        self._substring_index = {}
+
+        for line in lines:
+            rule = parse_rule(line)
+            # Пропускаем пустые строки
+            if not rule.words:
+                continue
+            rule_id = len(self.rules)
+            self.rules.append(rule)
+            index = self._token_index if rule.mode == MODE_TOKEN else self._substring_index
+            for word in rule.words:
+                index.setdefault(word, []).append(rule_id)
+
+        # Слова-подстроки ищем одним проходом автомата по всему тексту
+        # (слова уже нормализованы, текст нормализуется один раз в iter_matches)
+        self._substring_matcher = PhraseMatcher(self._substring_index, normalizer=None)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def iter_matches(self, text, normalized=False):
+        """Генератор сработавших правил (normalized=True - текст уже нормализован)"""
+        hits = [0] * len(self.rules)
+        if not normalized:
+            text = normalize_text(text)
+
+        def collect(word, index):
+            for rule_id in index[word]:
+                hits[rule_id] += 1
+                if hits[rule_id] == len(self.rules[rule_id].words):
+                    yield self.rules[rule_id]
+
+        if self._token_index:
+            for token in set(TOKEN_RE.findall(text)):
+                if token in self._token_index:
+                    yield from collect(token, self._token_index)
+
+        if self._substring_index:
+            found = set()
+            for match in self._substring_matcher.iter_matches(text):
+                if match.phrase not in found:
+                    found.add(match.phrase)
+                    yield from collect(match.phrase, self._substring_index)
+
+    def find_all(self, text):
+        """Все сработавшие правила"""
+        return list(self.iter_matches(text))
+
+    def search(self, text):
+        """Первое сработавшее правило или None"""
+        for rule in self.iter_matches(text):
+            return rule
+        return None
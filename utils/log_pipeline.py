@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Формат основного лога: "text" (как раньше) или "json" (одна запись - одна строка JSON)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Доля сообщений, для которых пишутся подробные строки обработки (1 - все, 0 - ни одного)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+# Максимальная длина больших вставок в лог (текст с картинки и т.п.)
+LOG_PAYLOAD_LIMIT = int(os.getenv("LOG_PAYLOAD_LIMIT", "300"))
+# Максимальная длина одной записи лога
+LOG_MAX_MESSAGE = int(os.getenv("LOG_MAX_MESSAGE", "2000"))
+# Сколько записей может ждать записи на диск; сверх этого записи отбрасываются
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Журнал действий модерации (баны, удаления, изменения списков) пишется всегда
+AUDIT_LOG_FILE = os.getenv("AUDIT_LOG_FILE", "audit.log")
+AUDIT_LOG_MAX_BYTES = int(os.getenv("AUDIT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+AUDIT_LOG_BACKUPS = int(os.getenv("AUDIT_LOG_BACKUPS", "5"))
+
+trace_logger = logging.getLogger("moderator.trace")
+audit_logger = logging.getLogger("moderator.audit")
+audit_logger.setLevel(logging.INFO)
+audit_logger.propagate = False
+
+# Пишутся ли подробные строки для текущего сообщения (у каждого обновления свой контекст)
+_tracing = contextvars.ContextVar("log_tracing", default=False)
+
+# Стандартные поля LogRecord, все остальное - структурированные поля из extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def cap(text, limit=LOG_PAYLOAD_LIMIT):
+    """Обрезает большую вставку в лог"""
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... (+{len(text) - limit} символов)"
+
+
+def start_trace():
+    """Решает, попадут ли в лог подробные строки обработки текущего сообщения"""
+    tracing = LOG_SAMPLE_RATE >= 1 or (LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE)
+    _tracing.set(tracing)
+    return tracing
+
+
+def trace(message, *args):
+    """
+    Подробная строка обработки сообщения: пишется только для выбранной доли сообщений.
+    Аргументы подставляются в message (%s) лишь при записи, поэтому для остальных
+    сообщений строка даже не форматируется.
+    """
+    if _tracing.get():
+        trace_logger.info(message, *args)
+
+
+def audit(event, **fields):
+    """Запись в журнал действий модерации"""
+    audit_logger.info(event, extra={'event': event, **fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в одну строку JSON вместе с полями из extra"""
+
+    def format(self, record):
+        data = {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+                    + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Передает записи в очередь фонового потока: обработчик на цикле событий
+    только форматирует строку. При переполнении очереди запись отбрасывается.
+    """
+
+    def __init__(self, log_queue, max_message=LOG_MAX_MESSAGE):
+        super().__init__(log_queue)
+        self.max_message = max_message
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        if len(record.msg) > self.max_message:
+            record.msg = cap(record.msg, self.max_message)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Фоновая запись основного лога и журнала действий модерации"""
+
+    def __init__(self):
+        self.queue_handler = None
+        self._handlers = []
+        self._audit_handler = None
+        self._listeners = []
+
+    @property
+    def dropped(self):
+        return self.queue_handler.dropped if self.queue_handler else 0
+
+    def start(self):
+        """
+        Переносит обработчики, настроенные config.setup_logging (файл и консоль),
+        в фоновый поток; в корневом логгере остается только очередь.
+        """
+        if self._listeners:
+            return
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        if handlers:
+            if LOG_FORMAT == "json":
+                for handler in handlers:
+                    handler.setFormatter(JsonFormatter())
+            self.queue_handler = BoundedQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            for handler in handlers:
+                root.removeHandler(handler)
+            root.addHandler(self.queue_handler)
+            self._handlers = handlers
+            self._listeners.append(
+                QueueListener(self.queue_handler.queue, *handlers, respect_handler_level=True)
+            )
+
+        if AUDIT_LOG_FILE:
+            audit_handler = RotatingFileHandler(AUDIT_LOG_FILE, maxBytes=AUDIT_LOG_MAX_BYTES,
+                                                backupCount=AUDIT_LOG_BACKUPS, encoding="utf-8")
+            audit_handler.setFormatter(JsonFormatter())
+            # Журнал не теряет записи: очередь без ограничения, события редкие
+            audit_queue = queue.Queue()
+            audit_logger.addHandler(QueueHandler(audit_queue))
+            self._listeners.append(QueueListener(audit_queue, audit_handler))
+            self._audit_handler = audit_handler
+
+        for listener in self._listeners:
+            listener.start()
+
+    def stop(self):
+        """Дописывает оставшиеся в очередях записи и возвращает обычную синхронную запись"""
+        for listener in self._listeners:
+            listener.stop()
+        self._listeners = []
+        root = logging.getLogger()
+        if self.queue_handler is not None:
+            root.removeHandler(self.queue_handler)
+            self.queue_handler = None
+        for handler in self._handlers:
+            root.addHandler(handler)
+        self._handlers = []
+        for handler in list(audit_logger.handlers):
+            audit_logger.removeHandler(handler)
+        if self._audit_handler is not None:
+            self._audit_handler.close()
+            self._audit_handler = None
+
+
+# Общий на процесс
+log_pipeline = LogPipeline()
@@ -0,0 +1,94 @@
+from collections import deque, namedtuple
+from utils.normalization import normalize_text
+
+# Найденное вхождение: исходная фраза и позиция [start, end) в нормализованном тексте
+Match = namedtuple("Match", ["phrase", "start", "end"])
+
+
+class PhraseMatcher:
+    """
+    Автомат Ахо-Корасик для поиска всех запрещенных фраз за один проход по тексту.
+    Строится один раз при изменении списка фраз. Фразы и текст проходят одну и ту же
+    нормализацию (регистр, двойники букв, невидимые символы); normalizer=None - для уже
+    нормализованных фраз и текста.
+    """
+
+    def __init__(self, phrases, normalizer=normalize_text):
+        self.normalizer = normalizer
+        self.phrases = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+
+        seen = set()
+        for phrase in phrases:
+            key = normalizer(phrase) if normalizer else phrase.strip()
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            self.phrases.append(phrase.strip())
+            self._add(key, len(self.phrases) - 1)
+
+        self._build_links()
+
+    def _add(self, key, index):
+        """Добавление фразы в бор"""
+        state = 0
+        for ch in key:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        self._out[state] = self._out[state] + ((index, len(key)),)
+
+    def _build_links(self):
+        """Построение суффиксных ссылок обходом в ширину"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[next_state] = fail
+                # Сразу объединяем выходы, чтобы при поиске не ходить по ссылкам
+                self._out[next_state] = self._out[next_state] + self._out[fail]
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def iter_matches(self, text, normalized=False):
+        """
+        Генератор всех вхождений фраз в текст (в порядке окончания вхождения).
+        normalized=True - текст уже нормализован (например, для поиска несколькими автоматами).
+        """
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        phrases = self.phrases
+        state = 0
+        if self.normalizer and not normalized:
+            text = self.normalizer(text)
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for index, length in out[state]:
+                    yield Match(phrases[index], i + 1 - length, i + 1)
+
+    def find_all(self, text):
+        """Список всех вхождений фраз в текст"""
+        return list(self.iter_matches(text))
+
+    def search(self, text):
+        """Первое найденное вхождение или None"""
+        for match in self.iter_matches(text):
+            return match
+        return None
@@ -0,0 +1,199 @@
+import io
+import os
+import glob
+import time
+import shutil
+import tempfile
+import subprocess
+from collections import namedtuple
+from PIL import Image
+from utils.ocr_cache import dhash_image, hamming_distance
+
+# Проверка текста в GIF, анимациях, стикерах и видео (0 - только фото и картинки-документы)
+MEDIA_OCR_ENABLED = os.getenv("MEDIA_OCR_ENABLED", "1") == "1"
+# Файлы больше этого размера не скачиваются, проверяется только превью
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(8 * 1024 * 1024)))
+# Из видео длиннее этого (секунд) кадры берутся только из начала
+MEDIA_MAX_DURATION = float(os.getenv("MEDIA_MAX_DURATION", "60"))
+# Сколько кадров-кандидатов равномерно выбирается из ролика
+MEDIA_CANDIDATE_FRAMES = int(os.getenv("MEDIA_CANDIDATE_FRAMES", "12"))
+# Сколько разных кадров распознается (остальные кандидаты - повторы сцен)
+MEDIA_MAX_FRAMES = int(os.getenv("MEDIA_MAX_FRAMES", "3"))
+# Расстояние Хэмминга между dHash, начиная с которого кадр считается новой сценой
+MEDIA_SCENE_DISTANCE = int(os.getenv("MEDIA_SCENE_DISTANCE", "10"))
+# Ограничение процессорного времени на извлечение кадров из одного файла, секунд
+MEDIA_CPU_SECONDS = float(os.getenv("MEDIA_CPU_SECONDS", "5"))
+# Кадры больше этого числа пикселей не разворачиваются (защита от "бомб")
+MEDIA_MAX_PIXELS = int(os.getenv("MEDIA_MAX_PIXELS", str(4096 * 4096)))
+# Сколько пикселей всего может развернуть Pillow при переходе по кадрам GIF/WebP
+# (seek декодирует все кадры до нужного); у длинных анимаций кадры берутся только из начала
+MEDIA_MAX_DECODE_PIXELS = int(os.getenv("MEDIA_MAX_DECODE_PIXELS", str(100 * 1000 * 1000)))
+# Длинная сторона кадра, до которой ffmpeg уменьшает видео
+MEDIA_FRAME_SIDE = int(os.getenv("MEDIA_FRAME_SIDE", "1280"))
+# ffmpeg нужен для видео (MP4, WebM); GIF и WebP разбираются средствами Pillow
+FFMPEG_PATH = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg")
+
+# Способы получения кадров
+FRAMES_PILLOW = "pillow"
+FRAMES_FFMPEG = "ffmpeg"
+
+# Уровень проверки: файл Telegram и способ получения кадров (None - обычная картинка)
+MediaTier = namedtuple("MediaTier", ["file", "frames"])
+
+_PILLOW_MIME_TYPES = ("image/gif", "image/webp")
+
+
+class MediaTooLarge(Exception):
+    """Кадр слишком большой для распознавания"""
+
+
+def _frames_mode(mime_type):
+    """Чем разбирать файл с несколькими кадрами (None, если разобрать нечем)"""
+    if mime_type in _PILLOW_MIME_TYPES:
+        return FRAMES_PILLOW
+    if FFMPEG_PATH:
+        return FRAMES_FFMPEG
+    return None
+
+
+def _with_thumbnail(media, frames_mode):
+    """Сначала превью (часто его хватает), затем кадры самого файла, если его можно разобрать"""
+    tiers = []
+    if media.thumbnail is not None:
+        tiers.append(MediaTier(media.thumbnail, None))
+    if frames_mode and (media.file_size or 0) <= MEDIA_MAX_BYTES:
+        tiers.append(MediaTier(media, frames_mode))
+    return tiers
+
+
+def get_media(message):
+    """Анимация, стикер, кружок или видео в сообщении (None, если их нет или проверка отключена)"""
+    if not MEDIA_OCR_ENABLED:
+        return None
+    return message.animation or message.sticker or message.video_note or message.video
+
+
+def media_tiers(message):
+    """
+    Что скачивать и распознавать для сообщения без фото: (основной файл, [MediaTier]).
+    Основной файл - ключ кэша OCR; (None, []), если проверять нечего.
+    """
+    media = get_media(message)
+    if media is None:
+        document = message.document
+        if document is None:
+            return None, []
+        if MEDIA_OCR_ENABLED and document.mime_type in _PILLOW_MIME_TYPES:
+            return document, _with_thumbnail(document, FRAMES_PILLOW)
+        return document, [MediaTier(document, None)]
+    if message.sticker is not None:
+        if media.is_video:
+            return media, _with_thumbnail(media, _frames_mode("video/webm"))
+        if media.is_animated:
+            # Анимированный стикер (Lottie) не отрисовать без отдельной библиотеки
+            return media, _with_thumbnail(media, None)
+        return media, [MediaTier(media, None)]
+    # Кружки без mime_type всегда в MP4
+    return media, _with_thumbnail(media, _frames_mode(getattr(media, "mime_type", None) or "video/mp4"))
+
+
+def _select_scenes(frames, max_frames=MEDIA_MAX_FRAMES, distance=MEDIA_SCENE_DISTANCE):
+    """
+    Оставляет первый кадр каждой сцены: кадр пропускается, если он похож (по dHash)
+    на уже выбранный. frames - итератор картинок PIL в порядке времени.
+    """
+    selected = []
+    hashes = []
+    for frame in frames:
+        phash = dhash_image(frame)
+        if any(hamming_distance(phash, seen) < distance for seen in hashes):
+            continue
+        hashes.append(phash)
+        selected.append(frame)
+        if len(selected) >= max_frames:
+            break
+    return selected
+
+
+def _sample_indices(count, candidates):
+    """Равномерно распределенные номера кадров, включая первый и последний"""
+    if count <= candidates:
+        return list(range(count))
+    step = (count - 1) / (candidates - 1)
+    return sorted({round(i * step) for i in range(candidates)})
+
+
+def _pillow_frames(data, candidates, deadline):
+    """
+    Кадры GIF/WebP. Pillow разворачивает кадры последовательно и прервать seek нельзя,
+    поэтому число просматриваемых кадров ограничено заранее по числу пикселей,
+    а время проверяется между выбранными кадрами.
+    """
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if width * height > MEDIA_MAX_PIXELS:
+        raise MediaTooLarge(f"кадр {width}x{height}")
+    count = min(getattr(image, "n_frames", 1), max(1, MEDIA_MAX_DECODE_PIXELS // (width * height)))
+    for index in _sample_indices(count, candidates):
+        if index and time.process_time() > deadline:
+            break
+        image.seek(index)
+        yield image.convert("RGB")
+
+
+def _limit_cpu(seconds):
+    def apply():
+        import resource
+        limit = max(1, int(seconds))
+        resource.setrlimit(resource.RLIMIT_CPU, (limit, limit + 1))
+    return apply
+
+
+def _ffmpeg_frames(data, candidates, duration, cpu_seconds):
+    """Кадры видео через ffmpeg: равномерно по длительности, уменьшенные до MEDIA_FRAME_SIDE"""
+    duration = min(duration or MEDIA_MAX_DURATION, MEDIA_MAX_DURATION)
+    fps = candidates / max(duration, 1)
+    with tempfile.TemporaryDirectory(prefix="frames_") as directory:
+        # MP4 читается из файла: индекс ролика бывает в конце, из потока его не найти
+        source = os.path.join(directory, "source")
+        with open(source, "wb") as f:
+            f.write(data)
+        side = MEDIA_FRAME_SIDE
+        command = [
+            FFMPEG_PATH, "-v", "error", "-nostdin", "-threads", "1",
+            "-t", str(duration), "-i", source,
+            "-vf", f"fps={fps:.4f},scale='min({side},iw)':'min({side},ih)':force_original_aspect_ratio=decrease",
+            "-frames:v", str(candidates), os.path.join(directory, "frame_%03d.png"),
+        ]
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+                       timeout=cpu_seconds * 2 + 5,
+                       preexec_fn=_limit_cpu(cpu_seconds) if os.name == "posix" else None)
+        for path in sorted(glob.glob(os.path.join(directory, "frame_*.png"))):
+            with Image.open(path) as frame:
+                yield frame.convert("RGB")
+
+
+def _encode(frame):
+    buffer = io.BytesIO()
+    frame.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def extract_frames(data, mode, duration=None, candidates=MEDIA_CANDIDATE_FRAMES,
+                   max_frames=MEDIA_MAX_FRAMES, cpu_seconds=MEDIA_CPU_SECONDS):
+    """
+    Несколько разных кадров файла для OCR (список PNG). Выполняется в процессе пула OCR.
+    Кадры выбираются равномерно по времени, повторы одной сцены пропускаются.
+    """
+    try:
+        if mode == FRAMES_PILLOW:
+            frames = _pillow_frames(data, candidates, time.process_time() + cpu_seconds)
+        else:
+            frames = _ffmpeg_frames(data, candidates, duration, cpu_seconds)
+        return [_encode(frame) for frame in _select_scenes(frames, max_frames)]
+    except subprocess.CalledProcessError as e:
+        error = e.stderr.decode("utf-8", "replace").strip()[-300:]
+        raise RuntimeError(f"ffmpeg завершился с кодом {e.returncode}: {error}") from None
+    except Exception as e:
+        # Как и в _recognize: исключение должно пережить передачу между процессами
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
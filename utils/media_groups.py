@@ -0,0 +1,58 @@
+import os
+import asyncio
+import time
+
+# Сколько ждать следующих частей альбома после последней полученной, секунд
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.0"))
+# Максимальное время сбора одного альбома, секунд
+MEDIA_GROUP_MAX_WAIT = float(os.getenv("MEDIA_GROUP_MAX_WAIT", "5.0"))
+
+
+class MediaGroupCollector:
+    """
+    Собирает сообщения одного альбома (общий media_group_id), которые приходят
+    отдельными обновлениями, чтобы проверить и обработать их как единое целое.
+    """
+
+    def __init__(self, window=MEDIA_GROUP_WINDOW, max_wait=MEDIA_GROUP_MAX_WAIT):
+        self.window = window
+        self.max_wait = max_wait
+        # (chat_id, media_group_id) -> [сообщения, время последнего добавления]
+        self._groups = {}
+
+    def add(self, message):
+        """
+        Добавляет сообщение в альбом.
+        Возвращает True для первого сообщения альбома - вызывающий должен запустить обработку.
+        """
+        key = (message.chat_id, message.media_group_id)
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = [[message], time.monotonic()]
+            return True
+        group[0].append(message)
+        group[1] = time.monotonic()
+        return False
+
+    async def wait_for_group(self, chat_id, media_group_id):
+        """Ждет, пока части альбома перестанут приходить, и возвращает все его сообщения"""
+        key = (chat_id, media_group_id)
+        started = time.monotonic()
+        while True:
+            group = self._groups.get(key)
+            if group is None:
+                return []
+            # Окно отсчитывается от последней полученной части альбома
+            remaining = group[1] + self.window - time.monotonic()
+            if remaining <= 0 or time.monotonic() - started >= self.max_wait:
+                break
+            await asyncio.sleep(min(remaining, self.max_wait - (time.monotonic() - started)))
+        messages = self._groups.pop(key)[0]
+        return sorted(messages, key=lambda message: message.message_id)
+
+    def __len__(self):
+        return len(self._groups)
+
+
+# Общий сборщик на процесс
+media_group_collector = MediaGroupCollector()
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+# Сколько секунд доверять сохраненному статусу участника
+MEMBER_CACHE_TTL = float(os.getenv("MEMBER_CACHE_TTL", "600"))
+# Максимум записей о пользователях и о чатах
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "50000"))
+MEMBER_CACHE_CHATS = int(os.getenv("MEMBER_CACHE_CHATS", "1000"))
+
+ADMIN_STATUSES = ('administrator', 'creator')
+
+
+class MemberStatusCache:
+    """
+    Кэш статусов участников с ограничением по времени жизни и размеру.
+    Список администраторов чата загружается одним запросом get_chat_administrators,
+    поэтому для обычного участника сетевой запрос не нужен.
+    """
+
+    def __init__(self, ttl=MEMBER_CACHE_TTL, max_size=MEMBER_CACHE_SIZE, max_chats=MEMBER_CACHE_CHATS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_chats = max_chats
+        self.hits = 0
+        self.misses = 0
+        # (chat_id, user_id) -> (status, время записи); заполняется из обновлений chat_member
+        self._members = OrderedDict()
+        # chat_id -> ({user_id: status} администраторов, время загрузки)
+        self._admins = OrderedDict()
+        # chat_id -> задача загрузки администраторов, чтобы параллельные промахи не дублировали запрос
+        self._loading = {}
+
+    def _is_fresh(self, stored_at):
+        return time.monotonic() - stored_at < self.ttl
+
+    def get(self, chat_id, user_id):
+        """Статус из кэша или None, если его нужно запросить"""
+        key = (chat_id, user_id)
+        item = self._members.get(key)
+        if item is not None:
+            if self._is_fresh(item[1]):
+                self._members.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            del self._members[key]
+
+        admins = self._admins.get(chat_id)
+        if admins is not None:
+            if self._is_fresh(admins[1]):
+                self._admins.move_to_end(chat_id)
+                self.hits += 1
+                return admins[0].get(user_id, 'member')
+            del self._admins[chat_id]
+
+        self.misses += 1
+        return None
+
+    def set(self, chat_id, user_id, status):
+        """Сохранение статуса конкретного пользователя"""
+        key = (chat_id, user_id)
+        self._members[key] = (status, time.monotonic())
+        self._members.move_to_end(key)
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+
+        # Поддерживаем актуальность загруженного списка администраторов
+        admins = self._admins.get(chat_id)
+        if admins is not None:
+            if status in ADMIN_STATUSES:
+                admins[0][user_id] = status
+            else:
+                admins[0].pop(user_id, None)
+
+    def set_admins(self, chat_id, administrators):
+        """Сохранение списка администраторов чата (результат get_chat_administrators)"""
+        self._admins[chat_id] = (
+            {member.user.id: member.status for member in administrators},
+            time.monotonic(),
+        )
+        self._admins.move_to_end(chat_id)
+        while len(self._admins) > self.max_chats:
+            self._admins.popitem(last=False)
+
+    def invalidate(self, chat_id, user_id=None):
+        """Сброс записи пользователя или всего чата"""
+        if user_id is None:
+            self._admins.pop(chat_id, None)
+            for key in [key for key in self._members if key[0] == chat_id]:
+                del self._members[key]
+        else:
+            self._members.pop((chat_id, user_id), None)
+
+    async def get_status(self, chat, user_id):
+        """Статус пользователя в чате, при промахе кэша - один запрос списка администраторов"""
+        status = self.get(chat.id, user_id)
+        if status is not None:
+            return status
+
+        task = self._loading.get(chat.id)
+        if task is None:
+            task = asyncio.ensure_future(chat.get_administrators())
+            self._loading[chat.id] = task
+            # Результат сохраняется из самой задачи: отмена первого ожидающего не должна
+            # оставлять остальных без списка администраторов
+            task.add_done_callback(lambda done, chat_id=chat.id: self._loaded(chat_id, done))
+        administrators = await asyncio.shield(task)
+        for member in administrators:
+            if member.user.id == user_id:
+                return member.status
+        return 'member'
+
+    def _loaded(self, chat_id, task):
+        """Завершение загрузки администраторов: запись в кэш и снятие задачи"""
+        if self._loading.get(chat_id) is task:
+            del self._loading[chat_id]
+        if not task.cancelled() and task.exception() is None:
+            self.set_admins(chat_id, task.result())
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'members': len(self._members),
+            'chats': len(self._admins),
+        }
+
+
+# Общий кэш на процесс
+member_cache = MemberStatusCache()
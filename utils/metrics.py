@@ -0,0 +1,282 @@
+import os
+import time
+import logging
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Сбор времени этапов и счетчиков (выключается значением 0)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Порт локального HTTP-эндпоинта в формате Prometheus (0 - не запускать)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Сколько последних замеров каждого этапа хранится для расчета перцентилей
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "2048"))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Названия этапов для /stats
+STAGE_TITLES = {
+    'wait_text': "ожидание в текстовой полосе",
+    'wait_image': "ожидание в полосе картинок",
+    'update_text': "обработка текста целиком",
+    'update_image': "обработка картинки целиком",
+    'member_check': "проверка прав",
+    'phrase_match': "поиск фраз",
+    'near_duplicate': "поиск похожего спама",
+    'download': "скачивание файла",
+    'frames': "выбор кадров анимации и видео",
+    'decode': "декодирование картинки",
+    'tesseract': "tesseract",
+    'ocr': "OCR с очередью пула",
+    'image_match': "правила для картинок",
+    'enforce': "бан и удаление",
+}
+
+
+class Histogram:
+    """Последние замеры этапа в кольцевом буфере, общее число и сумма - за все время"""
+
+    __slots__ = ("values", "next", "count", "total")
+
+    def __init__(self):
+        self.values = array("d")
+        self.next = 0
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value, window):
+        if len(self.values) < window:
+            self.values.append(value)
+        else:
+            self.values[self.next] = value
+            self.next = (self.next + 1) % window
+        self.count += 1
+        self.total += value
+
+    def merge(self, values, count, total, window):
+        """Замеры другого процесса: values - последние из них, count и total - за все время"""
+        for value in values:
+            self.observe(value, window)
+        self.count += count - len(values)
+        self.total += total - sum(values)
+
+    def quantiles(self, points=QUANTILES):
+        """Перцентили по последним замерам (метод ближайшего ранга)"""
+        ordered = sorted(self.values)
+        if not ordered:
+            return [0.0 for _ in points]
+        return [ordered[min(len(ordered) - 1, int(point * len(ordered)))] for point in points]
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    Время этапов модерации и счетчики в памяти процесса.
+    При выключенном сборе таймер - общий пустой объект, а запись сразу возвращается.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED, window=METRICS_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.started = time.time()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = {}
+        self._server = None
+        # Замеры с прошлой передачи в другой процесс: этап -> [значения, число, сумма]
+        # (None - замеры никуда не передаются)
+        self._exported = None
+
+    def timer(self, stage):
+        """Контекстный менеджер, замеряющий время этапа"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = self._histograms[stage] = Histogram()
+        histogram.observe(seconds, self.window)
+        if self._exported is not None:
+            item = self._exported.get(stage)
+            if item is None:
+                item = self._exported[stage] = [[], 0, 0.0]
+            if len(item[0]) < self.window:
+                item[0].append(seconds)
+            item[1] += 1
+            item[2] += seconds
+
+    def increment(self, name, value=1):
+        if not self.enabled:
+            return
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def enable_export(self):
+        """Копить новые замеры для передачи в другой процесс (процесс-обработчик в режиме шардов)"""
+        if self._exported is None:
+            self._exported = {}
+
+    def take_exported(self):
+        """Замеры с прошлого вызова: {этап: (значения, число, сумма)}"""
+        if self._exported is None:
+            return {}
+        exported, self._exported = self._exported, {}
+        return {stage: tuple(item) for stage, item in exported.items()}
+
+    def merge(self, exported):
+        """Добавляет замеры, полученные от другого процесса (результат take_exported)"""
+        if not self.enabled:
+            return
+        for stage, (values, count, total) in exported.items():
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.merge(values, count, total, self.window)
+
+    def register_collector(self, name, collect):
+        """Источник текущих значений (статистика кэшей, очередей): функция, возвращающая dict"""
+        self._collectors[name] = collect
+
+    def snapshot(self):
+        """Текущее состояние: перцентили этапов, счетчики и значения источников"""
+        stages = {}
+        for stage, histogram in list(self._histograms.items()):
+            stages[stage] = {
+                'count': histogram.count,
+                'sum': histogram.total,
+                'quantiles': dict(zip(QUANTILES, histogram.quantiles())),
+            }
+        collected = {}
+        for name, collect in list(self._collectors.items()):
+            try:
+                collected[name] = collect()
+            except Exception as e:
+                logging.error(f"Ошибка сбора статистики {name}: {e}")
+        return {
+            'uptime': time.time() - self.started,
+            'stages': stages,
+            'counters': dict(self._counters),
+            'collectors': collected,
+        }
+
+    def render_text(self):
+        """Отчет для команды /stats"""
+        snapshot = self.snapshot()
+        uptime = int(snapshot['uptime'])
+        lines = [f"📊 Статистика за {uptime // 3600} ч {uptime % 3600 // 60} мин"]
+        if not self.enabled:
+            lines.append("Замер этапов отключен (METRICS_ENABLED=0)")
+        if snapshot['stages']:
+            lines.append("\n⏱ Этапы, мс (p50 / p95 / p99, число замеров):")
+            for stage, data in sorted(snapshot['stages'].items()):
+                p50, p95, p99 = (data['quantiles'][q] * 1000 for q in QUANTILES)
+                title = STAGE_TITLES.get(stage, stage)
+                lines.append(f"• {title}: {p50:.2f} / {p95:.2f} / {p99:.2f} ({data['count']})")
+        if snapshot['counters']:
+            lines.append("\n🔢 Счетчики:")
+            for name, value in sorted(snapshot['counters'].items()):
+                lines.append(f"• {name}: {value}")
+        for name, values in snapshot['collectors'].items():
+            lines.append(f"\n📦 {name}:")
+            for key, value in values.items():
+                if isinstance(value, float):
+                    value = f"{value:.3f}"
+                lines.append(f"• {key}: {value}")
+        return "\n".join(lines)
+
+    def render_prometheus(self):
+        """Отчет в текстовом формате Prometheus"""
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE moderator_uptime_seconds gauge",
+            f"moderator_uptime_seconds {snapshot['uptime']:.0f}",
+            "# TYPE moderator_stage_seconds summary",
+        ]
+        for stage, data in sorted(snapshot['stages'].items()):
+            for quantile, value in data['quantiles'].items():
+                lines.append(f'moderator_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.6f}')
+            lines.append(f'moderator_stage_seconds_sum{{stage="{stage}"}} {data["sum"]:.6f}')
+            lines.append(f'moderator_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE moderator_{name}_total counter")
+            lines.append(f"moderator_{name}_total {value}")
+        for collector, values in snapshot['collectors'].items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE moderator_{collector}_{key} gauge")
+                    lines.append(f"moderator_{collector}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, host=METRICS_HOST, port=METRICS_PORT):
+        """Запускает HTTP-эндпоинт /metrics в отдельном потоке (если задан порт)"""
+        if not port or self._server is not None:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logging.error(f"Не удалось запустить эндпоинт метрик на {host}:{port}: {e}")
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info(f"Метрики Prometheus: http://{host}:{self._server.server_address[1]}/metrics")
+
+    def stop_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Общие метрики на процесс
+metrics = Metrics()
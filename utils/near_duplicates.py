@@ -0,0 +1,217 @@
+import os
+import time
+from collections import OrderedDict, namedtuple
+from utils.normalization import normalize_text
+
+# Поиск измененных копий недавно удаленного спама (выключается значением 0)
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "1") == "1"
+# Минимальное оценочное сходство (коэффициент Жаккара по 5-граммам символов)
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.5"))
+# Короткие тексты ("всем привет") не запоминаются и не проверяются
+NEAR_DUP_MIN_LENGTH = int(os.getenv("NEAR_DUP_MIN_LENGTH", "40"))
+# Сколько отпечатков хранить; самые давно не встречавшиеся вытесняются
+NEAR_DUP_MAX_SIZE = int(os.getenv("NEAR_DUP_MAX_SIZE", "5000"))
+# Через сколько секунд без повторов отпечаток забывается (по умолчанию сутки)
+NEAR_DUP_TTL = float(os.getenv("NEAR_DUP_TTL", str(24 * 3600)))
+
+SHINGLE_SIZE = 5
+# MinHash с одной хэш-функцией: 64 корзины по младшим битам хэша
+SIGNATURE_BINS = 64
+BIN_BITS = 6
+# LSH: 16 полос по 4 корзины. Кандидат находится с вероятностью 1 - (1 - s^4)^16:
+# ~0.64 при сходстве 0.5, ~0.89 при 0.6 и почти 1 при 0.8; непохожие тексты
+# почти не попадают в кандидаты, поэтому проверка занимает доли миллисекунды
+BAND_ROWS = 4
+HASH_MASK = (1 << 64) - 1
+EMPTY_BIN = HASH_MASK
+# Отпечатки, почти совпадающие с уже сохраненным, не добавляются повторно
+SAME_SIMILARITY = 0.9
+
+# Найденный похожий текст: оценка сходства, чат, где он был удален, его возраст в секундах
+# и ищется ли он во всех чатах (удален по общему списку) или только в своем
+NearDuplicate = namedtuple("NearDuplicate", ["similarity", "chat_id", "age", "shared"])
+
+
+def minhash_signature(normalized):
+    """
+    Сигнатура MinHash нормализованного текста за один проход по шинглам
+    (one permutation hashing с заполнением пустых корзин соседними).
+    """
+    bins = [EMPTY_BIN] * SIGNATURE_BINS
+    mask = SIGNATURE_BINS - 1
+    for i in range(len(normalized) - SHINGLE_SIZE + 1):
+        h = hash(normalized[i:i + SHINGLE_SIZE]) & HASH_MASK
+        index = h & mask
+        value = h >> BIN_BITS
+        if value < bins[index]:
+            bins[index] = value
+
+    filled = [i for i, value in enumerate(bins) if value != EMPTY_BIN]
+    if not filled:
+        return None
+    if len(filled) < SIGNATURE_BINS:
+        # Пустая корзина берет значение ближайшей заполненной справа со сдвигом на расстояние,
+        # так у похожих текстов пустые корзины совпадают примерно так же часто, как заполненные
+        result = list(bins)
+        for i in range(SIGNATURE_BINS):
+            if bins[i] == EMPTY_BIN:
+                distance = 1
+                while bins[(i + distance) & mask] == EMPTY_BIN:
+                    distance += 1
+                result[i] = bins[(i + distance) & mask] + (distance << 64)
+        bins = result
+    return tuple(bins)
+
+
+def similarity(a, b):
+    """Оценка коэффициента Жаккара по двум сигнатурам"""
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_BINS
+
+
+def _bands(signature):
+    return [(band, signature[band * BAND_ROWS:(band + 1) * BAND_ROWS])
+            for band in range(SIGNATURE_BINS // BAND_ROWS)]
+
+
+class _Fingerprint:
+    __slots__ = ("key", "signature", "chat_id", "source", "shared", "seen")
+
+    def __init__(self, key, signature, chat_id, source, shared, seen):
+        self.key = key
+        self.signature = signature
+        self.chat_id = chat_id
+        # Фраза, по которой был удален исходный текст
+        self.source = source
+        self.shared = shared
+        self.seen = seen
+
+
+class NearDuplicateIndex:
+    """
+    Отпечатки текстов недавно удаленных сообщений с поиском похожих через LSH.
+    Память ограничена числом записей, отпечаток живет, пока похожие тексты продолжают приходить.
+    Текст, удаленный по правилу отдельного чата, ищется только в этом чате.
+    Отпечаток действует, пока в списке есть фраза, по которой был удален исходный текст (см. forget).
+    """
+
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD, min_length=NEAR_DUP_MIN_LENGTH,
+                 max_size=NEAR_DUP_MAX_SIZE, ttl=NEAR_DUP_TTL, enabled=NEAR_DUP_ENABLED):
+        self.threshold = threshold
+        self.min_length = min_length
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self.checks = 0
+        self.hits = 0
+        self._entries = OrderedDict()
+        self._bands = {}
+        self._next_key = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _signature(self, text):
+        if not self.enabled or not text:
+            return None
+        normalized = normalize_text(text)
+        if len(normalized) < self.min_length:
+            return None
+        return minhash_signature(normalized)
+
+    def _remove(self, entry):
+        self._entries.pop(entry.key, None)
+        for band in _bands(entry.signature):
+            keys = self._bands.get(band)
+            if keys is not None:
+                keys.discard(entry.key)
+                if not keys:
+                    del self._bands[band]
+
+    def _expire(self, now):
+        # Записи упорядочены по времени последнего появления, устаревшие - в начале
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.seen <= self.ttl:
+                break
+            self._remove(entry)
+
+    def _best_match(self, signature, now, chat_id):
+        """Самый похожий отпечаток из видимых в чате (chat_id=None - только общие)"""
+        self._expire(now)
+        candidates = set()
+        for band in _bands(signature):
+            candidates.update(self._bands.get(band, ()))
+        best = None
+        best_similarity = 0.0
+        for key in candidates:
+            entry = self._entries[key]
+            if not entry.shared and (chat_id is None or entry.chat_id != chat_id):
+                continue
+            value = similarity(signature, entry.signature)
+            if value > best_similarity:
+                best, best_similarity = entry, value
+        return best, best_similarity
+
+    def find(self, text, chat_id):
+        """Поиск похожего удаленного текста среди видимых в чате; None, если такого нет"""
+        signature = self._signature(text)
+        if signature is None:
+            return None
+        self.checks += 1
+        now = time.monotonic()
+        entry, value = self._best_match(signature, now, chat_id)
+        if entry is None or value < self.threshold:
+            return None
+        self.hits += 1
+        age = now - entry.seen
+        # Рассылка продолжается - отпечаток живет дольше
+        entry.seen = now
+        self._entries.move_to_end(entry.key)
+        return NearDuplicate(value, entry.chat_id, age, entry.shared)
+
+    def add(self, text, chat_id, source=None, shared=True):
+        """
+        Запоминает отпечаток текста удаленного сообщения; False, если текст слишком короткий.
+        source - сработавшая фраза, shared=False - текст удален по правилу только этого чата,
+        в других чатах он не ищется.
+        """
+        signature = self._signature(text)
+        if signature is None:
+            return False
+        now = time.monotonic()
+        entry, value = self._best_match(signature, now, None if shared else chat_id)
+        if entry is not None and value >= SAME_SIMILARITY:
+            entry.seen = now
+            self._entries.move_to_end(entry.key)
+            return True
+
+        key = self._next_key
+        self._next_key += 1
+        self._entries[key] = _Fingerprint(key, signature, chat_id, source, shared, now)
+        for band in _bands(signature):
+            self._bands.setdefault(band, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries.values())))
+        return True
+
+    def forget(self, is_active):
+        """
+        Удаляет отпечатки, чья фраза больше не действует: is_active(фраза, chat_id) -> bool.
+        Вызывается при изменении списка фраз, возвращает число удаленных отпечатков.
+        """
+        removed = [entry for entry in self._entries.values()
+                   if entry.source is not None and not is_active(entry.source, entry.chat_id)]
+        for entry in removed:
+            self._remove(entry)
+        return len(removed)
+
+    def stats(self):
+        return {
+            'fingerprints': len(self._entries),
+            'checks': self.checks,
+            'hits': self.hits,
+        }
+
+
+# Общий индекс на процесс
+near_duplicates = NearDuplicateIndex()
@@ -0,0 +1,72 @@
+import re
+import unicodedata
+
+# Похожие по начертанию символы латиницы и греческого алфавита приводятся к кириллице
+# (и наоборот для кириллических букв, у которых двойник есть только в латинице).
+# Таблица применяется после lower(), поэтому заглавные буквы не нужны. Только настоящие
+# двойники: буквы, лишь отдаленно похожие (r и г, n и п, u и и), превращали бы обычный
+# английский текст в кириллицу и давали ложные срабатывания.
+CONFUSABLES = {
+    # Латиница
+    "a": "а", "c": "с", "e": "е", "k": "к", "m": "м", "o": "о", "p": "р", "t": "т",
+    "x": "х", "y": "у",
+    # Греческий
+    "α": "а", "γ": "у", "ε": "е", "ι": "i", "κ": "к", "ν": "v", "ο": "о", "π": "п",
+    "ρ": "р", "τ": "т", "χ": "х", "ς": "с",
+    # Кириллица, совпадающая с латиницей, и варианты букв
+    "і": "i", "ј": "j", "ѕ": "s", "ё": "е", "ԁ": "d", "ԛ": "q", "ԝ": "w",
+}
+
+# Символы нулевой ширины разделяют слова, как пробел
+ZERO_WIDTH = ("\u200b", "\u200c", "\u200d", "\u2060", "\ufeff")
+
+# Повторы одного символа (кроме цифр) схлопываются: "прииивеет" -> "привет"
+REPEATS_RE = re.compile(r"(\D)\1+")
+# Знаки препинания и символы (подряд идущие)
+PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+
+
+def _build_table():
+    """Таблица для str.translate: двойники, удаление невидимых символов, пробелы"""
+    table = {}
+    # Достаточно основной плоскости Unicode, остальные символы остаются как есть
+    for code in range(0x10000):
+        category = unicodedata.category(chr(code))
+        if category in ("Cf", "Mn", "Me"):
+            # Невидимые символы (мягкий перенос, направление текста), комбинируемые знаки
+            table[code] = None
+        elif category[0] == "Z" or category == "Cc":
+            # Пробелы любой ширины, переводы строк и управляющие символы
+            table[code] = " "
+    for char in ZERO_WIDTH:
+        table[ord(char)] = " "
+    for source, target in CONFUSABLES.items():
+        table[ord(source)] = target
+    return table
+
+
+TRANSLATE_TABLE = _build_table()
+
+
+def _separate(match):
+    """
+    Знаки на границе слова (с пробелом или краем текста с одной из сторон) становятся
+    пробелом, между буквами и цифрами остаются частью слова: "t.me", "в/у", "8-800"
+    """
+    text = match.string
+    start, end = match.span()
+    if start and end < len(text) and not text[start - 1].isspace() and not text[end].isspace():
+        return match.group()
+    return " "
+
+
+def normalize_text(text):
+    """
+    Приводит текст к каноническому виду для поиска запрещенных фраз:
+    NFKC, нижний регистр, замена двойников, удаление невидимых символов,
+    пробелы и знаки препинания между словами в пробел, схлопывание повторов.
+    Применяется одинаково к сообщениям и к фразам из списков.
+    """
+    text = unicodedata.normalize("NFKC", text).lower().translate(TRANSLATE_TABLE)
+    text = PUNCTUATION_RE.sub(_separate, text)
+    return REPEATS_RE.sub(r"\1", text).strip()
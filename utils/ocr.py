@@ -0,0 +1,301 @@
+import io
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps
+from utils.media_frames import extract_frames, MEDIA_CPU_SECONDS
+from utils.risk import PrioritySlots
+from utils.ocr_engine import create_engine, OCR_ENGINE
+from config import TESSERACT_PATH
+
+# Количество процессов для распознавания текста
+OCR_WORKERS = max(1, int(os.getenv("OCR_WORKERS", "2")))
+# Сколько картинок может ждать своей очереди сверх занятых процессов
+OCR_QUEUE_SIZE = max(0, int(os.getenv("OCR_QUEUE_SIZE", "8")))
+# Максимальное время распознавания одной картинки, секунд
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "20"))
+# Что делать, когда очередь заполнена:
+#   drop    - пропустить проверку картинки (подпись проверяется как обычно)
+#   defer   - дождаться свободного места в очереди (не дольше OCR_TIMEOUT)
+#   caption - если есть подпись, проверить только ее, иначе ждать как defer
+OCR_OVERLOAD_POLICY = os.getenv("OCR_OVERLOAD_POLICY", "caption").lower()
+OCR_LANG = "rus+eng"
+
+# Первый уровень - наименьший размер фото, у которого длинная сторона не меньше этой
+OCR_LOW_TIER_SIDE = int(os.getenv("OCR_LOW_TIER_SIDE", "800"))
+# Больше этого размера картинка уменьшается еще при декодировании
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2560"))
+# Картинки с большим числом пикселей не распознаются (проверяется по заголовку, до декодирования;
+# для JPEG - по размеру после уменьшения в декодере)
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(25 * 1000 * 1000)))
+# Ниже этих порогов результат первого уровня считается ненадежным
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "12"))
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "60"))
+
+# Распознанный текст, средняя уверенность tesseract по словам (0-100)
+# и время декодирования картинки и работы tesseract в процессе пула, секунд;
+# engine - каким движком распознано (см. utils.ocr_engine)
+OcrResult = namedtuple("OcrResult", ["text", "confidence", "decode_time", "tesseract_time", "engine"],
+                       defaults=(0.0, 0.0, ""))
+
+# Движок распознавания процесса пула (создается один раз на процесс)
+_engine = None
+
+
+class OcrOverloaded(Exception):
+    """Очередь на распознавание заполнена"""
+
+
+def _init_worker(tesseract_cmd, engine_name=OCR_ENGINE):
+    """
+    Инициализация процесса-исполнителя (нужна и при spawn на Windows):
+    движок и его модели загружаются до первой картинки
+    """
+    global _engine
+    _engine = create_engine(engine_name, OCR_LANG, tesseract_cmd)
+
+
+def _get_engine():
+    # Вне пула (например, в замерах) движок создается при первом распознавании
+    if _engine is None:
+        _init_worker(TESSERACT_PATH)
+    return _engine
+
+
+def select_photo_tiers(photo):
+    """
+    Уровни распознавания для фото: сначала средний размер, затем самый большой.
+    photo - список PhotoSize из сообщения (по возрастанию размера).
+    """
+    largest = photo[-1]
+    for size in photo:
+        if max(size.width, size.height) >= OCR_LOW_TIER_SIDE:
+            if size.file_unique_id != largest.file_unique_id:
+                return [size, largest]
+            break
+    return [largest]
+
+
+def is_confident(result):
+    """Достаточно ли текста и уверенности, чтобы не переходить к следующему уровню"""
+    return (len(result.text.strip()) >= OCR_MIN_TEXT_CHARS
+            and result.confidence >= OCR_MIN_CONFIDENCE)
+
+
+def _otsu_threshold(histogram):
+    """Порог бинаризации по методу Оцу для гистограммы изображения в оттенках серого"""
+    total = sum(histogram)
+    sum_total = sum(value * count for value, count in enumerate(histogram))
+    sum_background = 0
+    weight_background = 0
+    best_threshold = 127
+    best_variance = 0.0
+    for value, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += value * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_total - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = value
+    return best_threshold
+
+
+def draft_image(image, max_side=OCR_MAX_SIDE):
+    """
+    Для JPEG декодер сразу уменьшает картинку (в 2, 4 или 8 раз), полный кадр
+    не разворачивается. Возвращает размер, который получится после декодирования.
+    """
+    # Декодер уменьшает, пока обе стороны не меньше запрошенных, поэтому запрашиваем
+    # размер с теми же пропорциями, что и после thumbnail в preprocess_image
+    width, height = image.size
+    ratio = min(1.0, max_side / max(width, height))
+    image.draft("L", (max(1, int(width * ratio)), max(1, int(height * ratio))))
+    return image.size
+
+
+def preprocess_image(image, max_side=OCR_MAX_SIDE):
+    """Оттенки серого, нормализация контраста и бинаризация перед OCR"""
+    draft_image(image, max_side)
+    image = image.convert("L")
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side))
+    image = ImageOps.autocontrast(image, cutoff=1)
+    histogram = image.histogram()
+    threshold = _otsu_threshold(histogram)
+    # Светлый текст на темном фоне переворачиваем: tesseract лучше читает темный текст
+    if sum(histogram[:threshold + 1]) > sum(histogram[threshold + 1:]):
+        image = ImageOps.invert(image)
+        threshold = 255 - threshold
+    return image.point(lambda value: 255 if value > threshold else 0)
+
+
+def _recognize(image_data, lang, timeout, preprocess=True):
+    """Распознавание текста в отдельном процессе"""
+    try:
+        started = time.perf_counter()
+        image = Image.open(io.BytesIO(image_data))
+        width, height = draft_image(image) if preprocess else image.size
+        if width * height > OCR_MAX_PIXELS:
+            raise ValueError(f"слишком большое разрешение {width}x{height}")
+        if preprocess:
+            image = preprocess_image(image)
+        else:
+            image.load()
+        engine = _get_engine()
+        decoded = time.perf_counter()
+        data = engine.image_to_data(image, lang, timeout)
+        finished = time.perf_counter()
+    except Exception as e:
+        # Не все исключения pytesseract и tesserocr переживают передачу между процессами,
+        # а ошибка распаковки ломает весь пул
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+    # Собираем строки текста и среднюю уверенность по распознанным словам
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        word = word.strip()
+        if not word:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        confidence = float(data["conf"][i])
+        if confidence >= 0:
+            confidences.append(confidence)
+    text = "\n".join(" ".join(words) for words in lines.values())
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return OcrResult(text, confidence, decoded - started, finished - decoded, engine.name)
+
+
+class OcrPool:
+    """Пул процессов для OCR с ограниченной очередью, таймаутом и отменой"""
+
+    def __init__(self, workers=OCR_WORKERS, queue_size=OCR_QUEUE_SIZE, timeout=OCR_TIMEOUT):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.timeout = timeout
+        self._executor = None
+        self._slots = None
+        # Сколько раз пул пересоздавался после гибели процесса
+        self.restarts = 0
+        # Движок, которым распознана последняя картинка (auto может откатиться на pytesseract)
+        self.engine = None
+
+    def _get_executor(self):
+        # Процессы создаются при первой картинке, а не при импорте модуля
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(TESSERACT_PATH, OCR_ENGINE),
+            )
+        return self._executor
+
+    async def _run(self, timeout, func, *args):
+        """
+        Выполнение в процессе пула. Если процесс погиб (нехватка памяти, падение в
+        libtesseract), пул сломан навсегда: он закрывается и создается заново при следующем вызове.
+        """
+        executor = self._get_executor()
+        try:
+            job = executor.submit(func, *args)
+        except BrokenProcessPool:
+            # Пул сломался раньше, задание не запускалось: отправляем его в новый пул
+            self._drop_executor(executor)
+            executor = self._get_executor()
+            job = executor.submit(func, *args)
+        future = asyncio.wrap_future(job)
+        try:
+            # shield: таймаут и отмена прерывают только ожидание, а не само задание
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BrokenProcessPool:
+            # Картинку, на которой погиб процесс, повторно не распознаем
+            self._drop_executor(executor)
+            raise
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Еще не начатое задание снимается из очереди пула. Начатое остановить нельзя,
+            # поэтому место в очереди держим, пока процесс не освободится: время задания
+            # ограничено в самом процессе (таймаут tesseract, лимит процессорного времени ffmpeg)
+            if not job.cancel():
+                with contextlib.suppress(Exception):
+                    await future
+            raise
+
+    def _drop_executor(self, executor):
+        # Одновременно сломанные задания пересоздают пул один раз
+        if self._executor is executor:
+            self._executor = None
+            self.restarts += 1
+            executor.shutdown(wait=False, cancel_futures=True)
+            logging.error("Процесс OCR завершился аварийно, пул процессов будет создан заново")
+
+    def _get_slots(self):
+        # Места в очереди отдаются в первую очередь картинкам с высокой оценкой риска
+        if self._slots is None:
+            self._slots = PrioritySlots(self.capacity)
+        return self._slots
+
+    def is_full(self):
+        return self._get_slots().locked()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, wait=False, priority=0.0, timeout=None):
+        """
+        Занимает место в очереди на время скачивания и распознавания.
+        Без wait при заполненной очереди сразу выбрасывает OcrOverloaded.
+        priority - оценка риска 0..1, timeout - сколько ждать места (по умолчанию OCR_TIMEOUT).
+        """
+        slots = self._get_slots()
+        if not wait and slots.locked():
+            raise OcrOverloaded()
+        try:
+            await asyncio.wait_for(slots.acquire(priority), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise OcrOverloaded()
+        try:
+            yield
+        finally:
+            slots.release()
+
+    async def recognize(self, image_data, lang=OCR_LANG, preprocess=True):
+        """Распознает текст в байтах изображения, не блокируя цикл событий (OcrResult)"""
+        # Небольшой запас сверх таймаута tesseract на передачу данных между процессами
+        result = await self._run(self.timeout + 5, _recognize, image_data, lang, self.timeout, preprocess)
+        self.engine = result.engine
+        return result
+
+    async def extract_frames(self, data, mode, duration=None):
+        """Разные кадры анимации или видео для распознавания (список PNG), в процессе пула"""
+        # Время разбора ограничено в самом процессе, здесь - запас на запуск ffmpeg и передачу кадров
+        return await self._run(MEDIA_CPU_SECONDS * 2 + 10, extract_frames, data, mode, duration)
+
+    def stats(self):
+        slots = self._get_slots()
+        return {
+            'engine': self.engine or OCR_ENGINE,
+            'workers': self.workers,
+            'busy': slots.busy,
+            'waiting': slots.waiting,
+            'restarts': self.restarts,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Общий пул на процесс
+ocr_pool = OcrPool()
@@ -0,0 +1,156 @@
+import os
+import time
+import logging
+import sqlite3
+from collections import OrderedDict
+from PIL import Image
+
+# Сколько распознанных картинок держать в памяти и на диске
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "10000"))
+# Время жизни записи, секунд (по умолчанию неделя)
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", str(7 * 24 * 3600)))
+# Файл для хранения кэша между перезапусками (пустая строка - только в памяти)
+OCR_CACHE_FILE = os.getenv("OCR_CACHE_FILE", "ocr_cache.sqlite3")
+HASH_SIZE = 8
+
+
+def dhash_image(image, size=HASH_SIZE):
+    """
+    Разностный перцептивный хэш (dHash) открытой картинки, например кадра анимации.
+    Для поиска копий в кэше не годится: не различает разный текст на похожем фоне.
+    """
+    image = image.convert("L").resize((size + 1, size), Image.BILINEAR)
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class OcrCacheEntry:
+    """Распознанный текст картинки и вердикт для конкретной версии списка правил"""
+
+    __slots__ = ("key", "text", "created", "verdict", "verdict_version")
+
+    def __init__(self, key, text, created):
+        self.key = key
+        self.text = text
+        self.created = created
+        self.verdict = None
+        self.verdict_version = None
+
+    def get_verdict(self, snapshot):
+        """
+        Возвращает сработавшее правило (или None) для снимка списка правил.
+        При смене версии списка (или другом наборе правил чата) вердикт пересчитывается
+        по сохраненному тексту без OCR.
+        """
+        if self.verdict_version != snapshot.version:
+            self.verdict = snapshot.matcher.search(self.text)
+            self.verdict_version = snapshot.version
+        return self.verdict
+
+
+class OcrCache:
+    """
+    LRU-кэш результатов OCR с ограничением по времени жизни. Ключ - file_unique_id Telegram:
+    пересланная картинка находится, а загруженная заново или пережатая распознается снова.
+    """
+
+    def __init__(self, path=OCR_CACHE_FILE, max_size=OCR_CACHE_SIZE, ttl=OCR_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._puts_since_trim = 0
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                    "key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)"
+                )
+                self._load()
+            except sqlite3.Error as e:
+                logging.error(f"Не удалось открыть кэш OCR {path}: {e}")
+                self._db = None
+
+    def _load(self):
+        """Загрузка свежих записей с диска, устаревшие удаляются"""
+        expire_before = time.time() - self.ttl
+        with self._db:
+            self._db.execute("DELETE FROM ocr_cache WHERE created < ?", (expire_before,))
+        rows = self._db.execute(
+            "SELECT key, text, created FROM ocr_cache ORDER BY created DESC LIMIT ?",
+            (self.max_size,),
+        ).fetchall()
+        for key, text, created in reversed(rows):
+            self._insert(OcrCacheEntry(key, text, created))
+        logging.info(f"Кэш OCR: загружено {len(rows)} записей")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _insert(self, entry):
+        self._entries.pop(entry.key, None)
+        self._entries[entry.key] = entry
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _is_expired(self, entry):
+        return time.time() - entry.created > self.ttl
+
+    def get(self, key):
+        """Поиск по file_unique_id"""
+        entry = self._entries.get(key)
+        if entry is None or self._is_expired(entry):
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, text):
+        """Сохранение распознанного текста в памяти и на диске"""
+        entry = OcrCacheEntry(key, text, time.time())
+        self._insert(entry)
+        if self._db is not None:
+            try:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO ocr_cache (key, text, created) VALUES (?, ?, ?)",
+                        (key, text, entry.created),
+                    )
+                    # Держим файл в пределах размера кэша, подрезая его пачками
+                    self._puts_since_trim += 1
+                    if self._puts_since_trim >= max(1, self.max_size // 10):
+                        self._puts_since_trim = 0
+                        self._db.execute(
+                            "DELETE FROM ocr_cache WHERE key NOT IN "
+                            "(SELECT key FROM ocr_cache ORDER BY created DESC LIMIT ?)",
+                            (self.max_size,),
+                        )
+            except sqlite3.Error as e:
+                logging.error(f"Ошибка записи в кэш OCR: {e}")
+        return entry
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+# Общий кэш на процесс
+ocr_cache = OcrCache()
@@ -0,0 +1,126 @@
+import os
+import pytesseract
+
+# Движок распознавания в процессах пула OCR:
+#   auto        - tesserocr, если он установлен и модели загружаются, иначе pytesseract
+#   tesserocr   - libtesseract внутри процесса: модели загружаются один раз на процесс,
+#                 картинка передается пикселями без временного файла
+#   pytesseract - отдельный процесс tesseract на каждую картинку
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+# Папка с моделями (tessdata) для tesserocr; по умолчанию - та, с которой собран tesserocr
+OCR_TESSDATA = os.getenv("OCR_TESSDATA")
+# Разрешение картинки для tesserocr, если в файле его нет (как у tesseract из командной строки)
+OCR_DEFAULT_DPI = 70
+
+ENGINE_PYTESSERACT = "pytesseract"
+ENGINE_TESSEROCR = "tesserocr"
+
+
+class PytesseractEngine:
+    """Запуск программы tesseract на каждую картинку (картинка передается через временный файл)"""
+
+    name = ENGINE_PYTESSERACT
+
+    def __init__(self, tesseract_cmd=None):
+        if tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+    def image_to_data(self, image, lang, timeout):
+        """Слова с номерами блока, абзаца, строки и уверенностью (формат pytesseract.Output.DICT)"""
+        # timeout в pytesseract завершает зависший процесс tesseract
+        return pytesseract.image_to_data(image, lang=lang, timeout=timeout,
+                                         output_type=pytesseract.Output.DICT)
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """
+    Постоянный экземпляр libtesseract в процессе (через tesserocr). Для каждого набора
+    языков модели загружаются один раз, дальше на картинку уходит только распознавание.
+    """
+
+    name = ENGINE_TESSEROCR
+
+    def __init__(self, lang, tessdata=OCR_TESSDATA):
+        # Несколько процессов пула и так занимают все ядра, потоки OpenMP внутри
+        # каждого только мешают друг другу (переменная читается при загрузке библиотеки)
+        os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.tessdata = tessdata
+        self._apis = {}
+        # Модели загружаются сразу при запуске процесса, а не на первой картинке
+        self._get_api(lang)
+
+    def _get_api(self, lang):
+        api = self._apis.get(lang)
+        if api is None:
+            kwargs = {'lang': lang, 'psm': self._tesserocr.PSM.AUTO}
+            if self.tessdata:
+                kwargs['path'] = self.tessdata
+            # Без моделей для lang выбрасывает RuntimeError
+            api = self._tesserocr.PyTessBaseAPI(**kwargs)
+            self._apis[lang] = api
+        return api
+
+    def image_to_data(self, image, lang, timeout):
+        """Слова с номерами блока, абзаца, строки и уверенностью (формат pytesseract.Output.DICT)"""
+        RIL = self._tesserocr.RIL
+        api = self._get_api(lang)
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        bytes_per_pixel = 1 if image.mode == "L" else 3
+        data = {'text': [], 'conf': [], 'block_num': [], 'par_num': [], 'line_num': []}
+        try:
+            # Пиксели передаются напрямую, без кодирования в PNG
+            api.SetImageBytes(image.tobytes(), image.width, image.height,
+                              bytes_per_pixel, image.width * bytes_per_pixel)
+            dpi = image.info.get("dpi")
+            api.SetSourceResolution(int(dpi[0]) if dpi and dpi[0] else OCR_DEFAULT_DPI)
+            if not api.Recognize(int(timeout * 1000)):
+                raise RuntimeError(f"распознавание прервано (таймаут {timeout} с)")
+            iterator = api.GetIterator()
+            if iterator is None or iterator.Empty(RIL.WORD):
+                return data
+            block = paragraph = line = 0
+            while True:
+                if iterator.IsAtBeginningOf(RIL.BLOCK):
+                    block += 1
+                    paragraph = line = 0
+                if iterator.IsAtBeginningOf(RIL.PARA):
+                    paragraph += 1
+                    line = 0
+                if iterator.IsAtBeginningOf(RIL.TEXTLINE):
+                    line += 1
+                data['text'].append(iterator.GetUTF8Text(RIL.WORD) or "")
+                data['conf'].append(iterator.Confidence(RIL.WORD))
+                data['block_num'].append(block)
+                data['par_num'].append(paragraph)
+                data['line_num'].append(line)
+                if not iterator.Next(RIL.WORD):
+                    break
+            return data
+        finally:
+            # Картинка и результаты освобождаются, загруженные модели остаются
+            api.Clear()
+
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis = {}
+
+
+def create_engine(name=OCR_ENGINE, lang="rus+eng", tesseract_cmd=None, strict=False):
+    """
+    Движок для процесса пула. Если tesserocr не установлен или не нашел моделей,
+    используется pytesseract; strict=True - вместо этого выбросить исключение.
+    """
+    if name in ("auto", ENGINE_TESSEROCR):
+        try:
+            return TesserocrEngine(lang)
+        except (ImportError, RuntimeError):
+            if strict:
+                raise
+    return PytesseractEngine(tesseract_cmd)
@@ -1,8 +1,60 @@
 import os
+import time
+import logging
+import threading
+from collections import namedtuple, OrderedDict
+from utils.matcher import PhraseMatcher
+from utils.image_rules import ImageRuleIndex
+from utils.normalization import normalize_text
+from utils.phrase_store import get_phrase_store, phrase_key, GLOBAL_CHAT
 from config import BANNED_PHRASES_FILE, BANNED_WORDS_IMAGE_FILE
 
+# Как часто (в секундах) проверять, не изменил ли базу фраз другой процесс
+# и не изменился ли старый текстовый список на диске
+RELOAD_CHECK_INTERVAL = float(os.getenv("PHRASES_RELOAD_INTERVAL", "2"))
+# Сколько собранных автоматов правил отдельных чатов держать в памяти
+CHAT_MATCHERS_CACHE_SIZE = int(os.getenv("CHAT_MATCHERS_CACHE_SIZE", "64"))
+
+# Неизменяемый снимок списка: читатели берут его целиком, без блокировок и копий
+# (у снимка чата phrases - только собственные фразы чата)
+PhraseSnapshot = namedtuple("PhraseSnapshot", ["version", "phrases", "matcher"])
+
+
+class CombinedMatcher:
+    """
+    Поиск по общему автомату и автомату правил чата. Общий автомат один на процесс,
+    в автомате чата - только его собственные фразы; текст нормализуется один раз.
+    """
+
+    __slots__ = ("shared", "own")
+
+    def __init__(self, shared, own):
+        self.shared = shared
+        self.own = own
+
+    def iter_matches(self, text):
+        text = normalize_text(text)
+        yield from self.shared.iter_matches(text, normalized=True)
+        yield from self.own.iter_matches(text, normalized=True)
+
+    def find_all(self, text):
+        return list(self.iter_matches(text))
+
+    def search(self, text):
+        for match in self.iter_matches(text):
+            return match
+        return None
+
+
 class PhraseManager:
-    def __init__(self, file_type="text"):
+    """
+    Список запрещенных фраз: общий для всех чатов и свои правила отдельных чатов.
+    Фразы хранятся в базе (utils.phrase_store), в памяти - словари ключ -> фраза.
+    Общий автомат один на все чаты. Для чатов со своими правилами по требованию
+    собирается автомат только из фраз чата (хранится в LRU), поиск идет по обоим.
+    """
+
+    def __init__(self, file_type="text", store=None):
         """
         file_type: "text" - для текстовых фраз, "image" - для слов на картинках
         """
@@ -11,46 +63,238 @@ class PhraseManager:
             self.phrases_file = BANNED_WORDS_IMAGE_FILE
         else:
             self.phrases_file = BANNED_PHRASES_FILE
-            
-        self.banned_phrases = self.load_banned_phrases()
+        self._store = store or get_phrase_store()
 
-    def load_banned_phrases(self):
-        """Загрузка запрещенных фраз из файла"""
-        # Создаем файл, если он не существует
-        if not os.path.exists(self.phrases_file):
-            open(self.phrases_file, 'w', encoding='utf-8').close()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._chat_versions = {}
+        self._chat_snapshots = OrderedDict()
+        self.compiled = 0
+        # Функции (file_type, chat_id), вызываемые после каждого изменения списка
+        self._subscribers = []
+        self._file_mtime = None
+        self._sync_file()
+        self._data_version = self._store.data_version()
+        self._next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+        self._load()
 
+    def _sync_file(self):
+        """
+        Перенос правок текстового файла в общий список (при первом запуске - всего файла).
+        Между проверками сравнивается только mtime; True, если список в базе изменился.
+        """
+        try:
+            mtime = os.stat(self.phrases_file).st_mtime_ns
+        except OSError:
+            # Удаленный файл ничего не удаляет из базы
+            return False
+        if mtime == self._file_mtime:
+            return False
+        self._file_mtime = mtime
         with open(self.phrases_file, 'r', encoding='utf-8') as f:
-            phrases = [line.strip() for line in f if line.strip()]
-            return phrases
-
-    def save_banned_phrases(self, phrases):
-        """Сохранение фраз в файл"""
-        with open(self.phrases_file, 'w', encoding='utf-8') as f:
-            for phrase in phrases:
-                f.write(phrase + '\n')
-        self.banned_phrases = phrases
-
-    def add_phrase(self, phrase):
-        """Добавление новой фразы"""
-        normalized_phrase = phrase.strip()
-        # Проверяем без учета регистра
-        if not any(normalized_phrase.lower() == existing.lower() 
-                   for existing in self.banned_phrases):
-            self.banned_phrases.append(normalized_phrase)
-            self.save_banned_phrases(self.banned_phrases)
-            return True
-        return False
-
-    def remove_phrase(self, phrase):
+            lines = [line.strip() for line in f if line.strip()]
+        result = self._store.sync_file(self.file_type, mtime, lines,
+                                       lambda phrase: phrase_key(self.file_type, phrase))
+        if result is None:
+            return False
+        added, removed = result
+        logging.info(f"Правки {self.phrases_file} перенесены в общий список: добавлено {added}, удалено {removed}")
+        return bool(added or removed)
+
+    def _load(self):
+        """Загрузка всех правил списка из базы"""
+        self._rulesets = self._store.load(self.file_type)
+        self._rulesets.setdefault(GLOBAL_CHAT, {})
+        self._version += 1
+        self._chat_versions = dict.fromkeys(self._rulesets, self._version)
+        self._chat_snapshots.clear()
+        self._publish_global()
+        # Список мог измениться целиком (другой процесс, правка файла)
+        self._notify(None)
+
+    def _changed(self, chat_id):
+        """Отметка об изменении правил чата (или общего списка) после записи в базу"""
+        self._version += 1
+        self._chat_versions[chat_id] = self._version
+        if chat_id == GLOBAL_CHAT:
+            # Автоматы чатов остаются: общих фраз в них нет
+            self._publish_global()
+        else:
+            self._chat_snapshots.pop(chat_id, None)
+        self._notify(chat_id)
+
+    def _notify(self, chat_id):
+        for callback in self._subscribers:
+            callback(self.file_type, chat_id)
+
+    def subscribe(self, callback):
+        """
+        Уведомления об изменениях списка (например, для рассылки другим процессам):
+        callback(file_type, chat_id), chat_id=None - список перечитан из базы целиком
+        """
+        self._subscribers.append(callback)
+
+    def _publish_global(self):
+        """Атомарная замена снимка общего списка"""
+        phrases = tuple(self._rulesets[GLOBAL_CHAT].values())
+        self.banned_phrases = list(phrases)
+        # Присваивание атрибута атомарно, читатели видят либо старый, либо новый снимок
+        self.snapshot = PhraseSnapshot((self._chat_versions[GLOBAL_CHAT], GLOBAL_CHAT),
+                                       phrases, self._compile(phrases))
+
+    def _compile(self, phrases):
+        """Текстовые фразы ищутся автоматом, правила для картинок - инвертированным индексом"""
+        self.compiled += 1
+        if self.file_type == "image":
+            return ImageRuleIndex(phrases)
+        return PhraseMatcher(phrases)
+
+    @property
+    def version(self):
+        """Номер версии списков, увеличивается при каждом изменении"""
+        return self._version
+
+    def reload_if_changed(self, force=False):
+        """
+        Перечитывает базу, если ее изменил другой процесс (импорт из командной строки)
+        или изменился текстовый файл списка.
+        Между проверками не чаще RELOAD_CHECK_INTERVAL ничего не делается.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + RELOAD_CHECK_INTERVAL
+
+        # Не ждем блокировку: если идет запись, проверим в следующий раз
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            # Запись своего соединения не меняет data_version, поэтому правка файла - отдельный признак
+            file_changed = self._sync_file()
+            data_version = self._store.data_version()
+            if data_version == self._data_version and not force and not file_changed:
+                return False
+            self._data_version = data_version
+            self._load()
+        finally:
+            self._lock.release()
+
+        logging.info(f"Список {self.file_type} изменен в базе, загружена версия {self._version}")
+        return True
+
+    def get_snapshot(self, chat_id=None):
+        """
+        Снимок правил для чата: общий список, если своих правил у чата нет,
+        иначе общий автомат вместе с автоматом правил чата.
+        """
+        self.reload_if_changed()
+        if chat_id is None or not self._rulesets.get(chat_id):
+            return self.snapshot
+        version = (self._chat_versions[GLOBAL_CHAT], self._chat_versions[chat_id], chat_id)
+        snapshot = self._chat_snapshots.get(chat_id)
+        if snapshot is not None and snapshot.version == version:
+            self._chat_snapshots.move_to_end(chat_id)
+            return snapshot
+        phrases = tuple(self._rulesets[chat_id].values())
+        if snapshot is not None and snapshot.version[1] == version[1]:
+            # Изменился только общий список: автомат чата прежний
+            own = snapshot.matcher.own
+        else:
+            own = self._compile(phrases)
+        snapshot = PhraseSnapshot(version, phrases, CombinedMatcher(self.snapshot.matcher, own))
+        self._chat_snapshots[chat_id] = snapshot
+        while len(self._chat_snapshots) > CHAT_MATCHERS_CACHE_SIZE:
+            self._chat_snapshots.popitem(last=False)
+        return snapshot
+
+    def add_phrase(self, phrase, chat_id=GLOBAL_CHAT):
+        """Добавление новой фразы в общий список или в правила чата"""
+        phrase = phrase.strip()
+        # Дубли ищутся без учета регистра и написания похожими буквами других алфавитов
+        key = phrase_key(self.file_type, phrase)
+        if not key:
+            return False
+        with self._lock:
+            if key in self._rulesets.get(chat_id, ()) or not self._store.add(self.file_type, chat_id, key, phrase):
+                return False
+            self._rulesets.setdefault(chat_id, {})[key] = phrase
+            self._changed(chat_id)
+        return True
+
+    def remove_phrase(self, phrase, chat_id=GLOBAL_CHAT):
         """Удаление фразы"""
-        for existing_phrase in self.banned_phrases:
-            if existing_phrase.lower() == phrase.strip().lower():
-                self.banned_phrases.remove(existing_phrase)
-                self.save_banned_phrases(self.banned_phrases)
-                return True  # Фраза успешно удалена
-        return False  # Фразы не было в списке
-
-    def get_phrases(self):
-        """Получение списка запрещенных фраз"""
-        return self.banned_phrases.copy()
+        key = phrase_key(self.file_type, phrase)
+        with self._lock:
+            if key not in self._rulesets.get(chat_id, ()):
+                return False  # Фразы не было в списке
+            self._store.remove(self.file_type, chat_id, key)
+            del self._rulesets[chat_id][key]
+            self._changed(chat_id)
+        return True  # Фраза успешно удалена
+
+    def import_phrases(self, phrases, chat_id=GLOBAL_CHAT, replace=False, publish=True):
+        """
+        Массовое добавление одной транзакцией (replace=True - список заменяется целиком).
+        Возвращает число новых фраз.
+        """
+        items = {}
+        for phrase in phrases:
+            phrase = phrase.strip()
+            key = phrase_key(self.file_type, phrase)
+            if key:
+                items.setdefault(key, phrase)
+        with self._lock:
+            added = self._store.add_many(self.file_type, chat_id, list(items.items()), replace)
+            if publish:
+                self._rulesets[chat_id] = dict(self._store.load_chat(self.file_type, chat_id))
+                self._changed(chat_id)
+        return added
+
+    def get_phrases(self, chat_id=GLOBAL_CHAT):
+        """Получение списка запрещенных фраз (для чата - только его собственных)"""
+        self.reload_if_changed()
+        return list(self._rulesets.get(chat_id, {}).values())
+
+    def is_global(self, phrase):
+        """Фраза (или правило для картинок) из общего списка, а не только из правил чата"""
+        return phrase_key(self.file_type, phrase) in self._rulesets[GLOBAL_CHAT]
+
+    def has_phrase(self, phrase, chat_id):
+        """Действует ли фраза в чате: она есть в общем списке или в правилах чата"""
+        key = phrase_key(self.file_type, phrase)
+        return key in self._rulesets[GLOBAL_CHAT] or key in self._rulesets.get(chat_id, ())
+
+    def get_chats(self):
+        """Чаты, у которых есть свои правила"""
+        return [chat_id for chat_id, phrases in self._rulesets.items() if chat_id != GLOBAL_CHAT and phrases]
+
+    def find_phrase(self, text, chat_id=None):
+        """Поиск первой запрещенной фразы в тексте (Match, для картинок ImageRule, или None)"""
+        return self.get_snapshot(chat_id).matcher.search(text)
+
+    def find_all_phrases(self, text, chat_id=None):
+        """Все вхождения запрещенных фраз в текст с позициями (в нормализованном тексте)"""
+        return self.get_snapshot(chat_id).matcher.find_all(text)
+
+    def stats(self):
+        return {
+            'chats': len(self.get_chats()),
+            'cached_matchers': len(self._chat_snapshots),
+            'compiled': self.compiled,
+        }
+
+
+# Общий для всего процесса реестр менеджеров фраз
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_phrase_manager(file_type="text"):
+    """Возвращает единственный в процессе PhraseManager для указанного типа списка"""
+    manager = _managers.get(file_type)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(file_type)
+            if manager is None:
+                manager = PhraseManager(file_type)
+                _managers[file_type] = manager
+    return manager
@@ -0,0 +1,202 @@
+"""
+Хранилище запрещенных фраз в SQLite.
+
+Каждая фраза - отдельная строка таблицы с уникальным ключом (список, чат, ключ),
+поэтому добавление и удаление не переписывают весь список. chat_id = 0 - общий
+для всех чатов список, остальные значения - правила отдельных чатов.
+
+Массовый импорт и экспорт из командной строки (бот подхватит изменения сам):
+    python -m utils.phrase_store export text > phrases.txt
+    python -m utils.phrase_store import image words.txt --chat -1001234567890
+
+Правки старых текстовых списков (banned_phrases.txt, banned_words_image.txt) переносятся
+в общий список: добавленные строки добавляются, удаленные - удаляются. Фразы, которых
+в файле не было (добавленные командой бота), правки файла не затрагивают.
+"""
+import os
+import sys
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+from utils.image_rules import rule_key
+from utils.normalization import normalize_text
+
+# Файл базы фраз (при первом запуске в нее переносятся старые текстовые списки)
+PHRASES_DB_FILE = os.getenv("PHRASES_DB_FILE", "phrases.sqlite3")
+
+# Общий для всех чатов список
+GLOBAL_CHAT = 0
+
+
+def phrase_key(list_name, phrase):
+    """Ключ фразы для поиска дублей: текст после нормализации, для картинок - еще и режим правила"""
+    if list_name == "image":
+        return rule_key(phrase)
+    return normalize_text(phrase)
+
+
+class PhraseStore:
+    """Фразы всех списков и чатов; ключ - нормализованная фраза (без учета регистра и двойников)"""
+
+    def __init__(self, path=PHRASES_DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS phrases ("
+                "id INTEGER PRIMARY KEY, list TEXT NOT NULL, chat_id INTEGER NOT NULL, "
+                "key TEXT NOT NULL, phrase TEXT NOT NULL, created REAL NOT NULL, "
+                "UNIQUE (list, chat_id, key))"
+            )
+            # Списки, уже перенесенные из старых текстовых файлов
+            # и время изменения последней перенесенной версии файла
+            self._db.execute("CREATE TABLE IF NOT EXISTS migrated (list TEXT PRIMARY KEY, mtime INTEGER)")
+            # Строки файла на момент последнего переноса: по ним находятся удаленные строки
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS file_phrases ("
+                "list TEXT NOT NULL, phrase TEXT NOT NULL, PRIMARY KEY (list, phrase))"
+            )
+
+    def load(self, list_name):
+        """Все фразы списка по чатам в порядке добавления: {chat_id: {ключ: фраза}}"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chat_id, key, phrase FROM phrases WHERE list = ? ORDER BY id", (list_name,)
+            ).fetchall()
+        rulesets = {}
+        for chat_id, key, phrase in rows:
+            rulesets.setdefault(chat_id, {})[key] = phrase
+        return rulesets
+
+    def sync_file(self, list_name, mtime, lines, key_func):
+        """
+        Перенос правок текстового файла в общий список. Строки, которых не было при прошлом
+        переносе, добавляются; исчезнувшие из файла - удаляются. Возвращает (добавлено, удалено)
+        или None, если эта версия файла (mtime) уже перенесена, например другим процессом.
+        """
+        lines = set(lines)
+        with self._lock, self._db:
+            row = self._db.execute("SELECT mtime FROM migrated WHERE list = ?", (list_name,)).fetchone()
+            if row is not None and row[0] == mtime:
+                return None
+            previous = {phrase for phrase, in self._db.execute(
+                "SELECT phrase FROM file_phrases WHERE list = ?", (list_name,))}
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO phrases (list, chat_id, key, phrase, created) VALUES (?, ?, ?, ?, ?)",
+                [(list_name, GLOBAL_CHAT, key, phrase, time.time())
+                 for phrase in sorted(lines - previous) for key in (key_func(phrase),) if key],
+            )
+            added = self._db.total_changes - before
+            # Строка могла измениться только в написании (регистр): такой ключ остается
+            keys = {key_func(phrase) for phrase in lines}
+            gone = {key_func(phrase) for phrase in previous - lines} - keys
+            before = self._db.total_changes
+            self._db.executemany(
+                "DELETE FROM phrases WHERE list = ? AND chat_id = ? AND key = ?",
+                [(list_name, GLOBAL_CHAT, key) for key in gone],
+            )
+            removed = self._db.total_changes - before
+            self._db.execute("DELETE FROM file_phrases WHERE list = ?", (list_name,))
+            self._db.executemany("INSERT INTO file_phrases (list, phrase) VALUES (?, ?)",
+                                 [(list_name, phrase) for phrase in lines])
+            self._db.execute("INSERT OR REPLACE INTO migrated (list, mtime) VALUES (?, ?)", (list_name, mtime))
+        return added, removed
+
+    def add(self, list_name, chat_id, key, phrase):
+        """Добавляет фразу; False, если фраза с таким ключом уже есть"""
+        return self.add_many(list_name, chat_id, [(key, phrase)]) == 1
+
+    def add_many(self, list_name, chat_id, items, replace=False):
+        """
+        Добавляет пары (ключ, фраза) одной транзакцией, возвращает число новых фраз.
+        replace=True - список чата заменяется целиком в той же транзакции.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            if replace:
+                self._db.execute("DELETE FROM phrases WHERE list = ? AND chat_id = ?", (list_name, chat_id))
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO phrases (list, chat_id, key, phrase, created) VALUES (?, ?, ?, ?, ?)",
+                [(list_name, chat_id, key, phrase, now) for key, phrase in items],
+            )
+            return self._db.total_changes - before
+
+    def remove(self, list_name, chat_id, key):
+        """Удаляет фразу по ключу; True, если она была"""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "DELETE FROM phrases WHERE list = ? AND chat_id = ? AND key = ?", (list_name, chat_id, key)
+            )
+            return cursor.rowcount > 0
+
+    def load_chat(self, list_name, chat_id=GLOBAL_CHAT):
+        """Фразы списка одного чата в порядке добавления: [(ключ, фраза)]"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT key, phrase FROM phrases WHERE list = ? AND chat_id = ? ORDER BY id", (list_name, chat_id)
+            ).fetchall()
+
+    def export(self, list_name, chat_id=GLOBAL_CHAT):
+        """Фразы списка чата в порядке добавления"""
+        return [phrase for key, phrase in self.load_chat(list_name, chat_id)]
+
+    def data_version(self):
+        """Меняется, когда базу изменило другое соединение (например, импорт из командной строки)"""
+        with self._lock:
+            return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_phrase_store():
+    """Возвращает единственное в процессе хранилище фраз"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PhraseStore()
+    return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт и экспорт списков запрещенных фраз")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("list", choices=("text", "image"), help="text - фразы, image - слова на картинках")
+    parser.add_argument("file", nargs="?", help="файл со списком (по одной фразе в строке), по умолчанию stdin/stdout")
+    parser.add_argument("--chat", type=int, default=GLOBAL_CHAT, help="id чата (по умолчанию общий список)")
+    parser.add_argument("--replace", action="store_true", help="при импорте заменить список целиком")
+    args = parser.parse_args()
+
+    store = PhraseStore()
+    if args.action == "export":
+        output = open(args.file, "w", encoding="utf-8") if args.file else sys.stdout
+        for phrase in store.export(args.list, args.chat):
+            output.write(phrase + "\n")
+        if args.file:
+            output.close()
+        return
+
+    source = open(args.file, encoding="utf-8") if args.file else sys.stdin
+    lines = [line.strip() for line in source if line.strip()]
+    if args.file:
+        source.close()
+    items = [(phrase_key(args.list, line), line) for line in lines]
+    added = store.add_many(args.list, args.chat, [(key, line) for key, line in items if key], args.replace)
+    print(f"Добавлено {added} из {len(lines)} строк")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
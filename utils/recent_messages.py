@@ -0,0 +1,79 @@
+import os
+import time
+from array import array
+from collections import OrderedDict
+
+# Сколько последних сообщений помнить для каждого пользователя в чате
+RECENT_MESSAGES_PER_USER = int(os.getenv("RECENT_MESSAGES_PER_USER", "20"))
+# Для скольких пар (чат, пользователь) хранить сообщения; самые давние вытесняются
+RECENT_MESSAGES_MAX_USERS = int(os.getenv("RECENT_MESSAGES_MAX_USERS", "20000"))
+# Сообщения старше этого (секунд) при бане не удаляются
+RECENT_MESSAGES_MAX_AGE = float(os.getenv("RECENT_MESSAGES_MAX_AGE", "3600"))
+
+
+class _MessageRing:
+    """Кольцевой буфер id сообщений и времени их получения в компактных массивах"""
+
+    __slots__ = ("ids", "times", "next", "count")
+
+    def __init__(self, size):
+        self.ids = array("q", [0]) * size
+        self.times = array("d", [0.0]) * size
+        self.next = 0
+        self.count = 0
+
+    def push(self, message_id, received_at):
+        self.ids[self.next] = message_id
+        self.times[self.next] = received_at
+        self.next = (self.next + 1) % len(self.ids)
+        self.count = min(self.count + 1, len(self.ids))
+
+    def items(self):
+        size = len(self.ids)
+        for offset in range(self.count):
+            index = (self.next - self.count + offset) % size
+            yield self.ids[index], self.times[index]
+
+
+class RecentMessages:
+    """
+    Последние сообщения каждого пользователя в каждом чате.
+    Память ограничена: фиксированный буфер на пользователя и предел числа пользователей.
+    """
+
+    def __init__(self, per_user=RECENT_MESSAGES_PER_USER, max_users=RECENT_MESSAGES_MAX_USERS,
+                 max_age=RECENT_MESSAGES_MAX_AGE):
+        self.per_user = per_user
+        self.max_users = max_users
+        self.max_age = max_age
+        self._rings = OrderedDict()
+
+    def add(self, chat_id, user_id, message_id):
+        key = (chat_id, user_id)
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = self._rings[key] = _MessageRing(self.per_user)
+            while len(self._rings) > self.max_users:
+                self._rings.popitem(last=False)
+        else:
+            self._rings.move_to_end(key)
+        ring.push(message_id, time.monotonic())
+
+    def pop(self, chat_id, user_id):
+        """Забирает id недавних сообщений пользователя и очищает его буфер"""
+        ring = self._rings.pop((chat_id, user_id), None)
+        if ring is None:
+            return []
+        oldest = time.monotonic() - self.max_age
+        return [message_id for message_id, received_at in ring.items() if received_at >= oldest]
+
+    def __len__(self):
+        return len(self._rings)
+
+    def memory_estimate(self):
+        """Примерный объем памяти под буферы, байт"""
+        return len(self._rings) * self.per_user * 16
+
+
+# Общий буфер на процесс
+recent_messages = RecentMessages()
@@ -0,0 +1,190 @@
+import os
+import re
+import time
+import heapq
+import asyncio
+import itertools
+from collections import OrderedDict
+
+# Участник считается новым столько секунд после вступления (по обновлениям chat_member)
+RISK_NEW_MEMBER_AGE = float(os.getenv("RISK_NEW_MEMBER_AGE", str(24 * 3600)))
+# Сколько сообщений без нарушений должно быть у участника, чтобы считать его постоянным
+RISK_TRUSTED_MESSAGES = int(os.getenv("RISK_TRUSTED_MESSAGES", "20"))
+# Ниже этой оценки картинка при перегрузке OCR откладывается или проверяется выборочно
+RISK_LOW_SCORE = float(os.getenv("RISK_LOW_SCORE", "0.2"))
+# От этой оценки картинка всегда ждет очереди OCR, даже при политике drop
+RISK_HIGH_SCORE = float(os.getenv("RISK_HIGH_SCORE", "0.5"))
+# На сколько секунд очереди продвигает вперед оценка 1.0 (обычная картинка пропускается
+# вперед не дольше этого, поэтому в очереди она не застревает навсегда)
+RISK_PRIORITY_SECONDS = float(os.getenv("RISK_PRIORITY_SECONDS", "30"))
+# Сколько отложенных проверок может ждать свободного OCR и сколько они ждут, секунд
+RISK_DEFER_MAX_PENDING = int(os.getenv("RISK_DEFER_MAX_PENDING", "100"))
+RISK_DEFER_TIMEOUT = float(os.getenv("RISK_DEFER_TIMEOUT", "120"))
+# Доля картинок с низким риском, которые все же проверяются, когда отложить уже некуда
+RISK_SAMPLE_RATE = float(os.getenv("RISK_SAMPLE_RATE", "0.2"))
+# Для скольких пар (чат, пользователь) и пользователей хранятся признаки
+RISK_TRACKER_SIZE = int(os.getenv("RISK_TRACKER_SIZE", "50000"))
+
+# Вклад признаков в оценку риска (сумма ограничивается диапазоном 0..1)
+WEIGHT_NEW_MEMBER = 0.35
+WEIGHT_FIRST_MESSAGE = 0.25
+WEIGHT_LINKS = 0.2
+WEIGHT_FORWARDED = 0.1
+WEIGHT_PAST_VIOLATIONS = 0.5
+WEIGHT_TRUSTED = -0.3
+
+LINK_ENTITY_TYPES = ("url", "text_link", "mention", "text_mention")
+LINK_RE = re.compile(r"https?://|t\.me/|www\.", re.IGNORECASE)
+JOINED_STATUSES = ("member", "restricted")
+LEFT_STATUSES = ("left", "kicked")
+
+
+class _Member:
+    __slots__ = ("joined_at", "messages")
+
+    def __init__(self):
+        self.joined_at = None
+        self.messages = 0
+
+
+def has_links(message):
+    """Ссылки, упоминания или кнопки со ссылками в сообщении"""
+    if message.reply_markup is not None:
+        return True
+    entities = (message.caption_entities or ()) + (message.entities or ())
+    if any(entity.type in LINK_ENTITY_TYPES for entity in entities):
+        return True
+    text = message.caption or message.text
+    return bool(text and LINK_RE.search(text))
+
+
+class RiskTracker:
+    """
+    Дешевые признаки спамера и оценка риска сообщения (0 - постоянный участник,
+    1 - только что вступил, первое сообщение со ссылкой, уже попадался).
+    Память ограничена: самые давние записи вытесняются.
+    """
+
+    def __init__(self, max_size=RISK_TRACKER_SIZE, new_member_age=RISK_NEW_MEMBER_AGE):
+        self.max_size = max_size
+        self.new_member_age = new_member_age
+        # (chat_id, user_id) -> _Member
+        self._members = OrderedDict()
+        # user_id -> число нарушений в любых чатах
+        self._violations = OrderedDict()
+        # Сколько отложенных проверок картинок сейчас ждет OCR
+        self.deferred = 0
+
+    def _member(self, chat_id, user_id):
+        key = (chat_id, user_id)
+        member = self._members.get(key)
+        if member is None:
+            member = self._members[key] = _Member()
+            while len(self._members) > self.max_size:
+                self._members.popitem(last=False)
+        else:
+            self._members.move_to_end(key)
+        return member
+
+    def record_member_update(self, chat_id, user_id, old_status, new_status):
+        """Обновление chat_member: запоминаем время вступления"""
+        if new_status in JOINED_STATUSES and old_status in LEFT_STATUSES:
+            member = self._member(chat_id, user_id)
+            member.joined_at = time.time()
+            member.messages = 0
+
+    def record_message(self, chat_id, user_id):
+        self._member(chat_id, user_id).messages += 1
+
+    def record_violation(self, user_id):
+        self._violations[user_id] = self._violations.get(user_id, 0) + 1
+        self._violations.move_to_end(user_id)
+        while len(self._violations) > self.max_size:
+            self._violations.popitem(last=False)
+
+    def score(self, chat_id, user_id, message):
+        """Оценка риска сообщения до его учета в record_message"""
+        member = self._members.get((chat_id, user_id))
+        messages = member.messages if member is not None else 0
+        score = 0.0
+        if member is not None and member.joined_at is not None:
+            if time.time() - member.joined_at < self.new_member_age:
+                score += WEIGHT_NEW_MEMBER
+        elif messages >= RISK_TRUSTED_MESSAGES:
+            score += WEIGHT_TRUSTED
+        if messages == 0:
+            score += WEIGHT_FIRST_MESSAGE
+        if has_links(message):
+            score += WEIGHT_LINKS
+        if message.forward_origin is not None:
+            score += WEIGHT_FORWARDED
+        if user_id in self._violations:
+            score += WEIGHT_PAST_VIOLATIONS
+        return min(1.0, max(0.0, score))
+
+    def stats(self):
+        return {
+            'members': len(self._members),
+            'violators': len(self._violations),
+            'deferred': self.deferred,
+        }
+
+
+class PrioritySlots:
+    """
+    Семафор, отдающий освободившееся место ожидающему с наибольшим приоритетом.
+    Приоритет (оценка риска 0..1) сдвигает время постановки в очередь на
+    priority * priority_seconds назад: рискованные сообщения идут первыми,
+    а обычные ждут не дольше priority_seconds сверх очереди.
+    """
+
+    def __init__(self, capacity, priority_seconds=RISK_PRIORITY_SECONDS):
+        self.capacity = capacity
+        self.priority_seconds = priority_seconds
+        self._free = capacity
+        self._waiters = []
+        self._order = itertools.count()
+
+    def locked(self):
+        return self._free <= 0
+
+    @property
+    def busy(self):
+        return self.capacity - self._free
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority=0.0):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        waiter = (time.monotonic() - priority * self.priority_seconds, next(self._order), future)
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Место уже было отдано, но задачу отменили: передаем его следующему
+                self.release()
+            elif waiter in self._waiters:
+                # Отмененное ожидание (таймаут, отмена задачи) убираем из очереди,
+                # чтобы waiting считал только тех, кто еще ждет
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        while self._waiters:
+            *_, future = heapq.heappop(self._waiters)
+            # Отмененные ожидания (таймаут, отмена задачи) пропускаются
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+
+# Общий на процесс
+risk_tracker = RiskTracker()
@@ -0,0 +1,421 @@
+"""
+Режим нескольких процессов: принимающий процесс получает обновления от Telegram
+и передает сообщения групп процессам-обработчикам, каждый из которых выполняет
+обычную проверку (handle_message и handle_chat_member) в своем Application.
+
+Чат закрепляется за обработчиком консистентным хешем chat_id. Принимающий процесс
+разбирает обновления по одному, а в очередь каждого обработчика их передает одна задача
+из буфера FIFO, поэтому обновления одного чата приходят в процесс в порядке получения.
+Изменения списков фраз рассылаются всем обработчикам, записи лога обработчиков пишет
+принимающий процесс. Упавший обработчик перезапускается.
+
+Кэш OCR у каждого обработчика свой: файл кэша общий, но обработчик читает его только
+при запуске и не видит записей других обработчиков.
+"""
+import os
+import time
+import queue
+import bisect
+import signal
+import asyncio
+import hashlib
+import logging
+import threading
+import multiprocessing
+from logging.handlers import QueueHandler
+from telegram import Update
+from utils.metrics import metrics
+from utils.log_pipeline import audit_logger
+from utils.phrase_manager import get_phrase_manager
+
+# Число процессов-обработчиков (0 - все в одном процессе, как раньше).
+# У каждого свой пул OCR из OCR_WORKERS процессов
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+# Сколько обновлений может ждать в очереди одного обработчика; когда она заполнена,
+# прием новых обновлений замедляется
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "500"))
+# Как часто проверять, живы ли обработчики, и получать от них счетчики, секунд
+SHARD_CHECK_INTERVAL = float(os.getenv("SHARD_CHECK_INTERVAL", "1"))
+# Наибольшая пауза перед перезапуском обработчика, который падает сразу после запуска;
+# проработавший дольше этого обработчик перезапускается без паузы
+SHARD_RESTART_MAX_DELAY = float(os.getenv("SHARD_RESTART_MAX_DELAY", "60"))
+# Сколько ждать, пока обработчики доделают очередь при остановке, секунд
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "30"))
+
+# Точек на кольце на обработчик: чем больше, тем равномернее делятся чаты
+RING_REPLICAS = 64
+# Пауза перед повторной попыткой, когда очередь обработчика заполнена, секунд
+PUT_RETRY_DELAY = 0.01
+# Очередь обработчика пуста дольше SHARD_CHECK_INTERVAL
+_IDLE = object()
+
+
+def _ring_hash(value):
+    return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Консистентное хеширование: каждый узел - несколько точек на кольце, ключ
+    принадлежит ближайшей точке по часовой стрелке. При изменении числа узлов
+    к другому узлу переходит лишь доля ключей, а не почти все, как при остатке от деления.
+    """
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = sorted((_ring_hash(f"{node}:{replica}"), node) for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, node in points]
+        self._nodes = [node for point, node in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, _ring_hash(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+class _Shard:
+    """Процесс-обработчик и его очереди (на стороне принимающего процесса)"""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.updates = None
+        self.control = None
+        # Буфер принимающего процесса и задача, передающая из него в updates по порядку
+        self.pending = None
+        self.feeder = None
+        self.routed = 0
+        # Обновления, отброшенные, пока обработчик не работал и его буфер был заполнен
+        self.dropped = 0
+        self.dropping = False
+        self.restarts = 0
+        # Сколько раз подряд процесс падал вскоре после запуска
+        self.failures = 0
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        # Процесс запустил свой Application и прислал первые счетчики
+        self.ready = False
+        # Последние счетчики metrics, присланные процессом (замеры этапов добавляются в metrics сразу)
+        self.counters = {}
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def queued(self):
+        try:
+            return self.updates.qsize() if self.updates is not None else 0
+        except NotImplementedError:
+            # qsize не поддерживается на macOS
+            return 0
+
+
+class ShardRouter:
+    """Распределение обновлений по процессам-обработчикам и присмотр за ними"""
+
+    def __init__(self, workers=SHARD_WORKERS, queue_size=SHARD_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        # spawn: обработчик не наследует соединения с базами, потоки и цикл событий родителя
+        self._context = multiprocessing.get_context("spawn")
+        self._shards = [_Shard(index) for index in range(workers)]
+        self._ring = HashRing(range(workers)) if workers else None
+        self._build = None
+        self._events = None
+        self._reader = None
+        self._loop = None
+        self._supervisor = None
+        # Обновления, оставшиеся в очередях упавших обработчиков
+        self.lost = 0
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def configure(self, build):
+        """
+        build - функция без аргументов, создающая Application обработчика.
+        Передается в новый процесс, поэтому должна определяться на уровне модуля
+        (или быть functools.partial от такой функции).
+        """
+        self._build = build
+
+    @property
+    def ready(self):
+        """Все обработчики запущены и принимают обновления"""
+        return all(shard.ready for shard in self._shards)
+
+    def shard_for(self, chat_id):
+        return self._ring.node_for(chat_id)
+
+    def start(self):
+        """Запускает обработчики (внутри работающего цикла событий)"""
+        if self._supervisor is not None:
+            return
+        loop = self._loop = asyncio.get_running_loop()
+        self._events = self._context.Queue()
+        self._reader = threading.Thread(target=self._read_events, name="shard-events", daemon=True)
+        self._reader.start()
+        for shard in self._shards:
+            self._new_queues(shard)
+            self._spawn(shard)
+            shard.pending = asyncio.Queue(self.queue_size)
+            shard.feeder = loop.create_task(self._feed(shard))
+        for file_type in ("text", "image"):
+            get_phrase_manager(file_type).subscribe(self.broadcast_reload)
+        self._supervisor = loop.create_task(self._supervise())
+        logging.info(f"Запущено обработчиков: {self.workers}")
+
+    def _new_queues(self, shard):
+        self._close_queues(shard)
+        shard.updates = self._context.Queue(self.queue_size)
+        shard.control = self._context.Queue()
+
+    @staticmethod
+    def _close_queues(shard):
+        for channel in (shard.updates, shard.control):
+            if channel is not None:
+                # Не ждем дописывания в канал, который больше никто не читает
+                channel.cancel_join_thread()
+                channel.close()
+
+    def _spawn(self, shard):
+        shard.process = self._context.Process(
+            target=run_worker,
+            name=f"shard-{shard.index}",
+            args=(shard.index, shard.updates, shard.control, self._events, self._build,
+                  logging.getLogger().getEffectiveLevel()),
+        )
+        shard.ready = False
+        shard.dropping = False
+        shard.process.start()
+        shard.started_at = time.monotonic()
+
+    async def forward(self, update: Update, context):
+        """
+        Обработчик PTB: передает обновление процессу, за которым закреплен чат.
+        Приложение вызывает его по одному обновлению, так что порядок в буфере - порядок получения.
+        Пока буфер работающего обработчика заполнен, прием следующих обновлений ждет; если обработчик
+        упал и ждет перезапуска, обновление отбрасывается, чтобы не останавливать прием для всех чатов.
+        """
+        chat = update.effective_chat
+        shard = self._shards[self.shard_for(chat.id if chat else 0)]
+        while shard.pending.full():
+            if not shard.is_alive():
+                self._drop(shard)
+                return
+            await asyncio.sleep(PUT_RETRY_DELAY)
+        shard.pending.put_nowait(update.to_dict())
+        shard.routed += 1
+
+    @staticmethod
+    def _drop(shard):
+        shard.dropped += 1
+        metrics.increment("shard_dropped")
+        if not shard.dropping:
+            shard.dropping = True
+            logging.error(f"Обработчик {shard.index} не работает, буфер заполнен: "
+                          f"обновления его чатов отбрасываются до перезапуска")
+
+    async def _feed(self, shard):
+        """Задача: обновления из буфера в очередь обработчика, строго по одному (None - остановка)"""
+        while True:
+            item = await shard.pending.get()
+            await self._put(shard, item)
+            if item is None:
+                return
+
+    async def _put(self, shard, item, deadline=None):
+        """Кладет в очередь обработчика, пока она заполнена - ждет (False, если не дождались)"""
+        while True:
+            try:
+                shard.updates.put_nowait(item)
+                return True
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                await asyncio.sleep(PUT_RETRY_DELAY)
+
+    def broadcast_reload(self, file_type, chat_id):
+        """Изменение списка фраз: обработчики перечитывают его из базы, не дожидаясь проверки"""
+        for shard in self._shards:
+            if shard.control is not None:
+                shard.control.put_nowait(file_type)
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(SHARD_CHECK_INTERVAL)
+            now = time.monotonic()
+            for shard in self._shards:
+                if shard.process is None:
+                    if now >= shard.restart_at:
+                        self._spawn(shard)
+                        shard.restarts += 1
+                        logging.info(f"Обработчик {shard.index} перезапущен")
+                elif not shard.process.is_alive():
+                    self._on_exit(shard, now)
+
+    def _on_exit(self, shard, now):
+        lost = shard.queued()
+        self.lost += lost
+        if now - shard.started_at >= SHARD_RESTART_MAX_DELAY:
+            shard.failures = 0
+        delay = min(SHARD_RESTART_MAX_DELAY, 2 ** shard.failures - 1)
+        shard.failures += 1
+        logging.error(f"Обработчик {shard.index} завершился с кодом {shard.process.exitcode}, "
+                      f"потеряно обновлений из очереди: {lost}, перезапуск через {delay:.0f} с")
+        # Процесс мог умереть, держа блокировку очереди, поэтому очереди создаются заново;
+        # новые обновления чатов этого обработчика ждут в них его перезапуска
+        shard.process = None
+        self._new_queues(shard)
+        shard.restart_at = now + delay
+
+    def _read_events(self):
+        """Поток: записи лога, счетчики и замеры этапов от обработчиков"""
+        while True:
+            try:
+                event = self._events.get()
+            except (EOFError, OSError):
+                return
+            if event is None:
+                return
+            if isinstance(event, logging.LogRecord):
+                # Запись уже отформатирована в обработчике, дальше она идет по обычным обработчикам лога
+                logging.getLogger(event.name).handle(event)
+            else:
+                index, counters, stages = event
+                self._shards[index].counters = counters
+                self._shards[index].ready = True
+                if stages:
+                    # Гистограммы metrics меняются только в цикле событий
+                    try:
+                        self._loop.call_soon_threadsafe(metrics.merge, stages)
+                    except RuntimeError:
+                        # Цикл уже закрыт
+                        pass
+
+    async def stop(self, timeout=SHARD_STOP_TIMEOUT):
+        """Останавливает обработчики: они доделывают свои очереди, зависшие завершаются принудительно"""
+        if self._supervisor is None:
+            return
+        self._supervisor.cancel()
+        self._supervisor = None
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        feeders = [shard.feeder for shard in self._shards]
+        try:
+            # None - сигнал остановки после всех уже принятых обновлений
+            for shard in self._shards:
+                await asyncio.wait_for(shard.pending.put(None), max(0.0, deadline - time.monotonic()))
+            await asyncio.wait_for(asyncio.gather(*feeders), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            logging.warning(f"Не все обновления переданы обработчикам за {timeout:.0f} с")
+        for feeder in feeders:
+            feeder.cancel()
+        for shard in self._shards:
+            if shard.process is None:
+                continue
+            await loop.run_in_executor(None, shard.process.join, max(0.0, deadline - time.monotonic()))
+            if shard.process.is_alive():
+                logging.warning(f"Обработчик {shard.index} не остановился за {timeout:.0f} с, завершаем")
+                shard.process.terminate()
+                await loop.run_in_executor(None, shard.process.join, 5)
+            shard.process = None
+            self._close_queues(shard)
+            shard.updates = shard.control = None
+        self._events.put(None)
+        await loop.run_in_executor(None, self._reader.join, 5)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'alive': sum(1 for shard in self._shards if shard.is_alive()),
+            'ready': sum(1 for shard in self._shards if shard.ready),
+            'restarts': sum(shard.restarts for shard in self._shards),
+            'routed': sum(shard.routed for shard in self._shards),
+            'queued': sum(shard.queued() for shard in self._shards),
+            'buffered': sum(shard.pending.qsize() for shard in self._shards if shard.pending is not None),
+            'lost': self.lost,
+            'dropped': sum(shard.dropped for shard in self._shards),
+        }
+
+    def worker_counters(self):
+        """Счетчики metrics всех обработчиков (сумма последних присланных значений)"""
+        totals = {}
+        for shard in self._shards:
+            for name, value in shard.counters.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+
+def run_worker(index, updates, control, events, build, log_level):
+    """Точка входа процесса-обработчика"""
+    # Остановкой по Ctrl+C управляет принимающий процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Лог и журнал модерации пишет принимающий процесс: записи уходят ему через очередь
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(events)]
+    root.setLevel(log_level)
+    audit_logger.handlers = [QueueHandler(events)]
+    # Замеры этапов уходят туда же, /stats показывает их вместе
+    metrics.enable_export()
+    try:
+        asyncio.run(_worker_loop(index, updates, control, events, build))
+    except Exception as e:
+        logging.exception(f"Обработчик {index} остановлен из-за ошибки: {e}")
+        raise SystemExit(1)
+
+
+def _next_update(updates):
+    try:
+        return updates.get(timeout=SHARD_CHECK_INTERVAL)
+    except queue.Empty:
+        return _IDLE
+
+
+def _reload_phrases(control):
+    while True:
+        try:
+            file_type = control.get_nowait()
+        except queue.Empty:
+            return
+        get_phrase_manager(file_type).reload_if_changed(force=True)
+
+
+def _report(index):
+    """Счетчики обработчика и замеры этапов с прошлого отчета"""
+    return index, metrics.snapshot()['counters'], metrics.take_exported()
+
+
+async def _worker_loop(index, updates, control, events, build):
+    parent = os.getppid()
+    loop = asyncio.get_running_loop()
+    application = build()
+    async with application:
+        await application.start()
+        logging.info(f"Обработчик {index} запущен (pid {os.getpid()})")
+        next_report = 0.0
+        try:
+            while True:
+                item = await loop.run_in_executor(None, _next_update, updates)
+                _reload_phrases(control)
+                now = time.monotonic()
+                if now >= next_report:
+                    events.put(_report(index))
+                    next_report = now + SHARD_CHECK_INTERVAL
+                if item is None:
+                    break
+                if item is _IDLE:
+                    if os.getppid() != parent:
+                        logging.warning(f"Обработчик {index}: принимающий процесс завершился, останавливаемся")
+                        break
+                    continue
+                # Очередь Application ограничена: пока обработчик занят, он не берет новые обновления
+                await application.update_queue.put(Update.de_json(item, application.bot))
+        finally:
+            await application.stop()
+            events.put(_report(index))
+    # Как в run_polling: остановка пула OCR, закрытие кэша и базы фраз
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+# Общий на процесс
+shard_router = ShardRouter()
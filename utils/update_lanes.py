@@ -0,0 +1,199 @@
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from utils.metrics import metrics
+from utils.risk import risk_tracker, PrioritySlots
+
+# Сколько дешевых обновлений (текст, подписи, команды) обрабатывается одновременно
+TEXT_LANE_CONCURRENCY = int(os.getenv("TEXT_LANE_CONCURRENCY", "32"))
+# Сколько обновлений с картинками обрабатывается одновременно
+IMAGE_LANE_CONCURRENCY = int(os.getenv("IMAGE_LANE_CONCURRENCY", "8"))
+# Ожидание в очереди дольше этого (секунд) считается отставанием и попадает в лог
+LANE_WAIT_WARNING = float(os.getenv("LANE_WAIT_WARNING", "5"))
+# Общий предел обрабатываемых обновлений; реальные ограничения задают полосы
+MAX_CONCURRENT_UPDATES = 4096
+# Сколько обновлений может быть принято в обработку (ждут полосу или обрабатываются);
+# сверх этого новые обновления остаются в очереди, а когда заполнится и она -
+# прием обновлений (long polling или ответ на webhook) приостанавливается
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "1000"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "200"))
+
+
+class Lane:
+    """Полоса обработки с ограничением параллельности и счетчиками очереди"""
+
+    def __init__(self, name, concurrency, prioritized=False):
+        self.name = name
+        self.concurrency = concurrency
+        # В полосе с приоритетом место получает обновление с наибольшей оценкой риска
+        self.prioritized = prioritized
+        self.semaphore = None
+        self.waiting = 0
+        self.active = 0
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait):
+        self.processed += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait >= LANE_WAIT_WARNING:
+            logging.warning(f"Полоса {self.name}: обновление ждало {wait:.1f} с, "
+                            f"в очереди {self.waiting}, в работе {self.active}")
+
+    def stats(self):
+        return {
+            'waiting': self.waiting,
+            'active': self.active,
+            'processed': self.processed,
+            'avg_wait': self.total_wait / self.processed if self.processed else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+def is_image_update(update):
+    """Обновления с картинками идут в отдельную полосу, т.к. их проверка долгая"""
+    if not isinstance(update, Update):
+        return False
+    message = update.effective_message
+    return bool(message and (message.photo or message.document or message.animation or message.sticker
+                             or message.video_note or message.video))
+
+
+class LaneUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений в двух полосах: быстрой для текста
+    и отдельной ограниченной для картинок. В быстрой полосе обновления
+    одного чата обрабатываются строго по порядку.
+    """
+
+    def __init__(self, text_concurrency=TEXT_LANE_CONCURRENCY, image_concurrency=IMAGE_LANE_CONCURRENCY,
+                 max_pending=MAX_PENDING_UPDATES):
+        super().__init__(MAX_CONCURRENT_UPDATES)
+        self.text_lane = Lane("text", text_concurrency)
+        self.image_lane = Lane("image", image_concurrency, prioritized=True)
+        self.max_pending = max_pending
+        self._admission = None
+        # chat_id -> [блокировка, число обновлений чата в работе]
+        self._chat_locks = {}
+
+    async def initialize(self):
+        # Семафоры создаются внутри работающего цикла событий
+        for lane in (self.text_lane, self.image_lane):
+            lane.semaphore = (PrioritySlots(lane.concurrency) if lane.prioritized
+                              else asyncio.Semaphore(lane.concurrency))
+        self._get_admission()
+
+    def _get_admission(self):
+        if self._admission is None:
+            self._admission = asyncio.Semaphore(self.max_pending)
+        return self._admission
+
+    async def admit(self):
+        """Ждет, пока число принятых в обработку обновлений станет меньше max_pending"""
+        await self._get_admission().acquire()
+
+    @property
+    def pending(self):
+        return self.text_lane.waiting + self.text_lane.active + self.image_lane.waiting + self.image_lane.active
+
+    async def shutdown(self):
+        pass
+
+    @contextlib.asynccontextmanager
+    async def _chat_order(self, chat_id):
+        """Сохраняет порядок обработки обновлений одного чата"""
+        if chat_id is None:
+            yield
+            return
+        item = self._chat_locks.get(chat_id)
+        if item is None:
+            item = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        item[1] += 1
+        try:
+            async with item[0]:
+                yield
+        finally:
+            item[1] -= 1
+            if not item[1]:
+                del self._chat_locks[chat_id]
+
+    @contextlib.asynccontextmanager
+    async def _lane_slot(self, lane, priority):
+        if lane.prioritized:
+            await lane.semaphore.acquire(priority)
+        else:
+            await lane.semaphore.acquire()
+        try:
+            yield
+        finally:
+            lane.semaphore.release()
+
+    async def do_process_update(self, update, coroutine):
+        priority = 0.0
+        if is_image_update(update):
+            # Картинки не ждут друг друга даже внутри одного чата,
+            # первыми проверяются картинки новых и подозрительных участников
+            lane = self.image_lane
+            order = self._chat_order(None)
+            if update.effective_chat and update.effective_user:
+                priority = risk_tracker.score(update.effective_chat.id, update.effective_user.id,
+                                              update.effective_message)
+        else:
+            lane = self.text_lane
+            chat = update.effective_chat if isinstance(update, Update) else None
+            order = self._chat_order(chat.id if chat else None)
+
+        queued_at = time.monotonic()
+        lane.waiting += 1
+        started = False
+        try:
+            async with order:
+                async with self._lane_slot(lane, priority):
+                    lane.waiting -= 1
+                    started = True
+                    wait = time.monotonic() - queued_at
+                    lane.record_wait(wait)
+                    metrics.observe(f"wait_{lane.name}", wait)
+                    lane.active += 1
+                    try:
+                        with metrics.timer(f"update_{lane.name}"):
+                            await coroutine
+                    finally:
+                        lane.active -= 1
+        finally:
+            if not started:
+                lane.waiting -= 1
+            self._get_admission().release()
+
+    def stats(self):
+        return {
+            'text': self.text_lane.stats(),
+            'image': self.image_lane.stats(),
+            'pending': self.pending,
+        }
+
+
+class BackpressureQueue(asyncio.Queue):
+    """
+    Ограниченная очередь обновлений Application. Следующее обновление выдается
+    только после того, как процессор готов его принять, поэтому при перегрузке
+    очередь заполняется и прием новых обновлений замедляется.
+    """
+
+    def __init__(self, processor, maxsize=UPDATE_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self._processor = processor
+
+    async def get(self):
+        await self._processor.admit()
+        return await super().get()
+
+
+# Общий обработчик обновлений на процесс
+update_processor = LaneUpdateProcessor()